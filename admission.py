@@ -0,0 +1,277 @@
+# admission.py - Control de admisión para los endpoints de chat de Fulano AI
+#
+# Bajo un pico de tráfico es mejor rechazar rápido a unos pocos que dejar que
+# la latencia se dispare para todos (y que Postgres llegue a su tope de conexiones):
+#   - token bucket por cliente (IP) y por conversación → 429 + Retry-After
+#   - límite global de requests en curso con una cola de espera acotada y un
+#     deadline; si la cola está llena o se vence el deadline → 503 + Retry-After
+#
+# Los buckets viven en memoria del proceso (InMemoryRateLimitBackend). Para
+# compartirlos entre workers/instancias, ADMISSION_BACKEND="modulo:Clase" carga
+# otra implementación de RateLimitBackend (p. ej. sobre Redis).
+
+import asyncio
+import importlib
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from fastapi import Request
+
+import metrics
+
+
+class Rejected(Exception):
+    """El request no se admite; main.py lo convierte en 429/503 con Retry-After."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+# ==========================
+# 📌 Token buckets
+# ==========================
+
+class RateLimitBackend:
+    """
+    Interfaz de los backends de rate limiting. `take` descuenta `cost` tokens del
+    bucket `key` (que se recarga a `rate` tokens/s hasta `burst`) y retorna 0 si
+    se admitió, o los segundos que faltan para que haya tokens suficientes.
+    Un costo mayor que `burst` se admite con el bucket lleno y lo deja en
+    negativo: el cliente lo paga esperando (si no, un lote grande nunca pasaría).
+    """
+
+    @classmethod
+    def from_env(cls):
+        return cls()
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        raise NotImplementedError
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Buckets en un dict acotado (LRU): un bucket expulsado vuelve lleno."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key → (tokens, última recarga)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_keys=int(os.getenv("ADMISSION_MAX_KEYS", "100000")))
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            needed = min(cost, burst)
+            if tokens >= needed:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (needed - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+def load_backend(spec: str) -> RateLimitBackend:
+    """"memory" o "modulo:Clase" (una subclase de RateLimitBackend)."""
+    if spec in ("", "memory"):
+        return InMemoryRateLimitBackend.from_env()
+    module_name, _, class_name = spec.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class.from_env()
+
+
+# ==========================
+# 📌 Límite de concurrencia
+# ==========================
+
+class ConcurrencyLimiter:
+    """
+    Como un semáforo async, pero con cola acotada y deadline: si ya hay
+    `max_queue` esperando, o el turno no llega en `queue_timeout` segundos,
+    se rechaza en vez de seguir esperando. Los turnos se entregan en orden
+    de llegada. Se usa desde un solo event loop.
+    """
+
+    def __init__(self, limit: int, max_queue: int, queue_timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.limit <= 0:
+            return
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Rejected(503, "overloaded", self.queue_timeout)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                # El turno llegó justo al vencerse el deadline: se devuelve
+                self.release()
+            else:
+                self._discard(waiter)
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            raise Rejected(503, "queue_timeout", self.queue_timeout)
+
+    def release(self):
+        if self.limit <= 0:
+            return
+        # El cupo pasa directo al siguiente en la cola (active no cambia)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+# ==========================
+# 📌 Control de admisión
+# ==========================
+
+class AdmissionController:
+    """
+    Dependencia de FastAPI para los endpoints de chat:
+        @app.post("/api/chat", dependencies=[Depends(admission_control.admit)])
+    Los límites en 0 quedan desactivados.
+    """
+
+    def __init__(
+        self,
+        backend: RateLimitBackend = None,
+        client_rate: float = 5.0,
+        client_burst: float = 20.0,
+        conversation_rate: float = 1.0,
+        conversation_burst: float = 5.0,
+        max_concurrent: int = 64,
+        max_queue: int = 128,
+        queue_timeout: float = 2.0,
+        trusted_proxy_hops: int = 1,
+    ):
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.conversation_rate = conversation_rate
+        self.conversation_burst = conversation_burst
+        self.limiter = ConcurrencyLimiter(max_concurrent, max_queue, queue_timeout)
+        self.trusted_proxy_hops = trusted_proxy_hops
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            backend=load_backend(os.getenv("ADMISSION_BACKEND", "memory").strip()),
+            client_rate=float(os.getenv("ADMISSION_CLIENT_RATE", "5")),
+            client_burst=float(os.getenv("ADMISSION_CLIENT_BURST", "20")),
+            conversation_rate=float(os.getenv("ADMISSION_CONVERSATION_RATE", "1")),
+            conversation_burst=float(os.getenv("ADMISSION_CONVERSATION_BURST", "5")),
+            max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "64")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "128")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000")) / 1000,
+            trusted_proxy_hops=int(os.getenv("ADMISSION_TRUSTED_PROXY_HOPS", "1")),
+        )
+
+    def client_key(self, request: Request) -> str:
+        """
+        IP del cliente. Detrás del proxy de Render la IP real es la que agrega
+        el último proxy en X-Forwarded-For (las de más a la izquierda las puede
+        inventar el cliente).
+        """
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded and self.trusted_proxy_hops > 0:
+            hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+            if hops:
+                return hops[-min(self.trusted_proxy_hops, len(hops))]
+        return request.client.host if request.client else "unknown"
+
+    async def _check(self, key: str, rate: float, burst: float, reason: str, cost: float = 1.0):
+        if rate <= 0:
+            return
+        wait = await self.backend.take(key, rate, burst, cost=cost)
+        if wait > 0:
+            raise Rejected(429, reason, wait)
+
+    async def admit(self, request: Request):
+        """
+        Rate limit por cliente y por conversación(es) del body; después espera
+        (acotado) un cupo del límite global, que se libera al terminar el request.
+        Cada mensaje cuesta un token: un lote de /api/chat/batch paga por todos
+        sus mensajes, y cada conversación por los suyos.
+        """
+        try:
+            message_count, conversations = await _message_counts(request)
+            await self._check(
+                f"client:{self.client_key(request)}", self.client_rate, self.client_burst, "client_rate",
+                cost=max(1, message_count),
+            )
+            for conversation_id, count in conversations.items():
+                await self._check(
+                    f"conversation:{conversation_id}", self.conversation_rate, self.conversation_burst,
+                    "conversation_rate", cost=count,
+                )
+            await self.limiter.acquire()
+        except Rejected as rejection:
+            metrics.admission_rejections.inc(rejection.reason)
+            raise
+        try:
+            yield
+        finally:
+            self.limiter.release()
+
+    def stats(self) -> dict:
+        return {"active": self.limiter.active, "waiting": self.limiter.waiting, "limit": self.limiter.limit}
+
+
+async def _message_counts(request: Request):
+    """
+    (mensajes en el body, Counter de conversation_id → mensajes) para
+    /api/chat(/stream) o para cada mensaje de /api/chat/batch.
+    """
+    try:
+        body = await request.json()  # FastAPI ya lo leyó: queda en caché en el Request
+    except ValueError:
+        return 1, Counter()
+    if not isinstance(body, dict):
+        return 1, Counter()
+    items = body.get("messages") if isinstance(body.get("messages"), list) else [body]
+    conversations = Counter(
+        item["conversation_id"]
+        for item in items
+        if isinstance(item, dict) and isinstance(item.get("conversation_id"), str) and item["conversation_id"]
+    )
+    return len(items), conversations
+
+
+# Instancia compartida por main
+admission_control = AdmissionController.from_env()
@@ -0,0 +1,454 @@
+# archive.py - Archivado de conversaciones inactivas en almacenamiento frío
+#
+# Uso:
+#   python archive.py run [--idle-days 90] [--chunk 200] [--max-chunks N]
+#                         [--destination table|dir] [--output-dir archive] [--dry-run]
+#
+# Una conversación es candidata si se creó antes del corte y no tiene mensajes
+# desde el corte (now - idle_days). Se procesa por lotes acotados de
+# conversaciones, cada uno en su propia transacción:
+#   1. se bloquean sus filas (SELECT ... FOR UPDATE: un mensaje nuevo tiene que
+#      esperar al commit) y se descartan las que recibieron mensajes desde que
+#      se listaron
+#   2. sus mensajes se escriben en streaming (yield_per) a un .jsonl.gz
+#   3. filas del manifiesto (archived_conversations), DELETE masivo de los
+#      mensajes archivados y de las conversaciones que quedaron vacías, commit
+#
+# El destino tiene que ser durable: nunca se borra nada sin uno configurado
+# (ARCHIVE_DESTINATION):
+#   - table: el .jsonl.gz va a la tabla archive_chunks en la misma transacción
+#     del borrado (todo o nada). Sirve en Render free, donde el disco se pierde
+#     en cada deploy.
+#   - dir: archivos en ARCHIVE_DIR, que debe ser un disco persistente. Se
+#     escriben y sincronizan antes del commit: si el proceso muere en medio, el
+#     lote se vuelve a archivar en la siguiente corrida (al menos una vez).
+#
+# También puede correr dentro de la app: ARCHIVE_INTERVAL_HOURS > 0 arranca un
+# hilo que lo ejecuta periódicamente (por defecto apagado; en Render conviene
+# un cron job con el comando de arriba). Cada corrida toma un lock (advisory
+# lock en Postgres, archivo en otros motores): si otro worker o el cron ya está
+# archivando, la corrida se salta.
+
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import and_, delete, exists, insert, or_, select, text
+from sqlalchemy.orm import Session
+
+import crud
+import models
+from cache import conversation_cache
+from memory import conversation_memory
+
+logger = logging.getLogger(__name__)
+
+# Llave de pg_advisory_lock para las corridas (migrations.py usa 7_241_001)
+_ADVISORY_LOCK_KEY = 7_241_002
+
+# Destinos durables (ver el encabezado)
+TABLE = "table"
+DIRECTORY = "dir"
+DESTINATIONS = (TABLE, DIRECTORY)
+
+
+class ArchiveUnavailable(Exception):
+    """No hay destino durable configurado: no se archiva (ni se borra) nada."""
+
+
+def message_record(conversation_id: str, message) -> dict:
+    """Un mensaje como registro plano (una línea del archivo)."""
+    return {
+        "conversation_id": conversation_id,
+        "id": str(message.id),
+        "sender": message.sender,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat() if message.timestamp else None,
+        "handled_by_gemini": bool(message.handled_by_gemini),
+        "served_from_cache": bool(message.served_from_cache),
+    }
+
+
+class ConversationArchiver:
+    def __init__(
+        self,
+        session_factory,
+        destination: str = None,
+        output_dir: str = "archive",
+        idle_days: float = 90,
+        chunk_size: int = 200,
+        max_chunks: int = 0,
+        interval_hours: float = 0,
+        compresslevel: int = 6,
+    ):
+        if destination is not None and destination not in DESTINATIONS:
+            raise ValueError(f"ARCHIVE_DESTINATION inválido: {destination!r} (usa {', '.join(DESTINATIONS)})")
+        self.session_factory = session_factory
+        self.destination = destination
+        self.output_dir = Path(output_dir)
+        self.idle_days = idle_days
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.interval = interval_hours * 3600
+        self.compresslevel = compresslevel
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "conversations": 0, "messages": 0, "files": 0, "failed_runs": 0, "last_run": None}
+
+    @classmethod
+    def from_env(cls, session_factory):
+        """Crea el archivador a partir de las variables de entorno ARCHIVE_*."""
+        return cls(
+            session_factory,
+            destination=os.getenv("ARCHIVE_DESTINATION", "").strip().lower() or None,
+            output_dir=os.getenv("ARCHIVE_DIR", "archive"),
+            idle_days=float(os.getenv("ARCHIVE_IDLE_DAYS", "90")),
+            chunk_size=int(os.getenv("ARCHIVE_CHUNK_SIZE", "200")),
+            max_chunks=int(os.getenv("ARCHIVE_MAX_CHUNKS", "0")),
+            interval_hours=float(os.getenv("ARCHIVE_INTERVAL_HOURS", "0")),
+        )
+
+    # ==========================
+    # 📌 Candidatas
+    # ==========================
+
+    def find_idle(self, db: Session, cutoff: datetime, limit: int, after=None) -> list:
+        """
+        Hasta `limit` conversaciones inactivas desde `cutoff`, en orden
+        (created_at, id) a partir de `after`. El NOT EXISTS usa el índice
+        (conversation_id, timestamp, id) de messages.
+        """
+        Conversation, Message = models.Conversation, models.Message
+        recent = exists().where(Message.conversation_id == Conversation.id, Message.timestamp >= cutoff)
+        statement = (
+            select(Conversation.id, Conversation.conversation_id, Conversation.created_at)
+            .where(Conversation.created_at < cutoff, ~recent)
+            .order_by(Conversation.created_at, Conversation.id)
+            .limit(limit)
+        )
+        if after is not None:
+            created_at, pk = after
+            statement = statement.where(or_(
+                Conversation.created_at > created_at,
+                and_(Conversation.created_at == created_at, Conversation.id > pk),
+            ))
+        return list(db.execute(statement))
+
+    # ==========================
+    # 📌 Un lote
+    # ==========================
+
+    def _write_messages(self, db: Session, conversations: list, cutoff: datetime, raw) -> dict:
+        """
+        Escribe en `raw` (binario) el .jsonl.gz de los mensajes anteriores a
+        `cutoff` de las conversaciones del lote. Retorna {pk: (cantidad, último timestamp)}.
+        """
+        public_ids = {row.id: row.conversation_id for row in conversations}
+        summary = {}
+        statement = (
+            select(models.Message)
+            .where(models.Message.conversation_id.in_(list(public_ids)), models.Message.timestamp < cutoff)
+            .order_by(models.Message.conversation_id, models.Message.timestamp, models.Message.id)
+            .execution_options(yield_per=1000)
+        )
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.compresslevel) as compressed:
+            with io.TextIOWrapper(compressed, encoding="utf-8") as out:
+                for message in db.scalars(statement):
+                    out.write(json.dumps(message_record(public_ids[message.conversation_id], message), ensure_ascii=False))
+                    out.write("\n")
+                    count, _ = summary.get(message.conversation_id, (0, None))
+                    summary[message.conversation_id] = (count + 1, message.timestamp)
+        return summary
+
+    def _store_chunk(self, db: Session, conversations: list, cutoff: datetime, name: str, archived_at: datetime):
+        """Guarda el lote en el destino. Retorna (resumen, archive_path del manifiesto)."""
+        if self.destination == TABLE:
+            buffer = io.BytesIO()
+            summary = self._write_messages(db, conversations, cutoff, buffer)
+            db.execute(insert(models.ArchiveChunk).values(
+                id=uuid.uuid4(),
+                name=name,
+                message_count=sum(count for count, _ in summary.values()),
+                payload=buffer.getvalue(),
+                created_at=archived_at,
+            ))
+            return summary, f"db:{name}"
+
+        path = self.output_dir / name
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as raw:
+            summary = self._write_messages(db, conversations, cutoff, raw)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        return summary, path.name
+
+    def _lock_still_idle(self, db: Session, pks: list, cutoff: datetime) -> set:
+        """
+        Bloquea las conversaciones del lote hasta el commit (un INSERT en
+        messages toma FOR KEY SHARE sobre su conversación y espera) y retorna
+        las que siguen sin mensajes desde el corte. En SQLite FOR UPDATE no
+        existe; las escrituras ya se serializan por base de datos.
+        """
+        Conversation, Message = models.Conversation, models.Message
+        locked = list(db.scalars(
+            select(Conversation.id).where(Conversation.id.in_(pks)).order_by(Conversation.id).with_for_update()
+        ))
+        recent = set(db.scalars(
+            select(Message.conversation_id).where(Message.conversation_id.in_(locked), Message.timestamp >= cutoff)
+        ))
+        return set(locked) - recent
+
+    def archive_chunk(self, db: Session, conversations: list, cutoff: datetime) -> dict:
+        """Archiva un lote de conversaciones (ver el encabezado del módulo)."""
+        archived_at = datetime.utcnow()
+        name = f"conversations-{archived_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        # Transacción nueva: el bloqueo y el borrado van juntos
+        db.rollback()
+        try:
+            idle = self._lock_still_idle(db, [row.id for row in conversations], cutoff)
+            conversations = [row for row in conversations if row.id in idle]
+            if not conversations:
+                db.rollback()
+                return {"conversations": 0, "deleted_conversations": 0, "messages": 0, "path": None}
+
+            summary, archive_path = self._store_chunk(db, conversations, cutoff, name, archived_at)
+            pks = [row.id for row in conversations]
+            db.execute(insert(models.ArchivedConversation), [
+                {
+                    "id": uuid.uuid4(),
+                    "conversation_pk": row.id,
+                    "conversation_id": row.conversation_id,
+                    "created_at": row.created_at,
+                    "last_message_at": summary.get(row.id, (0, None))[1],
+                    "message_count": summary.get(row.id, (0, None))[0],
+                    "archive_path": archive_path,
+                    "archived_at": archived_at,
+                }
+                for row in conversations
+            ])
+            messages, deleted = self._delete_archived(db, pks, cutoff)
+        except Exception:
+            db.rollback()
+            raise
+        crud._commit(db)
+
+        for row in conversations:
+            conversation_cache.invalidate(row.conversation_id, row.id)
+            conversation_memory.invalidate(row.id)
+        path = archive_path if self.destination == TABLE else str(self.output_dir / archive_path)
+        return {"conversations": len(conversations), "deleted_conversations": deleted, "messages": messages, "path": path}
+
+    def _delete_archived(self, db: Session, pks: list, cutoff: datetime):
+        """
+        Borra los mensajes archivados y, en la misma sentencia, solo las
+        conversaciones que quedaron sin mensajes. Retorna (mensajes, conversaciones).
+        """
+        messages = db.execute(
+            delete(models.Message).where(models.Message.conversation_id.in_(pks), models.Message.timestamp < cutoff),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        remaining = exists().where(models.Message.conversation_id == models.Conversation.id)
+        conversations = db.execute(
+            delete(models.Conversation).where(models.Conversation.id.in_(pks), ~remaining),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        return messages, conversations
+
+    # ==========================
+    # 📌 Corrida completa
+    # ==========================
+
+    def run(self, idle_days: float = None, max_chunks: int = None, dry_run: bool = False) -> dict:
+        """
+        Archiva lotes de `chunk_size` conversaciones hasta que no queden
+        candidatas (o hasta `max_chunks` lotes, si es > 0).
+        Con dry_run solo cuenta las candidatas. Sin destino durable lanza
+        ArchiveUnavailable (salvo dry_run).
+        """
+        idle_days = self.idle_days if idle_days is None else idle_days
+        max_chunks = self.max_chunks if max_chunks is None else max_chunks
+        cutoff = datetime.utcnow() - timedelta(days=idle_days)
+        totals = {"cutoff": cutoff.isoformat(), "chunks": 0, "conversations": 0, "messages": 0, "files": []}
+        if not dry_run:
+            if self.destination is None:
+                raise ArchiveUnavailable(
+                    "Sin destino durable para el archivado (ARCHIVE_DESTINATION=table o dir): no se borra nada"
+                )
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        db = self.session_factory()
+        try:
+            with self._run_lock(db, dry_run) as acquired:
+                if not acquired:
+                    logger.info("Otra corrida de archivado está en curso; se salta esta")
+                    return dict(totals, skipped=True)
+                self._run_chunks(db, cutoff, max_chunks, dry_run, totals)
+        finally:
+            db.close()
+
+        if not dry_run:
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["conversations"] += totals["conversations"]
+                self._stats["messages"] += totals["messages"]
+                self._stats["files"] += len(totals["files"])
+                self._stats["last_run"] = datetime.utcnow().isoformat()
+        return totals
+
+    def _run_chunks(self, db: Session, cutoff: datetime, max_chunks: int, dry_run: bool, totals: dict):
+        after = None
+        while not max_chunks or totals["chunks"] < max_chunks:
+            conversations = self.find_idle(db, cutoff, self.chunk_size, after=after)
+            if not conversations:
+                break
+            after = (conversations[-1].created_at, conversations[-1].id)
+            totals["chunks"] += 1
+            if dry_run:
+                totals["conversations"] += len(conversations)
+                continue
+            result = self.archive_chunk(db, conversations, cutoff)
+            if result["path"] is None:
+                continue
+            totals["conversations"] += result["conversations"]
+            totals["messages"] += result["messages"]
+            totals["files"].append(result["path"])
+            logger.info(
+                "Archivadas %s conversaciones (%s mensajes) en %s",
+                result["conversations"], result["messages"], result["path"],
+            )
+
+    @contextmanager
+    def _run_lock(self, db: Session, dry_run: bool):
+        """
+        Una sola corrida a la vez entre workers, instancias y el cron. En
+        Postgres es un advisory lock en una conexión aparte (la de la sesión
+        vuelve al pool en cada commit); en otros motores, un lock de archivo en
+        el directorio de salida (workers de la misma máquina; fcntl no existe
+        en Windows, donde solo se usa para desarrollo y no hay lock).
+        """
+        if dry_run:
+            yield True
+            return
+        engine = db.get_bind()
+        if engine.dialect.name == "postgresql":
+            with engine.connect() as conn:
+                acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY}).scalar()
+                conn.commit()
+                try:
+                    yield acquired
+                finally:
+                    if acquired:
+                        conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+                        conn.commit()
+            return
+        try:
+            import fcntl
+        except ImportError:
+            yield True
+            return
+        with open(self.output_dir / ".archive.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ==========================
+    # 📌 Ejecución periódica
+    # ==========================
+
+    def start(self):
+        """Arranca el hilo periódico (no hace nada si ARCHIVE_INTERVAL_HOURS es 0)."""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        if self.destination is None:
+            logger.error("ARCHIVE_INTERVAL_HOURS está activo pero falta ARCHIVE_DESTINATION (table o dir): no se archiva")
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, name="conversation-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Detiene el hilo; un lote en curso termina (su transacción es atómica)."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _loop(self):
+        while not self._stopping.wait(self.interval):
+            started = time.perf_counter()
+            try:
+                totals = self.run()
+            except Exception:
+                logger.exception("Falló el archivado de conversaciones")
+                with self._lock:
+                    self._stats["failed_runs"] += 1
+                continue
+            if totals.get("skipped"):
+                continue
+            logger.info(
+                "Archivado: %s conversaciones, %s mensajes en %.1fs",
+                totals["conversations"], totals["messages"], time.perf_counter() - started,
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, enabled=self.interval > 0 and self.destination is not None, destination=self.destination)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archivado de conversaciones inactivas")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run")
+    p.add_argument("--idle-days", type=float, default=float(os.getenv("ARCHIVE_IDLE_DAYS", "90")))
+    p.add_argument("--chunk", type=int, default=int(os.getenv("ARCHIVE_CHUNK_SIZE", "200")))
+    p.add_argument("--max-chunks", type=int, default=0, help="0 = hasta terminar")
+    p.add_argument("--destination", choices=DESTINATIONS, default=os.getenv("ARCHIVE_DESTINATION", "").strip().lower() or None,
+                   help="destino durable (obligatorio salvo --dry-run)")
+    p.add_argument("--output-dir", default=os.getenv("ARCHIVE_DIR", "archive"), help="directorio de --destination dir (disco persistente)")
+    p.add_argument("--dry-run", action="store_true", help="solo cuenta las candidatas")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal, init_engine
+    from migrations import ensure_schema
+
+    ensure_schema(init_engine(), auto_upgrade=False)
+    archiver = ConversationArchiver(
+        SessionLocal, destination=args.destination, output_dir=args.output_dir, idle_days=args.idle_days, chunk_size=args.chunk,
+    )
+    try:
+        totals = archiver.run(max_chunks=args.max_chunks, dry_run=args.dry_run)
+    except ArchiveUnavailable as e:
+        print(f"❌ {e}")
+        return 1
+    if totals.get("skipped"):
+        print("⚠️ Otra corrida de archivado está en curso; no se hizo nada")
+        return 0
+    verb = "Candidatas" if args.dry_run else "Archivadas"
+    print(f"✅ {verb}: {totals['conversations']} conversaciones en {totals['chunks']} lotes "
+          f"({totals['messages']} mensajes, corte {totals['cutoff']})")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
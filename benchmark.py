@@ -0,0 +1,537 @@
+# benchmark.py - Benchmarks reproducibles de Fulano AI
+#
+# Levanta la app de FastAPI contra una base local (SQLite por defecto o un
+# Postgres desechable), la llena con conversaciones sintéticas y mide:
+#   - carga: /api/chat, /api/history/{id} y / a concurrencia fija
+#            (throughput y latencias p50/p95/p99)
+#   - micro: predict_intent, calculate, bm25 y las funciones de crud
+# Los resultados se guardan en JSON para comparar entre commits.
+#
+# Uso:
+#   python benchmark.py run [--db URL] [--conversations 200] [--messages 50]
+#                           [--concurrency 1,8,32] [--requests 400] [--output FILE]
+#   python benchmark.py micro [--output FILE]
+#   python benchmark.py compare base.json nuevo.json [--threshold 10]
+#   python benchmark.py startup [--import-budget-ms 1500] [--ready-budget-ms 5000]
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+SAMPLE_MESSAGES = [
+    "hola", "qué hora es", "cuánto es 8 por 8", "gracias", "chao",
+    "cuéntame un chiste", "calcula (3 + 4) * 12", "epale, que mas pues",
+    "no sé qué preguntar", "resuelve 2 elevado a 10",
+]
+
+RESULTS_DIR = "bench_results"
+
+
+# ==========================
+# 📌 Entorno
+# ==========================
+
+@contextmanager
+def _database_url(db_url: str, name: str):
+    """`db_url` tal cual o, si es None, un SQLite en un directorio temporal que se borra al salir."""
+    if db_url is not None:
+        yield db_url
+        return
+    with tempfile.TemporaryDirectory(prefix=f"fulano-{name}-") as tmpdir:
+        yield f"sqlite:///{os.path.join(tmpdir, name + '.db')}"
+
+
+def _setup_database(db_url: str):
+    """
+    Apunta DATABASE_URL a la base de benchmark, crea el motor con ella
+    (el lifespan de la app reutiliza ese mismo motor) y aplica las migraciones.
+    Todo el tráfico sale de 127.0.0.1: el rate limit por cliente/conversación
+    se apaga (salvo que se pida explícito); el límite de concurrencia queda.
+    """
+    os.environ["DATABASE_URL"] = db_url
+    os.environ.setdefault("ADMISSION_CLIENT_RATE", "0")
+    os.environ.setdefault("ADMISSION_CONVERSATION_RATE", "0")
+    import database
+    import migrations
+
+    migrations.upgrade(database.init_engine(db_url))
+    return database
+
+
+def seed(database, conversations: int, messages_per_conversation: int, seed_value: int = 42) -> list:
+    """
+    Crea conversaciones sintéticas con mensajes alternados usuario/bot.
+    Retorna los IDs públicos creados.
+    """
+    import crud
+    import models
+    from sqlalchemy import insert
+
+    rng = random.Random(seed_value)
+    start = datetime.utcnow() - timedelta(days=1)
+    public_ids = []
+
+    db = database.SessionLocal()
+    try:
+        for _ in range(conversations):
+            conversation_pk = uuid.UUID(int=rng.getrandbits(128))
+            public_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            public_ids.append(public_id)
+            db.execute(insert(models.Conversation), [{
+                "id": conversation_pk, "conversation_id": public_id, "created_at": start,
+            }])
+            rows = []
+            for index in range(messages_per_conversation):
+                rows.append({
+                    "id": uuid.UUID(int=rng.getrandbits(128)),
+                    "conversation_id": conversation_pk,
+                    "sender": "user" if index % 2 == 0 else "bot",
+                    "content": rng.choice(SAMPLE_MESSAGES),
+                    "handled_by_gemini": False,
+                    "timestamp": start + timedelta(seconds=index),
+                })
+            crud.bulk_insert_messages(db, rows)
+        db.commit()
+    finally:
+        db.close()
+    return public_ids
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _Server:
+    """uvicorn corriendo en un hilo, en un puerto libre."""
+
+    def __init__(self, app):
+        import uvicorn
+
+        self.port = _free_port()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 15
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("El servidor no arrancó a tiempo")
+            time.sleep(0.05)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(10)
+
+
+# ==========================
+# 📌 Estadísticas
+# ==========================
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies: list, wall_time: float, errors: int) -> dict:
+    values = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / wall_time, 2) if wall_time else 0.0,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "mean_ms": ms(statistics.fmean(values)) if values else 0.0,
+        "max_ms": ms(values[-1]) if values else 0.0,
+    }
+
+
+# ==========================
+# 📌 Carga HTTP
+# ==========================
+
+def _scenarios(public_ids: list):
+    def chat(session, base_url, rng):
+        payload = {"message": rng.choice(SAMPLE_MESSAGES), "conversation_id": rng.choice(public_ids)}
+        return session.post(f"{base_url}/api/chat", json=payload)
+
+    def history(session, base_url, rng):
+        return session.get(f"{base_url}/api/history/{rng.choice(public_ids)}", params={"limit": 50})
+
+    def root(session, base_url, rng):
+        return session.get(f"{base_url}/")
+
+    return {"chat": chat, "history": history, "root": root}
+
+
+def drive(base_url: str, scenario, concurrency: int, total_requests: int, seed_value: int = 7) -> dict:
+    """Lanza `total_requests` requests repartidos en `concurrency` hilos."""
+    import requests
+
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    counter = iter(range(total_requests))
+
+    def worker(worker_index):
+        local.session = requests.Session()
+        rng = random.Random(seed_value + worker_index)
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            started = time.perf_counter()
+            try:
+                response = scenario(local.session, base_url, rng)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return summarize(latencies, time.perf_counter() - wall_start, errors[0])
+
+
+def run_load(database, public_ids: list, concurrency_levels: list, total_requests: int) -> dict:
+    from main import app
+
+    results = {}
+    with _Server(app) as base_url:
+        for name, scenario in _scenarios(public_ids).items():
+            drive(base_url, scenario, 2, 20)  # calentamiento
+            results[name] = {
+                str(level): drive(base_url, scenario, level, total_requests) for level in concurrency_levels
+            }
+            print(f"  {name}: " + ", ".join(
+                f"c={level} {r['throughput_rps']} rps p99={r['p99_ms']}ms" for level, r in results[name].items()
+            ))
+    return results
+
+
+# ==========================
+# 📌 Microbenchmarks
+# ==========================
+
+def _timeit(func, iterations: int) -> dict:
+    func()  # calentamiento
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    us = lambda seconds: round(seconds * 1e6, 3)
+    return {
+        "iterations": iterations,
+        "mean_us": us(statistics.fmean(samples)),
+        "p50_us": us(percentile(samples, 50)),
+        "p99_us": us(percentile(samples, 99)),
+    }
+
+
+def run_micro(database, public_ids: list, iterations: int = 2000) -> dict:
+    import crud
+    from cache import conversation_cache
+    from intents import predict_intent
+    from tools import calculate
+
+    rng = random.Random(3)
+    messages = [rng.choice(SAMPLE_MESSAGES) for _ in range(64)]
+    expressions = [f"cuánto es {rng.randint(1, 999)} por {rng.randint(1, 999)}" for _ in range(64)]
+    # Cada bucle cronometrado tiene su propio iterador infinito
+    cycle = lambda values: itertools.cycle(values).__next__
+
+    results = {}
+    next_message = cycle(messages)
+    results["predict_intent"] = _timeit(lambda: predict_intent(next_message()), iterations)
+    next_expression = cycle(expressions)
+    results["calculate"] = _timeit(lambda: calculate(next_expression()), iterations)
+
+    from bm25 import BM25Index
+
+    documents = [" ".join(rng.choice(SAMPLE_MESSAGES) for _ in range(rng.randint(1, 4))) for _ in range(5000)]
+    index = BM25Index(documents)
+    queries = [rng.choice(SAMPLE_MESSAGES) for _ in range(64)]
+    next_query = cycle(queries)
+    results["bm25.search[5000 docs]"] = _timeit(lambda: index.search(next_query(), k=10), iterations)
+    results["bm25.search_many[64 x 5000 docs]"] = _timeit(lambda: index.search_many(queries, k=10), max(iterations // 64, 20))
+
+    db = database.SessionLocal()
+    try:
+        db_iterations = max(iterations // 10, 50)
+        next_id = cycle(public_ids)
+
+        def resolve_uncached():
+            conversation_cache.clear()
+            crud.resolve_conversation_pk(db, next_id())
+
+        results["crud.resolve_conversation_pk[miss]"] = _timeit(resolve_uncached, db_iterations)
+        for public_id in public_ids:
+            crud.resolve_conversation_pk(db, public_id)
+        next_id = cycle(public_ids)
+        results["crud.resolve_conversation_pk[hit]"] = _timeit(lambda: crud.resolve_conversation_pk(db, next_id()), db_iterations)
+
+        pks = [crud.resolve_conversation_pk(db, public_id) for public_id in public_ids]
+        next_pk = cycle(pks)
+        results["crud.get_messages_page"] = _timeit(lambda: crud.get_messages_page(db, next_pk(), limit=50), db_iterations)
+        for conversation_pk in pks:
+            crud.get_recent_messages(db, conversation_pk, limit=50)
+        next_pk = cycle(pks)
+        results["crud.get_recent_messages"] = _timeit(lambda: crud.get_recent_messages(db, next_pk(), limit=50), db_iterations)
+        next_id = cycle(public_ids)
+        results["crud.record_turn"] = _timeit(
+            lambda: crud.record_turn(db, next_id(), "hola", "¡Épale, mi pana!"), db_iterations
+        )
+    finally:
+        db.close()
+    return results
+
+
+# ==========================
+# 📌 Arranque en frío
+# ==========================
+
+HEAVY_MODULES = ("sklearn", "numpy", "google.generativeai", "cohere", "grpc", "wikipediaapi", "flask", "pyarrow")
+
+
+def _first_healthz(cwd: str, env: dict, ready_budget_ms: float):
+    """Arranca uvicorn y retorna los ms hasta el primer /healthz 200 (None si nunca responde)."""
+    import requests
+
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=env,
+    )
+    try:
+        deadline = started + max(ready_budget_ms / 1000 * 3, 10)
+        while time.perf_counter() < deadline and server.poll() is None:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/healthz", timeout=0.5).status_code == 200:
+                    return (time.perf_counter() - started) * 1000
+            except requests.ConnectionError:
+                time.sleep(0.02)
+        return None
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def check_startup(import_budget_ms: float, ready_budget_ms: float, db_url: str = None) -> int:
+    """
+    Presupuesto de arranque en frío, cada medición en un proceso nuevo:
+    1. `import main` sin DATABASE_URL: no debe tocar la BD ni cargar
+       integraciones pesadas, y debe caber en import_budget_ms.
+    2. uvicorn desde cero hasta que /healthz responde: debe caber en ready_budget_ms.
+    Retorna 1 si algún presupuesto se excede.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+    probe = (
+        "import sys, time, json; t = time.perf_counter(); import main; "
+        "elapsed = (time.perf_counter() - t) * 1000; "
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]; "
+        "print(json.dumps({'import_ms': elapsed, 'heavy': heavy}))"
+    )
+    # python-dotenv cargaría el .env del repo: se corre desde un directorio vacío
+    with tempfile.TemporaryDirectory() as cwd:
+        env["PYTHONPATH"] = here
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", probe], cwd=cwd, env=env, capture_output=True, text=True,
+        )
+    if output.returncode != 0:
+        print(f"❌ `import main` falló sin DATABASE_URL:\n{output.stderr[-2000:]}")
+        return 1
+    measured = json.loads(output.stdout.strip().splitlines()[-1])
+
+    # Módulos más lentos según -X importtime (columna acumulada, en µs)
+    slowest = []
+    for line in output.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            slowest.append((int(parts[1]), parts[2].strip()))
+    slowest.sort(reverse=True)
+
+    failed = False
+    status = "✅" if measured["import_ms"] <= import_budget_ms else "❌"
+    failed |= status == "❌"
+    print(f"{status} import main: {measured['import_ms']:.0f} ms (presupuesto {import_budget_ms:.0f} ms)")
+    for cumulative_us, module in slowest[:8]:
+        print(f"     {cumulative_us / 1000:8.1f} ms  {module}")
+    if measured["heavy"]:
+        failed = True
+        print(f"❌ Integraciones pesadas cargadas al importar: {', '.join(measured['heavy'])}")
+
+    # Tiempo hasta el primer /healthz con un servidor real
+    with _database_url(db_url, "startup") as db_url:
+        ready_ms = _first_healthz(here, dict(env, DATABASE_URL=db_url), ready_budget_ms)
+
+    if ready_ms is None:
+        print("❌ El servidor nunca respondió /healthz")
+        return 1
+    status = "✅" if ready_ms <= ready_budget_ms else "❌"
+    failed |= status == "❌"
+    print(f"{status} primer /healthz: {ready_ms:.0f} ms (presupuesto {ready_budget_ms:.0f} ms)")
+    return 1 if failed else 0
+
+
+# ==========================
+# 📌 Resultados
+# ==========================
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def _write(results: dict, output: str = None) -> str:
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{results['commit']}-{int(time.time())}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    return output
+
+
+def _flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    """
+    Compara dos archivos de resultados. Marca como regresión si una latencia
+    sube, o un throughput baja, más de `threshold` %. Retorna el código de salida.
+    """
+    with open(base_path, encoding="utf-8") as f:
+        base = _flatten({k: v for k, v in json.load(f).items() if k in ("load", "micro")})
+    with open(new_path, encoding="utf-8") as f:
+        new = _flatten({k: v for k, v in json.load(f).items() if k in ("load", "micro")})
+
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        higher_is_better = key.endswith("throughput_rps")
+        if not (higher_is_better or key.endswith("_ms") or key.endswith("_us")):
+            continue
+        old, current = base[key], new[key]
+        if not old:
+            continue
+        change = (current - old) / old * 100
+        worse = -change if higher_is_better else change
+        flag = "❌" if worse > threshold else "  "
+        regressions += worse > threshold
+        print(f"{flag} {key:60s} {old:>12} → {current:<12} ({change:+.1f}%)")
+    print(f"\n{regressions} regresiones por encima de {threshold}%")
+    return 1 if regressions else 0
+
+
+def _benchmark(args, db_url: str) -> int:
+    database = _setup_database(db_url)
+    try:
+        print(f"Sembrando {args.conversations} conversaciones x {args.messages} mensajes en {db_url.split('@')[-1]}")
+        public_ids = seed(database, args.conversations, args.messages)
+
+        results = {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "database": database.engine.dialect.name,
+            "config": {key: value for key, value in vars(args).items() if key not in ("command", "db", "output")},
+        }
+        if args.command == "run":
+            levels = [int(level) for level in args.concurrency.split(",")]
+            print("Carga HTTP:")
+            results["load"] = run_load(database, public_ids, levels, args.requests)
+        if args.command == "micro" or not getattr(args, "skip_micro", False):
+            print("Microbenchmarks:")
+            results["micro"] = run_micro(database, public_ids, args.iterations)
+            for name, r in results["micro"].items():
+                print(f"  {name}: {r['mean_us']} µs (p99 {r['p99_us']} µs)")
+
+        print(f"Resultados en {_write(results, args.output)}")
+        return 0
+    finally:
+        # Cierra las conexiones antes de que _database_url borre el SQLite temporal
+        database.dispose_engine()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de Fulano AI")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("run", "micro"):
+        p = sub.add_parser(name)
+        p.add_argument("--db", help="URL de la base (por defecto un SQLite temporal)")
+        p.add_argument("--conversations", type=int, default=200)
+        p.add_argument("--messages", type=int, default=50)
+        p.add_argument("--iterations", type=int, default=2000)
+        p.add_argument("--output")
+        if name == "run":
+            p.add_argument("--concurrency", default="1,8,32")
+            p.add_argument("--requests", type=int, default=400)
+            p.add_argument("--skip-micro", action="store_true")
+
+    p = sub.add_parser("compare")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=10.0)
+
+    p = sub.add_parser("startup")
+    p.add_argument("--db", help="URL de la base para el servidor (por defecto un SQLite temporal)")
+    p.add_argument("--import-budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")))
+    p.add_argument("--ready-budget-ms", type=float, default=float(os.getenv("READY_BUDGET_MS", "5000")))
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return compare(args.base, args.new, args.threshold)
+    if args.command == "startup":
+        return check_startup(args.import_budget_ms, args.ready_budget_ms, args.db)
+
+    with _database_url(args.db, "bench") as db_url:
+        return _benchmark(args, db_url)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# bm25.py - Índice BM25 vectorizado (NumPy) para rerankear documentos en Fulano AI
+#
+# El índice se construye una vez sobre un conjunto de documentos y se reutiliza:
+#   - postings en formato CSR (término → documentos) con el peso BM25 de cada
+#     posting ya calculado, así puntuar una consulta es solo sumar pesos
+#   - top-k con argpartition (sin ordenar todos los documentos)
+#   - consultas por lotes (las repetidas dentro del lote se puntúan una vez)
+#   - segunda etapa opcional con un cross-scorer sobre los mejores candidatos
+#
+# NumPy se importa aquí; tools.py importa este módulo solo al primer uso.
+
+from typing import Callable, List, NamedTuple, Sequence
+
+import numpy as np
+
+from intents import tokenize
+
+
+class Hit(NamedTuple):
+    index: int       # posición del documento en la lista original
+    score: float
+    document: str
+
+
+class BM25Index:
+    """
+    Okapi BM25 con idf = log(1 + (N - df + 0.5) / (df + 0.5)) (siempre >= 0).
+
+        index = BM25Index(documentos)
+        index.search("clima en bogotá", k=5)            → [Hit, ...]
+        index.search_many(["consulta 1", "consulta 2"])  → [[Hit, ...], [Hit, ...]]
+        index.rerank("consulta", k=5, cross_scorer=f)    → BM25 + segunda etapa
+    """
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75, tokenizer: Callable = tokenize):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer
+        self.vocabulary = {}
+        self._build()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _build(self):
+        n_docs = len(self.documents)
+        term_ids, lengths = [], []
+        for document in self.documents:
+            tokens = self.tokenizer(document)
+            lengths.append(len(tokens))
+            term_ids.extend(self.vocabulary.setdefault(token, len(self.vocabulary)) for token in tokens)
+
+        doc_lengths = np.asarray(lengths, dtype=np.float32)
+        doc_of_token = np.repeat(np.arange(n_docs, dtype=np.int64), doc_lengths.astype(np.int64))
+
+        # (término, documento) únicos, ya ordenados por término y luego por documento → CSR
+        keys, tf = np.unique(np.asarray(term_ids, dtype=np.int64) * max(n_docs, 1) + doc_of_token, return_counts=True)
+        terms = keys // max(n_docs, 1)
+        self._doc_ids = (keys % max(n_docs, 1)).astype(np.int32)
+        self._offsets = np.searchsorted(terms, np.arange(len(self.vocabulary) + 1))
+
+        df = np.diff(self._offsets).astype(np.float32)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        avg_length = float(doc_lengths.mean()) if n_docs and doc_lengths.sum() else 1.0
+        tf = tf.astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths[self._doc_ids] / avg_length)
+        self._weights = (self.idf[terms] * tf * (self.k1 + 1) / (tf + norm)).astype(np.float32)
+
+    # ==========================
+    # 📌 Puntuación
+    # ==========================
+
+    def _query_terms(self, query: str) -> list:
+        ids = {self.vocabulary.get(token) for token in self.tokenizer(query)}
+        ids.discard(None)
+        return sorted(ids)
+
+    def _score_unique(self, queries: Sequence[str]):
+        """
+        (puntajes, filas): una fila de puntajes por consulta distinta y, para
+        cada consulta del lote, el índice de su fila. Cada término suma su tramo
+        de pesos precalculados, sin copiar postings.
+        """
+        unique = {}
+        rows = [unique.setdefault(query, len(unique)) for query in queries]
+        scores = np.zeros((len(unique), len(self.documents)), dtype=np.float32)
+        for row, query in enumerate(unique):
+            target = scores[row]
+            for term in self._query_terms(query):
+                start, end = self._offsets[term], self._offsets[term + 1]
+                # Un documento aparece una sola vez por término: += con índices es seguro
+                target[self._doc_ids[start:end]] += self._weights[start:end]
+        return scores, rows
+
+    def score_many(self, queries: Sequence[str]) -> np.ndarray:
+        """Matriz (consultas × documentos) de puntajes BM25."""
+        scores, rows = self._score_unique(list(queries))
+        return scores[rows]
+
+    def score(self, query: str) -> np.ndarray:
+        return self.score_many([query])[0]
+
+    # ==========================
+    # 📌 Búsqueda
+    # ==========================
+
+    def search_many(self, queries: Sequence[str], k: int = 10, include_zero: bool = False) -> List[List[Hit]]:
+        """
+        Los `k` mejores documentos de cada consulta, en orden descendente.
+        Con include_zero=False se omiten los documentos sin ningún término en común.
+        """
+        queries = list(queries)
+        n_docs = len(self.documents)
+        k = min(k, n_docs)
+        if k <= 0:
+            return [[] for _ in queries]
+
+        # Top-k por consulta distinta; las repetidas comparten el resultado
+        scores, rows = self._score_unique(queries)
+        if k < n_docs:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(n_docs), scores.shape)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        # Orden estable: a igual puntaje queda primero el documento original anterior
+        order = np.lexsort((top, -top_scores), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        hits = [
+            [
+                Hit(index, score, self.documents[index])
+                for index, score in zip(indices, values)
+                if include_zero or score > 0
+            ]
+            for indices, values in zip(top.tolist(), top_scores.tolist())
+        ]
+        return [list(hits[row]) for row in rows]
+
+    def search(self, query: str, k: int = 10, include_zero: bool = False) -> List[Hit]:
+        return self.search_many([query], k=k, include_zero=include_zero)[0]
+
+    def rerank(
+        self,
+        query: str,
+        k: int = 10,
+        cross_scorer: Callable[[str, List[str]], Sequence[float]] = None,
+        candidates: int = None,
+    ) -> List[Hit]:
+        """
+        BM25 elige `candidates` documentos (por defecto 4·k, mínimo 50) y, si se
+        da `cross_scorer(query, documentos) → puntajes`, este los reordena.
+        """
+        if cross_scorer is None:
+            return self.search(query, k=k)
+        hits = self.search(query, k=candidates or max(4 * k, 50))
+        if not hits:
+            return []
+        scores = cross_scorer(query, [hit.document for hit in hits])
+        reranked = sorted(zip(hits, scores), key=lambda pair: -float(pair[1]))
+        return [Hit(hit.index, float(score), hit.document) for hit, score in reranked[:k]]
@@ -0,0 +1,420 @@
+# cache.py - Caché en memoria de conversaciones activas para Fulano AI
+
+import asyncio
+import importlib
+import importlib.util
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import NamedTuple, Optional
+import uuid
+
+from intents import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+# ==========================
+# 📌 LRU con TTL
+# ==========================
+
+class LRUTTLCache:
+    """
+    Diccionario acotado: expulsa la entrada usada hace más tiempo cuando se
+    llena y descarta las que llevan más de `ttl` segundos sin escribirse.
+    (cachelib.SimpleCache no hace LRU, por eso no se usa aquí.)
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, key, default=None):
+        """Como get, pero sin contar hit/miss ni mover la entrada en el LRU."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> list:
+        """Llaves vigentes (sin las vencidas), de la menos a la más usada."""
+        now = time.monotonic()
+        with self._lock:
+            return [key for key, (expires_at, _) in self._data.items() if expires_at > now]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# ==========================
+# 📌 Caché de conversaciones
+# ==========================
+
+class CachedMessage(NamedTuple):
+    """Mismos atributos que models.Message que usan el historial y los cursores."""
+    id: uuid.UUID
+    sender: str
+    content: str
+    timestamp: datetime
+    handled_by_gemini: bool = False
+
+
+class _Tail:
+    """Últimos mensajes de una conversación (en orden cronológico)."""
+
+    def __init__(self, size: int, messages=(), complete: bool = False):
+        self.lock = threading.Lock()
+        self.messages = deque(messages, maxlen=size)
+        # True si la cola contiene la conversación entera (no hay mensajes más viejos)
+        self.complete = complete
+
+
+class ConversationCache:
+    """
+    - ID público → llave primaria, para no consultar `conversations` en cada turno.
+    - Cola de los últimos `tail_size` mensajes por conversación, para servir la
+      primera página del historial sin ir a la BD.
+
+    Se actualiza en escritura (write-through) y se invalida al borrar. Con varios
+    workers cada proceso tiene su propia caché; el TTL acota lo que puede quedar
+    desactualizado si otro worker borra una conversación.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600, tail_size: int = 50):
+        self.tail_size = tail_size
+        self.ids = LRUTTLCache(maxsize, ttl)
+        self.tails = LRUTTLCache(maxsize, ttl)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            maxsize=int(os.getenv("CONVERSATION_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("CONVERSATION_CACHE_TTL", "600")),
+            tail_size=int(os.getenv("CONVERSATION_CACHE_TAIL", "50")),
+        )
+
+    # ---- ID público → PK ----
+
+    def get_pk(self, conversation_id: str) -> Optional[uuid.UUID]:
+        return self.ids.get(conversation_id)
+
+    def remember(self, conversation_id: str, conversation_pk: uuid.UUID):
+        self.ids.set(conversation_id, conversation_pk)
+
+    # ---- Cola de mensajes recientes ----
+
+    def get_tail(self, conversation_pk, limit: int):
+        """
+        Retorna (mensajes, has_more) si la caché puede responder los `limit`
+        mensajes más recientes, o None si hay que ir a la BD.
+        """
+        tail = self.tails.get(conversation_pk)
+        if tail is None:
+            return None
+        with tail.lock:
+            if len(tail.messages) < limit and not tail.complete:
+                return None
+            messages = list(tail.messages)[-limit:]
+            has_more = len(tail.messages) > limit or not tail.complete
+        return messages, has_more
+
+    def store_tail(self, conversation_pk, messages: list, complete: bool):
+        """Guarda los mensajes más recientes leídos de la BD."""
+        if self.tail_size > 0:
+            self.tails.set(conversation_pk, _Tail(self.tail_size, (to_cached(m) for m in messages), complete))
+
+    def append_messages(self, conversation_pk, rows: list, new_conversation: bool = False):
+        """
+        Write-through de los mensajes recién guardados. Solo se agregan si ya
+        hay una cola en caché (o la conversación es nueva): agregar a una
+        conversación sin cola dejaría una cola incompleta marcada como reciente.
+        """
+        if self.tail_size <= 0:
+            return
+        if new_conversation:
+            self.tails.set(conversation_pk, _Tail(self.tail_size, complete=True))
+        tail = self.tails.get(conversation_pk)
+        if tail is None:
+            return
+        with tail.lock:
+            tail.messages.extend(to_cached(row) for row in rows)
+            if len(tail.messages) == tail.messages.maxlen:
+                tail.complete = False
+
+    def invalidate(self, conversation_id: str = None, conversation_pk=None):
+        if conversation_id is not None:
+            pk = self.ids.pop(conversation_id)
+            conversation_pk = conversation_pk or pk
+        if conversation_pk is not None:
+            self.tails.pop(conversation_pk)
+
+    def clear(self):
+        self.ids.clear()
+        self.tails.clear()
+
+    def stats(self) -> dict:
+        return {"ids": self.ids.stats(), "tails": self.tails.stats()}
+
+
+def to_cached(message) -> CachedMessage:
+    if isinstance(message, dict):
+        return CachedMessage(
+            id=message["id"],
+            sender=message["sender"],
+            content=message["content"],
+            timestamp=message["timestamp"],
+            handled_by_gemini=message.get("handled_by_gemini", False),
+        )
+    return CachedMessage(message.id, message.sender, message.content, message.timestamp, message.handled_by_gemini)
+
+
+# ==========================
+# 📌 Caché de respuestas generadas
+# ==========================
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def response_key(text: str) -> str:
+    """"¿Qué es Fulano?" y "que es fulano" → "que es fulano"."""
+    return " ".join(_PUNCTUATION.sub(" ", normalize_text(text)).split())
+
+
+class ResponseHit(NamedTuple):
+    reply: str
+    similarity: float  # 1.0 = mismo texto normalizado
+
+
+class ResponseCache:
+    """
+    Respuestas del backend de generación por mensaje, para no pagar una llamada
+    al modelo por cada variante de la misma pregunta.
+
+    - Coincidencia exacta sobre response_key(texto).
+    - Opcional (similarity_threshold > 0): el vecino más cercano por similitud
+      coseno entre vectores TF-IDF de n-gramas de caracteres. scikit-learn se
+      importa con la primera búsqueda; el vocabulario se reajusta cuando llega
+      más de un 25% de entradas nuevas y mientras tanto las nuevas se
+      vectorizan con el vocabulario vigente.
+
+    Las entradas son por intent; `disabled_intents` nunca se guardan ni se sirven.
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 3600, similarity_threshold: float = 0.0, disabled_intents=()):
+        self.entries = LRUTTLCache(maxsize, ttl)  # (intent, llave) → respuesta
+        self.similarity_threshold = similarity_threshold
+        self.disabled_intents = frozenset(disabled_intents)
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+        self._index_lock = threading.Lock()
+        self._vectorizer = None
+        self._matrix = None      # una fila L2-normalizada por entrada indexada
+        self._rows = []          # (intent, llave) de cada fila
+        self._pending = []       # entradas nuevas aún sin vectorizar
+        self._added = 0          # entradas nuevas desde el último ajuste
+        self._fitted = 0
+        self._sklearn_missing = False
+
+    @classmethod
+    def from_env(cls):
+        disabled = os.getenv("RESPONSE_CACHE_DISABLED_INTENTS", "")
+        return cls(
+            maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+            similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0")),  # 0 = solo exacta
+            disabled_intents=[name.strip() for name in disabled.split(",") if name.strip()],
+        )
+
+    def enabled(self, intent: str) -> bool:
+        return self.entries.maxsize > 0 and intent not in self.disabled_intents
+
+    def get(self, text: str, intent: str) -> Optional[ResponseHit]:
+        if not self.enabled(intent):
+            return None
+        key = response_key(text)
+        hit = self._exact(intent, key)
+        if hit is None and self.similarity_threshold > 0 and key:
+            hit = self._count_similar(self._nearest(intent, key))
+        if hit is None:
+            self.misses += 1
+        return hit
+
+    async def aget(self, text: str, intent: str) -> Optional[ResponseHit]:
+        """
+        Igual que get, para los handlers async: la búsqueda por similitud (que
+        puede importar scikit-learn o reajustar el TF-IDF) corre en un hilo
+        para no frenar el event loop.
+        """
+        if not self.enabled(intent):
+            return None
+        key = response_key(text)
+        hit = self._exact(intent, key)
+        if hit is None and self.similarity_threshold > 0 and key:
+            hit = self._count_similar(await asyncio.to_thread(self._nearest, intent, key))
+        if hit is None:
+            self.misses += 1
+        return hit
+
+    def _exact(self, intent: str, key: str) -> Optional[ResponseHit]:
+        reply = self.entries.get((intent, key))
+        if reply is None:
+            return None
+        self.exact_hits += 1
+        return ResponseHit(reply, 1.0)
+
+    def _count_similar(self, hit: Optional[ResponseHit]) -> Optional[ResponseHit]:
+        if hit is not None:
+            self.similar_hits += 1
+        return hit
+
+    def warm(self):
+        """Importa scikit-learn por adelantado (main lo llama en un hilo al arrancar)."""
+        if self.similarity_threshold <= 0 or self._sklearn_missing:
+            return
+        if importlib.util.find_spec("sklearn") is not None:
+            importlib.import_module("sklearn.feature_extraction.text")
+
+    def put(self, text: str, intent: str, reply: str):
+        if not self.enabled(intent):
+            return
+        key = response_key(text)
+        if not key:
+            return
+        self.entries.set((intent, key), reply)
+        if self.similarity_threshold > 0:
+            with self._index_lock:
+                self._pending.append((intent, key))
+                self._added += 1
+
+    def clear(self):
+        self.entries.clear()
+        with self._index_lock:
+            self._vectorizer = self._matrix = None
+            self._rows, self._pending = [], []
+            self._added = self._fitted = 0
+
+    def stats(self) -> dict:
+        total = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.entries.maxsize,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "evictions": self.entries.evictions,
+            "hit_ratio": round((self.exact_hits + self.similar_hits) / total, 4) if total else 0.0,
+        }
+
+    # ---- Vecino más cercano (TF-IDF) ----
+
+    def _nearest(self, intent: str, key: str) -> Optional[ResponseHit]:
+        with self._index_lock:
+            if not self._refresh_index():
+                return None
+            query = self._vectorizer.transform([key])
+            if query.nnz == 0:
+                return None
+            scores = (self._matrix @ query.T).toarray().ravel()
+            for row in scores.argsort()[::-1]:
+                score = float(scores[row])
+                if score < self.similarity_threshold:
+                    return None
+                row_intent, row_key = self._rows[row]
+                if row_intent != intent:
+                    continue
+                # La fila puede haber vencido o salido de la caché desde el último ajuste
+                reply = self.entries.peek((row_intent, row_key))
+                if reply is not None:
+                    return ResponseHit(reply, score)
+        return None
+
+    def _refresh_index(self) -> bool:
+        """Reajusta o amplía la matriz TF-IDF. Retorna False si no hay índice usable."""
+        if self._sklearn_missing:
+            return False
+        if self._vectorizer is None or self._added > max(32, self._fitted // 4):
+            rows = self.entries.keys()
+            if not rows:
+                return False
+            try:
+                from sklearn.feature_extraction.text import TfidfVectorizer
+            except ImportError:
+                logger.warning("scikit-learn no está instalado: la caché de respuestas solo usa coincidencia exacta")
+                self._sklearn_missing = True
+                return False
+            vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4))
+            self._matrix = vectorizer.fit_transform([key for _, key in rows])
+            self._vectorizer = vectorizer
+            self._rows = rows
+            self._pending = []
+            self._added = 0
+            self._fitted = len(rows)
+        elif self._pending:
+            from scipy.sparse import vstack
+
+            self._matrix = vstack([self._matrix, self._vectorizer.transform([key for _, key in self._pending])]).tocsr()
+            self._rows.extend(self._pending)
+            self._pending = []
+        return True
+
+
+# Instancias compartidas por crud y main
+conversation_cache = ConversationCache.from_env()
+response_cache = ResponseCache.from_env()
@@ -0,0 +1,193 @@
+# calculator.py - Evaluador aritmético seguro para Fulano AI
+#
+# Reemplaza el eval() de tools.calculate: solo acepta números y operadores
+# aritméticos, y limita el tamaño de los operandos, los exponentes, la
+# cantidad de nodos y el tiempo de evaluación.
+
+import ast
+import math
+import operator
+import os
+import re
+import time
+from functools import lru_cache
+
+from intents import normalize_text
+
+MAX_EXPRESSION_LENGTH = int(os.getenv("CALC_MAX_LENGTH", "200"))
+MAX_NODES = int(os.getenv("CALC_MAX_NODES", "100"))
+MAX_EXPONENT = int(os.getenv("CALC_MAX_EXPONENT", "1000"))
+MAX_RESULT_BITS = int(os.getenv("CALC_MAX_BITS", "4096"))
+TIME_BUDGET_MS = float(os.getenv("CALC_TIME_BUDGET_MS", "50"))
+
+
+class CalculationError(ValueError):
+    """La expresión no es válida o excede los límites permitidos."""
+
+
+# ==========================
+# 📌 Frases en español → operadores
+# ==========================
+
+# El orden importa: las frases largas van primero
+_PHRASES = [
+    (r"elevado a la|elevado al|elevado a", "**"),
+    (r"al cuadrado", "**2"),
+    (r"al cubo", "**3"),
+    (r"dividido entre|dividido por|dividido en|entre|sobre", "/"),
+    (r"multiplicado por|veces|por", "*"),
+    (r"mas|sumado a|y", "+"),
+    (r"menos", "-"),
+    (r"modulo|mod", "%"),
+]
+_PHRASE_RE = [(re.compile(rf"\b(?:{pattern})\b"), symbol) for pattern, symbol in _PHRASES]
+
+_SYMBOLS = str.maketrans({"÷": "/", ",": "."})
+
+# Una expresión: números, operadores, paréntesis y espacios
+_EXPRESSION_RE = re.compile(r"[0-9.()+\-*/%^ ]*[0-9][0-9.()+\-*/%^ ]*")
+
+
+def extract_expression(text: str) -> str:
+    """
+    Convierte el mensaje del usuario en una expresión aritmética:
+    "cuánto es 8 por 8" -> "8*8", "2 elevado a 10" -> "2**10".
+    """
+    text = normalize_text(text)
+    for pattern, symbol in _PHRASE_RE:
+        text = pattern.sub(f" {symbol} ", text)
+    # "8x8" → "8*8", pero sin tocar palabras que tengan x
+    text = re.sub(r"(?<=[0-9)\s])[x×](?=[\s0-9(])", "*", text)
+    text = text.translate(_SYMBOLS).replace("^", "**")
+
+    candidates = [c.strip() for c in _EXPRESSION_RE.findall(text)]
+    candidates = [c for c in candidates if any(ch.isdigit() for ch in c)]
+    if not candidates:
+        raise CalculationError("No encontré una operación en el mensaje.")
+    expression = re.sub(r"\s+", "", max(candidates, key=len))
+    # "2+2 por favor" deja un "*" colgando al final
+    return expression.rstrip("+-*/%").lstrip("*/%")
+
+
+# ==========================
+# 📌 Evaluación sobre el AST
+# ==========================
+
+_BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+
+def _bits(value) -> float:
+    if isinstance(value, int):
+        return value.bit_length()
+    if value == 0 or not math.isfinite(value):
+        return 0
+    return max(math.log2(abs(value)), 0)
+
+
+def _check_size(value):
+    if isinstance(value, complex):
+        raise CalculationError("El resultado no es un número real.")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise CalculationError("El resultado es demasiado grande.")
+    if _bits(value) > MAX_RESULT_BITS:
+        raise CalculationError("El resultado es demasiado grande.")
+    return value
+
+
+def _power(base, exponent):
+    if abs(exponent) > MAX_EXPONENT:
+        raise CalculationError(f"El exponente no puede pasar de {MAX_EXPONENT}.")
+    # Estimar el tamaño del resultado antes de calcularlo
+    if _bits(base) * abs(exponent) > MAX_RESULT_BITS:
+        raise CalculationError("El resultado es demasiado grande.")
+    # (-8) ** 0.5 daría un número complejo
+    if base < 0 and not float(exponent).is_integer():
+        raise CalculationError("El resultado no es un número real.")
+    try:
+        return base ** exponent
+    except ZeroDivisionError:
+        raise CalculationError("No se puede dividir entre cero.")
+    except OverflowError:
+        raise CalculationError("El resultado es demasiado grande.")
+
+
+class _Evaluator:
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+
+    def visit(self, node):
+        if time.perf_counter() > self.deadline:
+            raise CalculationError("La operación tomó demasiado tiempo.")
+
+        if isinstance(node, ast.Expression):
+            return self.visit(node.body)
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return _check_size(node.value)
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+            return _UNARY[type(node.op)](self.visit(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            left = self.visit(node.left)
+            right = self.visit(node.right)
+            if isinstance(node.op, ast.Pow):
+                return _check_size(_power(left, right))
+            if isinstance(node.op, ast.Mult) and _bits(left) + _bits(right) > MAX_RESULT_BITS:
+                raise CalculationError("El resultado es demasiado grande.")
+            try:
+                return _check_size(_BINARY[type(node.op)](left, right))
+            except ZeroDivisionError:
+                raise CalculationError("No se puede dividir entre cero.")
+            except OverflowError:
+                raise CalculationError("El resultado es demasiado grande.")
+        raise CalculationError("Solo puedo hacer operaciones aritméticas.")
+
+
+@lru_cache(maxsize=1024)
+def _compile(expression: str) -> ast.Expression:
+    """Parsea y valida la expresión (se guarda en caché por texto)."""
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise CalculationError("La expresión es demasiado larga.")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        raise CalculationError("La expresión no es válida.")
+    if sum(1 for _ in ast.walk(tree)) > MAX_NODES:
+        raise CalculationError("La expresión es demasiado larga.")
+    return tree
+
+
+@lru_cache(maxsize=1024)
+def _evaluate_cached(expression: str):
+    tree = _compile(expression)
+    deadline = time.perf_counter() + TIME_BUDGET_MS / 1000
+    return _Evaluator(deadline).visit(tree)
+
+
+def evaluate(expression: str):
+    """
+    Evalúa una expresión aritmética ya extraída ("8*8", "2**10").
+    Lanza CalculationError si no es válida o excede los límites.
+    Las expresiones repetidas se responden desde la caché.
+    """
+    return _evaluate_cached(expression.replace(" ", ""))
+
+
+def format_result(value) -> str:
+    """20.0 → "20", 0.1 + 0.2 → "0.3"."""
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.10g}"
+    return str(value)
+
+
+def cache_info() -> dict:
+    return {"compiled": _compile.cache_info()._asdict(), "results": _evaluate_cached.cache_info()._asdict()}
@@ -1,6 +1,15 @@
+from sqlalchemy import and_, delete, insert, or_
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+import base64
+import metrics
 import models
+import queue
+from cache import conversation_cache
+from memory import conversation_memory
+from journal import GROUP
 import uuid
 
 
@@ -32,6 +41,39 @@ def get_conversation_by_id(db: Session, conversation_id: str):
     return db.query(models.Conversation).filter(models.Conversation.conversation_id == conversation_id).first()
 
 
+def resolve_conversation_pk(db: Session, conversation_id: str):
+    """
+    Retorna la llave primaria (Conversation.id) de una conversación a partir de
+    su ID público. Consulta primero la caché de conversaciones activas.
+    """
+    if not conversation_id:
+        return None
+    conversation_pk = conversation_cache.get_pk(conversation_id)
+    if conversation_pk is None:
+        conversation_pk = db.query(models.Conversation.id).filter(
+            models.Conversation.conversation_id == conversation_id
+        ).scalar()
+        if conversation_pk is not None:
+            conversation_cache.remember(conversation_id, conversation_pk)
+    return conversation_pk
+
+
+def get_recent_messages(db: Session, conversation_pk, limit: int = 50):
+    """
+    Los `limit` mensajes más recientes (orden cronológico) y si hay más viejos.
+    Se sirven desde la caché cuando está la cola de la conversación.
+    """
+    cached = conversation_cache.get_tail(conversation_pk, limit)
+    if cached is not None:
+        return cached
+
+    fetch = max(limit, conversation_cache.tail_size)
+    messages, has_more = get_messages_page(db, conversation_pk, limit=fetch)
+    if fetch == conversation_cache.tail_size:
+        conversation_cache.store_tail(conversation_pk, messages, complete=not has_more)
+    return messages[-limit:], has_more or len(messages) > limit
+
+
 # ==========================
 # 📌 Mensajes
 # ==========================
@@ -59,13 +101,386 @@ def get_messages_by_conversation(db: Session, conversation_id: int):
     return db.query(models.Message).filter(models.Message.conversation_id == conversation_id).order_by(models.Message.timestamp.asc()).all()
 
 
-def delete_conversation(db: Session, conversation_id: str):
+# ==========================
+# 📌 Paginación por cursor (keyset) sobre (timestamp, id)
+# ==========================
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(message: models.Message) -> str:
+    """
+    Cursor opaco que apunta a un mensaje: base64url de "timestamp|id".
+    """
+    raw = f"{message.timestamp.isoformat()}|{message.id.hex}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, message_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(hex=message_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidCursor(f"Cursor inválido: {cursor!r}") from exc
+
+
+def _after(cursor):
+    timestamp, message_id = cursor
+    return or_(
+        models.Message.timestamp > timestamp,
+        and_(models.Message.timestamp == timestamp, models.Message.id > message_id),
+    )
+
+
+def _before(cursor):
+    timestamp, message_id = cursor
+    return or_(
+        models.Message.timestamp < timestamp,
+        and_(models.Message.timestamp == timestamp, models.Message.id < message_id),
+    )
+
+
+def get_messages_page(db: Session, conversation_id, limit: int = 50, before: str = None, after: str = None):
+    """
+    Una página de mensajes en orden cronológico, usando el índice
+    (conversation_id, timestamp, id) en vez de OFFSET.
+
+    - after:  los `limit` mensajes siguientes al cursor.
+    - before: los `limit` mensajes anteriores al cursor.
+    - ninguno: los `limit` mensajes más recientes.
+
+    Retorna (mensajes, has_more), donde has_more indica si quedan mensajes
+    en la dirección consultada.
+    """
+    query = db.query(models.Message).filter(models.Message.conversation_id == conversation_id)
+    ascending = after is not None
+    if after is not None:
+        query = query.filter(_after(decode_cursor(after)))
+    if before is not None:
+        query = query.filter(_before(decode_cursor(before)))
+
+    if ascending:
+        query = query.order_by(models.Message.timestamp.asc(), models.Message.id.asc())
+    else:
+        query = query.order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+
+    messages = query.limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not ascending:
+        messages.reverse()
+    return messages, has_more
+
+
+def iter_messages(db: Session, conversation_id, after: str = None, batch_size: int = 500):
+    """
+    Recorre todos los mensajes de una conversación en orden con un cursor del
+    lado del servidor (yield_per), así la memoria no crece con el historial.
+    """
+    query = db.query(models.Message).filter(models.Message.conversation_id == conversation_id)
+    if after is not None:
+        query = query.filter(_after(decode_cursor(after)))
+    query = query.order_by(models.Message.timestamp.asc(), models.Message.id.asc())
+    yield from query.yield_per(batch_size)
+
+
+# ==========================
+# 📌 Turno completo (una sola transacción)
+# ==========================
+
+class TurnResult(NamedTuple):
+    conversation_pk: uuid.UUID  # Conversation.id
+    conversation_id: str        # Conversation.conversation_id (ID público)
+
+
+def turn_timestamps(received_at: datetime = None):
+    """(received_at, replied_at): la respuesta siempre queda después del mensaje."""
+    received_at = received_at or datetime.utcnow()
+    return received_at, max(datetime.utcnow(), received_at + timedelta(microseconds=1))
+
+
+def turn_rows(
+    conversation_pk,
+    user_content: str,
+    bot_content: str,
+    handled_by_gemini: bool,
+    received_at,
+    replied_at,
+    served_from_cache: bool = False,
+) -> list:
+    """Las dos filas de mensajes de un turno, listas para un INSERT masivo."""
+    return [
+        {
+            "id": uuid.uuid4(),
+            "conversation_id": conversation_pk,
+            "sender": "user",
+            "content": user_content,
+            "handled_by_gemini": False,
+            "served_from_cache": False,
+            "timestamp": received_at,
+        },
+        {
+            "id": uuid.uuid4(),
+            "conversation_id": conversation_pk,
+            "sender": "bot",
+            "content": bot_content,
+            "handled_by_gemini": handled_by_gemini,
+            "served_from_cache": served_from_cache,
+            "timestamp": replied_at,
+        },
+    ]
+
+
+def record_turn(
+    db: Session,
+    conversation_id: str,
+    user_content: str,
+    bot_content: str,
+    handled_by_gemini: bool = False,
+    received_at: datetime = None,
+    journal=None,
+    served_from_cache: bool = False,
+) -> "TurnResult":
     """
-    Elimina una conversación y sus mensajes.
+    Guarda un turno de chat (mensaje del usuario + respuesta del bot) con un
+    único commit. Busca (primero en la caché) o crea la conversación, inserta
+    los dos mensajes y confirma todo junto, sin refresh posteriores.
+
+    Los IDs y timestamps se generan aquí mismo para no tener que releer las
+    filas después del commit.
+
+    Si se pasa un `journal.MessageJournal` activo, los mensajes se encolan y
+    se escriben por lotes según su nivel de durabilidad.
     """
-    conversation = get_conversation_by_id(db, conversation_id)
-    if conversation:
-        db.delete(conversation)
+    with metrics.span("db.lookup"):
+        conversation_pk = resolve_conversation_pk(db, conversation_id)
+    turn = prepare_turn(
+        db, conversation_pk, conversation_id, user_content, bot_content, handled_by_gemini, received_at, served_from_cache
+    )
+    rows = turn.rows
+    pending = None
+
+    with metrics.span("db.persist"):
+        if journal is not None and journal.enabled:
+            # Write-behind: la conversación nueva sí se confirma ya (los mensajes
+            # tienen FK hacia ella); los mensajes se escriben en lote.
+            if turn.is_new:
+                _commit(db)
+            try:
+                pending = journal.append(rows)
+            except queue.Full:
+                bulk_insert_messages(db, rows)
+                _commit(db)
+            else:
+                if journal.durability == GROUP:
+                    journal.wait(pending)
+        else:
+            bulk_insert_messages(db, rows)
+            _commit(db)
+
+    return finish_turn(turn, pending)
+
+
+class PreparedTurn(NamedTuple):
+    conversation_pk: uuid.UUID
+    conversation_id: str
+    is_new: bool
+    rows: list  # filas de turn_rows
+
+
+def prepare_turn(
+    db,
+    conversation_pk,
+    conversation_id: str,
+    user_content: str,
+    bot_content: str,
+    handled_by_gemini: bool,
+    received_at: datetime = None,
+    served_from_cache: bool = False,
+) -> PreparedTurn:
+    """
+    Parte común de record_turn y crud_async.record_turn: con la llave ya
+    resuelta (None = conversación nueva), agrega la conversación nueva a la
+    sesión (Session o AsyncSession, db.add es igual) y arma las filas.
+    """
+    received_at, replied_at = turn_timestamps(received_at)
+    is_new = conversation_pk is None
+    if is_new:
+        conversation_pk = uuid.uuid4()
+        conversation_id = str(uuid.uuid4())
+        db.add(models.Conversation(
+            id=conversation_pk,
+            conversation_id=conversation_id,
+            created_at=received_at,
+        ))
+    rows = turn_rows(
+        conversation_pk, user_content, bot_content, handled_by_gemini, received_at, replied_at, served_from_cache
+    )
+    return PreparedTurn(conversation_pk, conversation_id, is_new, rows)
+
+
+def finish_turn(turn: PreparedTurn, pending=None) -> TurnResult:
+    """
+    Después de persistir: actualiza la caché de conversaciones y la memoria.
+    `pending` es el Future del journal si el turno quedó en cola: si al final
+    no se escribe, el turno se saca de la caché y de la memoria.
+    """
+    conversation_cache.remember(turn.conversation_id, turn.conversation_pk)
+    conversation_cache.append_messages(turn.conversation_pk, turn.rows, new_conversation=turn.is_new)
+    conversation_memory.add_messages(turn.conversation_pk, turn.rows, new_conversation=turn.is_new)
+    if pending is not None:
+        # Si el Future ya terminó, el callback corre aquí mismo
+        pending.add_done_callback(lambda future: _forget_if_lost(turn, future))
+    return TurnResult(conversation_pk=turn.conversation_pk, conversation_id=turn.conversation_id)
+
+
+def _forget_if_lost(turn: PreparedTurn, future):
+    if future.cancelled() or future.exception() is not None:
+        conversation_cache.invalidate(conversation_pk=turn.conversation_pk)
+        conversation_memory.invalidate(turn.conversation_pk)
+
+
+# ==========================
+# 📌 Turnos por lotes
+# ==========================
+
+class TurnInput(NamedTuple):
+    conversation_id: Optional[str]
+    user_content: str
+    bot_content: str
+    handled_by_gemini: bool = False
+
+
+def resolve_conversation_pks(db: Session, conversation_ids) -> dict:
+    """
+    ID público → llave primaria para varios IDs: primero la caché y luego una
+    sola consulta IN con los que falten.
+    """
+    resolved = {}
+    missing = []
+    for conversation_id in set(filter(None, conversation_ids)):
+        conversation_pk = conversation_cache.get_pk(conversation_id)
+        if conversation_pk is None:
+            missing.append(conversation_id)
+        else:
+            resolved[conversation_id] = conversation_pk
+
+    if missing:
+        rows = db.query(models.Conversation.conversation_id, models.Conversation.id).filter(
+            models.Conversation.conversation_id.in_(missing)
+        )
+        for conversation_id, conversation_pk in rows:
+            resolved[conversation_id] = conversation_pk
+            conversation_cache.remember(conversation_id, conversation_pk)
+    return resolved
+
+
+def record_turns(db: Session, turns: list, received_at: datetime = None) -> list:
+    """
+    Guarda muchos turnos (lista de TurnInput) en una sola transacción:
+    una consulta IN para las conversaciones, un INSERT masivo para las nuevas,
+    un INSERT masivo para todos los mensajes y un commit.
+
+    Los mensajes sin conversation_id abren cada uno una conversación nueva; los
+    que traen un ID desconocido comparten una conversación nueva por ID.
+    Retorna un TurnResult por turno, en el mismo orden.
+    """
+    received_at = received_at or datetime.utcnow()
+    known = resolve_conversation_pks(db, [turn.conversation_id for turn in turns])
+
+    created = {}  # ID desconocido enviado por el cliente → TurnResult nuevo
+    new_conversations = []
+    message_rows = []
+    results = []
+    tick = timedelta(microseconds=1)
+
+    for index, turn in enumerate(turns):
+        if turn.conversation_id in known:
+            result = TurnResult(known[turn.conversation_id], turn.conversation_id)
+        elif turn.conversation_id in created:
+            result = created[turn.conversation_id]
+        else:
+            result = TurnResult(uuid.uuid4(), str(uuid.uuid4()))
+            new_conversations.append({
+                "id": result.conversation_pk,
+                "conversation_id": result.conversation_id,
+                "created_at": received_at,
+            })
+            if turn.conversation_id:
+                created[turn.conversation_id] = result
+        results.append(result)
+
+        # Timestamps crecientes para conservar el orden dentro de cada conversación
+        user_at = received_at + tick * (2 * index)
+        message_rows.extend(turn_rows(
+            result.conversation_pk, turn.user_content, turn.bot_content, turn.handled_by_gemini, user_at, user_at + tick
+        ))
+
+    if new_conversations:
+        db.execute(insert(models.Conversation), new_conversations)
+    bulk_insert_messages(db, message_rows)
+    _commit(db)
+
+    new_pks = {row["id"] for row in new_conversations}
+    for result in set(results):
+        conversation_cache.remember(result.conversation_id, result.conversation_pk)
+    for result, start in zip(results, range(0, len(message_rows), 2)):
+        is_new = result.conversation_pk in new_pks
+        conversation_cache.append_messages(result.conversation_pk, message_rows[start:start + 2], new_conversation=is_new)
+        conversation_memory.add_messages(result.conversation_pk, message_rows[start:start + 2], new_conversation=is_new)
+        new_pks.discard(result.conversation_pk)
+    return results
+
+
+def bulk_insert_messages(db: Session, rows: list):
+    """
+    Inserta varios mensajes en un solo INSERT multi-fila (sin commit).
+    Antes hace flush de lo pendiente en la sesión para que las FKs existan.
+    """
+    if rows:
+        db.flush()
+        db.execute(insert(models.Message), rows)
+
+
+def _commit(db: Session):
+    try:
         db.commit()
-        return True
-    return False
+    except Exception:
+        db.rollback()
+        raise
+
+
+def delete_conversation(db: Session, conversation_id: str):
+    """
+    Elimina una conversación y sus mensajes (DELETE masivos, sin cargar filas).
+    """
+    conversation_pk = resolve_conversation_pk(db, conversation_id)
+    if conversation_pk is None:
+        return False
+    delete_conversations(db, [conversation_pk])
+    _commit(db)
+    conversation_cache.invalidate(conversation_id, conversation_pk)
+    conversation_memory.invalidate(conversation_pk)
+    return True
+
+
+def delete_conversations(db: Session, conversation_pks: list) -> int:
+    """
+    Borra varias conversaciones con sus mensajes en dos DELETE ... IN (sin
+    commit). Los mensajes se borran explícitamente: en Postgres la FK ya tiene
+    ON DELETE CASCADE, pero SQLite no aplica FKs por defecto.
+    Retorna cuántas conversaciones se borraron.
+    """
+    if not conversation_pks:
+        return 0
+    db.execute(
+        delete(models.Message).where(models.Message.conversation_id.in_(conversation_pks)),
+        execution_options={"synchronize_session": False},
+    )
+    result = db.execute(
+        delete(models.Conversation).where(models.Conversation.id.in_(conversation_pks)),
+        execution_options={"synchronize_session": False},
+    )
+    return result.rowcount
@@ -0,0 +1,160 @@
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+import metrics
+import models
+import queue
+from cache import conversation_cache
+from crud import TurnResult, _after, _before, decode_cursor, finish_turn, prepare_turn
+from journal import GROUP
+
+
+# ==========================
+# 📌 Variante async de crud.py
+# ==========================
+# Mismas reglas que crud.py (caché de conversaciones, cursores keyset, un solo
+# commit por turno) pero sobre AsyncSession: mientras se espera a la BD el
+# event loop sigue atendiendo otros requests, en vez de ocupar un hilo por request.
+
+
+async def resolve_conversation_pk(db: AsyncSession, conversation_id: str):
+    """
+    Retorna la llave primaria (Conversation.id) de una conversación a partir de
+    su ID público. Consulta primero la caché de conversaciones activas.
+    """
+    if not conversation_id:
+        return None
+    conversation_pk = conversation_cache.get_pk(conversation_id)
+    if conversation_pk is None:
+        conversation_pk = await db.scalar(
+            select(models.Conversation.id).where(models.Conversation.conversation_id == conversation_id)
+        )
+        if conversation_pk is not None:
+            conversation_cache.remember(conversation_id, conversation_pk)
+    return conversation_pk
+
+
+# ==========================
+# 📌 Mensajes (paginación por cursor)
+# ==========================
+
+def _messages_statement(conversation_id, before: str = None, after: str = None):
+    statement = select(models.Message).where(models.Message.conversation_id == conversation_id)
+    if after is not None:
+        statement = statement.where(_after(decode_cursor(after)))
+    if before is not None:
+        statement = statement.where(_before(decode_cursor(before)))
+    return statement
+
+
+async def get_messages_page(db: AsyncSession, conversation_id, limit: int = 50, before: str = None, after: str = None):
+    """
+    Igual que crud.get_messages_page: retorna (mensajes, has_more) en orden
+    cronológico usando el índice (conversation_id, timestamp, id).
+    """
+    statement = _messages_statement(conversation_id, before=before, after=after)
+    ascending = after is not None
+    if ascending:
+        statement = statement.order_by(models.Message.timestamp.asc(), models.Message.id.asc())
+    else:
+        statement = statement.order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+
+    messages = list(await db.scalars(statement.limit(limit + 1)))
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not ascending:
+        messages.reverse()
+    return messages, has_more
+
+
+async def get_recent_messages(db: AsyncSession, conversation_pk, limit: int = 50):
+    """
+    Los `limit` mensajes más recientes (orden cronológico) y si hay más viejos.
+    Se sirven desde la caché cuando está la cola de la conversación.
+    """
+    cached = conversation_cache.get_tail(conversation_pk, limit)
+    if cached is not None:
+        return cached
+
+    fetch = max(limit, conversation_cache.tail_size)
+    messages, has_more = await get_messages_page(db, conversation_pk, limit=fetch)
+    if fetch == conversation_cache.tail_size:
+        conversation_cache.store_tail(conversation_pk, messages, complete=not has_more)
+    return messages[-limit:], has_more or len(messages) > limit
+
+
+async def iter_messages(db: AsyncSession, conversation_id, after: str = None, batch_size: int = 500):
+    """
+    Recorre todos los mensajes de una conversación en orden con un cursor del
+    lado del servidor (session.stream + yield_per).
+    """
+    statement = _messages_statement(conversation_id, after=after).order_by(
+        models.Message.timestamp.asc(), models.Message.id.asc()
+    )
+    result = await db.stream_scalars(statement.execution_options(yield_per=batch_size))
+    async for message in result:
+        yield message
+
+
+# ==========================
+# 📌 Turno completo (una sola transacción)
+# ==========================
+
+async def record_turn(
+    db: AsyncSession,
+    conversation_id: str,
+    user_content: str,
+    bot_content: str,
+    handled_by_gemini: bool = False,
+    received_at: datetime = None,
+    journal=None,
+    served_from_cache: bool = False,
+) -> TurnResult:
+    """
+    Igual que crud.record_turn, sin bloquear el event loop: la espera del
+    journal (durabilidad "group") se hace con journal.wait_async y, si la
+    cola está llena, se escribe directo en vez de esperar a que se libere.
+    """
+    with metrics.span("db.lookup"):
+        conversation_pk = await resolve_conversation_pk(db, conversation_id)
+    turn = prepare_turn(
+        db, conversation_pk, conversation_id, user_content, bot_content, handled_by_gemini, received_at, served_from_cache
+    )
+    rows = turn.rows
+    pending = None
+
+    with metrics.span("db.persist"):
+        if journal is not None and journal.enabled:
+            if turn.is_new:
+                await _commit(db)
+            try:
+                pending = journal.append(rows, timeout=0)
+            except queue.Full:
+                await bulk_insert_messages(db, rows)
+                await _commit(db)
+            else:
+                if journal.durability == GROUP:
+                    await journal.wait_async(pending)
+        else:
+            await bulk_insert_messages(db, rows)
+            await _commit(db)
+
+    return finish_turn(turn, pending)
+
+
+async def bulk_insert_messages(db: AsyncSession, rows: list):
+    """
+    Inserta varios mensajes en un solo INSERT multi-fila (sin commit).
+    Antes hace flush de lo pendiente en la sesión para que las FKs existan.
+    """
+    if rows:
+        await db.flush()
+        await db.execute(insert(models.Message), rows)
+
+
+async def _commit(db: AsyncSession):
+    try:
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
@@ -1,32 +1,122 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+import metrics
+
 # Cargar variables de entorno (Render también las maneja automáticamente)
 load_dotenv()
 
-# URL de la base de datos desde Render
-DATABASE_URL = os.getenv("DATABASE_URL")
+# El motor se crea en el lifespan de la app (init_engine), no al importar:
+# así la app se puede importar sin DATABASE_URL (tests, chequeos de arranque).
+engine = None
 
-if not DATABASE_URL:
-    raise ValueError("❌ No se encontró la variable DATABASE_URL. Verifica en Render Config Vars.")
+# SessionLocal → se usará en las rutas para obtener la sesión (se enlaza al motor en init_engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
-# Render entrega la URL con "postgres://", pero SQLAlchemy requiere "postgresql://"
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+# Motor async para los endpoints `async def` (chat, historial). El motor sync
+# se queda para migraciones, el journal, benchmarks y trabajos por lotes.
+async_engine = None
 
-# Crear el motor de conexión
-engine = create_engine(DATABASE_URL)
+# expire_on_commit=False: en async no hay lazy loads implícitos después del commit
+AsyncSessionLocal = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
-# SessionLocal → se usará en las rutas para obtener la sesión
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Driver async por motor de BD (aiosqlite para pruebas locales)
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
 
 # Base para los modelos
 Base = declarative_base()
 
 
+def get_database_url() -> str:
+    # URL de la base de datos desde Render
+    database_url = os.getenv("DATABASE_URL")
+
+    if not database_url:
+        raise ValueError("❌ No se encontró la variable DATABASE_URL. Verifica en Render Config Vars.")
+
+    # Render entrega la URL con "postgres://", pero SQLAlchemy requiere "postgresql://"
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    return database_url
+
+
+def init_engine(database_url: str = None):
+    """
+    Crea el motor de conexión (si no existe) y enlaza SessionLocal.
+    create_engine no abre conexiones: la primera se abre con la primera consulta.
+    """
+    global engine
+    if engine is None:
+        engine = create_engine(database_url or get_database_url())
+        metrics.instrument_engine(engine)
+        SessionLocal.configure(bind=engine)
+    return engine
+
+
+def get_engine():
+    return engine if engine is not None else init_engine()
+
+
+def dispose_engine():
+    global engine
+    if engine is not None:
+        engine.dispose()
+        engine = None
+
+
+# ==========================
+# 📌 Motor async
+# ==========================
+
+def get_async_database_url(database_url: str = None) -> str:
+    """
+    La misma URL con el driver async: postgresql → postgresql+asyncpg,
+    sqlite → sqlite+aiosqlite. asyncpg no entiende `sslmode`: se pasa como `ssl`.
+    """
+    url = make_url(database_url or get_database_url())
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"❌ No hay driver async configurado para {url.get_backend_name()!r}")
+    url = url.set(drivername=driver)
+    if driver == "postgresql+asyncpg" and "sslmode" in url.query:
+        query = dict(url.query)
+        query["ssl"] = query.pop("sslmode")
+        url = url.set(query=query)
+    return url.render_as_string(hide_password=False)
+
+
+def init_async_engine(database_url: str = None):
+    """
+    Crea el AsyncEngine (si no existe) y enlaza AsyncSessionLocal.
+    Las métricas de SQL se registran sobre su motor sync interno.
+    """
+    global async_engine
+    if async_engine is None:
+        async_engine = create_async_engine(get_async_database_url(database_url))
+        metrics.instrument_engine(async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=async_engine)
+    return async_engine
+
+
+def get_async_engine():
+    return async_engine if async_engine is not None else init_async_engine()
+
+
+async def dispose_async_engine():
+    global async_engine
+    if async_engine is not None:
+        await async_engine.dispose()
+        async_engine = None
+
+
 # ==========================
 # 📌 Dependencia para FastAPI
 # ==========================
@@ -35,8 +125,18 @@ def get_db():
     Genera una sesión de BD para inyectar en los endpoints de FastAPI.
     Se asegura de cerrarla después de usarla.
     """
+    get_engine()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """
+    Igual que get_db pero con AsyncSession, para los endpoints `async def`.
+    """
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,330 @@
+# export.py - Exportación masiva de mensajes para análisis y reentrenamiento
+#
+# Uso:
+#   python export.py [--since 2026-10-01] [--until 2026-10-18] [--format jsonl|parquet|arrow]
+#                    [--output exports/mensajes.jsonl.gz] [--watermark-file exports/watermark] [--after CURSOR]
+#
+# Recorre todos los mensajes del rango [since, until) en orden (timestamp, id)
+# por páginas keyset de `batch_size` filas, cada una en su propia transacción
+# corta y leída con cursor del lado del servidor (yield_per): la memoria no
+# depende del tamaño del rango y no se sostiene ninguna transacción larga.
+# Cada página se escribe y se comprime de una vez (JSONL.gz, un row group de
+# Parquet o un record batch de Arrow).
+#
+# Cada registro es el mismo de archive.py más `cursor` (timestamp|id, igual que
+# los cursores de /api/history): el último exportado es la marca de agua desde
+# la que sigue la próxima exportación (--after o --watermark-file). Los mensajes
+# ya archivados no están en la BD: sus archivos usan el mismo formato de registro.
+#
+# El rango nunca llega hasta "ahora": se corta EXPORT_SAFETY_LAG_SECONDS antes
+# (ver safe_until), para que la marca de agua no pase por encima de turnos que
+# todavía no han hecho commit.
+#
+# pyarrow solo se importa para parquet/arrow.
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import select
+
+import crud
+import generation
+import models
+from archive import message_record
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("jsonl", "parquet", "arrow")
+EXTENSIONS = {"jsonl": ".jsonl.gz", "parquet": ".parquet", "arrow": ".arrow"}
+MEDIA_TYPES = {"jsonl": "application/gzip", "parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.stream"}
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+
+def _default_safety_lag() -> float:
+    """
+    El timestamp de un mensaje es la llegada del request (received_at), pero su
+    fila se ve hasta que termina la generación (GENERATION_TIMEOUT), las
+    herramientas y el flush del journal; se deja un minuto más de margen.
+    """
+    journal_flush = int(os.getenv("MESSAGE_JOURNAL_FLUSH_MS", "50")) / 1000
+    return generation.GENERATION_TIMEOUT + journal_flush + 60
+
+
+EXPORT_SAFETY_LAG = float(os.getenv("EXPORT_SAFETY_LAG_SECONDS", "0")) or _default_safety_lag()
+
+
+class ExportUnavailable(Exception):
+    """El formato pedido necesita pyarrow y no está instalado."""
+
+
+def check_format(fmt: str):
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato inválido: {fmt!r} (usa {', '.join(FORMATS)})")
+    if fmt != "jsonl" and importlib.util.find_spec("pyarrow") is None:
+        raise ExportUnavailable(f"El formato {fmt} necesita pyarrow (pip install pyarrow)")
+
+
+# ==========================
+# 📌 Lectura por páginas
+# ==========================
+
+def _naive_utc(value: datetime):
+    """Los timestamps se guardan en UTC sin zona: las fechas con zona se convierten."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def safe_until(until: datetime = None) -> datetime:
+    """`until` (por defecto ahora) sin pasar de now - EXPORT_SAFETY_LAG."""
+    limit = datetime.utcnow() - timedelta(seconds=EXPORT_SAFETY_LAG)
+    until = _naive_utc(until)
+    return limit if until is None else min(until, limit)
+
+
+def iter_pages(session_factory, since: datetime = None, until: datetime = None, after: str = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Páginas (listas de registros) de los mensajes del rango en orden
+    (timestamp, id). `after` (cursor) tiene prioridad sobre `since`.
+    `until` se recorta con safe_until.
+    """
+    cursor = crud.decode_cursor(after) if after else None
+    since, until = _naive_utc(since), safe_until(until)
+    while True:
+        statement = (
+            select(models.Message, models.Conversation.conversation_id)
+            .join(models.Conversation, models.Conversation.id == models.Message.conversation_id)
+            .order_by(models.Message.timestamp, models.Message.id)
+            .limit(batch_size)
+            .execution_options(yield_per=min(batch_size, 1000))
+        )
+        if cursor is not None:
+            statement = statement.where(crud._after(cursor))
+        elif since is not None:
+            statement = statement.where(models.Message.timestamp >= since)
+        statement = statement.where(models.Message.timestamp < until)
+
+        page = []
+        with session_factory() as db:
+            for message, conversation_id in db.execute(statement):
+                record = message_record(conversation_id, message)
+                record["cursor"] = crud.encode_cursor(message)
+                page.append(record)
+                cursor = (message.timestamp, message.id)
+        if page:
+            yield page
+        if len(page) < batch_size:
+            return
+
+
+# ==========================
+# 📌 Escritores por formato
+# ==========================
+
+class _Chunks:
+    """Destino en memoria que se vacía después de cada página (streaming HTTP)."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+class JsonlWriter:
+    def __init__(self, sink, compresslevel: int = 6):
+        self.sink = sink
+        # gzip en streaming (wbits=31 → encabezado gzip), comprimido página a página
+        self._compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+
+    def write_page(self, records: list):
+        payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        self.sink.write(self._compressor.compress(payload.encode("utf-8")))
+        self.sink.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def close(self):
+        self.sink.write(self._compressor.flush())
+
+
+class _ArrowWriter:
+    """Base de parquet/arrow: convierte cada página en un RecordBatch tipado."""
+
+    def __init__(self, sink):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.sink = sink
+        self.schema = pa.schema([
+            ("conversation_id", pa.string()),
+            ("id", pa.string()),
+            ("sender", pa.string()),
+            ("content", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+            ("handled_by_gemini", pa.bool_()),
+            ("served_from_cache", pa.bool_()),
+            ("cursor", pa.string()),
+        ])
+        self._writer = None
+
+    def _batch(self, records: list):
+        pa = self.pa
+        columns = []
+        for field in self.schema:
+            values = [record[field.name] for record in records]
+            if field.name == "timestamp":
+                columns.append(pa.array(values, pa.string()).cast(field.type))
+            else:
+                columns.append(pa.array(values, field.type))
+        return pa.RecordBatch.from_arrays(columns, schema=self.schema)
+
+    def close(self):
+        if self._writer is None:
+            self._open()
+        self._writer.close()
+
+
+class ParquetWriter(_ArrowWriter):
+    def _open(self):
+        import pyarrow.parquet as pq
+
+        self._writer = pq.ParquetWriter(self.sink, self.schema, compression="zstd")
+
+    def write_page(self, records: list):
+        if self._writer is None:
+            self._open()
+        # Un row group por página
+        self._writer.write_batch(self._batch(records))
+
+
+class ArrowStreamWriter(_ArrowWriter):
+    def _open(self):
+        import pyarrow as pa
+
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        self._writer = pa.ipc.new_stream(self.sink, self.schema, options=options)
+
+    def write_page(self, records: list):
+        if self._writer is None:
+            self._open()
+        self._writer.write_batch(self._batch(records))
+
+
+WRITERS = {"jsonl": JsonlWriter, "parquet": ParquetWriter, "arrow": ArrowStreamWriter}
+
+
+# ==========================
+# 📌 Exportación
+# ==========================
+
+def stream_export(session_factory, fmt: str = "jsonl", since: datetime = None, until: datetime = None, after: str = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """Bytes del archivo exportado, página por página (para StreamingResponse)."""
+    check_format(fmt)
+    sink = _Chunks()
+    writer = WRITERS[fmt](sink)
+    for page in iter_pages(session_factory, since=since, until=until, after=after, batch_size=batch_size):
+        writer.write_page(page)
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield sink.drain()
+
+
+def export_to_file(session_factory, path, fmt: str = "jsonl", since: datetime = None, until: datetime = None, after: str = None, batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """
+    Exporta a `path` (vía un .tmp que se renombra al terminar). Retorna
+    {"messages", "pages", "watermark"}; sin mensajes nuevos, la marca de agua
+    es `after`.
+    """
+    check_format(fmt)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    totals = {"messages": 0, "pages": 0, "watermark": after}
+    with open(tmp_path, "wb") as sink:
+        writer = WRITERS[fmt](sink)
+        for page in iter_pages(session_factory, since=since, until=until, after=after, batch_size=batch_size):
+            writer.write_page(page)
+            totals["messages"] += len(page)
+            totals["pages"] += 1
+            totals["watermark"] = page[-1]["cursor"]
+        writer.close()
+        sink.flush()
+        os.fsync(sink.fileno())
+    os.replace(tmp_path, path)
+    return totals
+
+
+def _read_watermark(path):
+    try:
+        return Path(path).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_watermark(path, cursor: str):
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(cursor + "\n")
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exportación de mensajes de Fulano AI")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="desde (inclusive, UTC)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="hasta (exclusivo, UTC; como mucho ahora - EXPORT_SAFETY_LAG_SECONDS)")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--output", help="archivo de salida (por defecto exports/mensajes-<fecha><ext>)")
+    parser.add_argument("--after", help="cursor desde el que se continúa (marca de agua)")
+    parser.add_argument("--watermark-file", help="lee la marca de agua de aquí y la actualiza al terminar")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    until = safe_until(args.until)
+    after = args.after or (_read_watermark(args.watermark_file) if args.watermark_file else None)
+    if after:
+        crud.decode_cursor(after)
+    output = args.output or os.path.join("exports", f"mensajes-{until:%Y%m%dT%H%M%S}{EXTENSIONS[args.format]}")
+
+    from database import SessionLocal, init_engine
+    from migrations import ensure_schema
+
+    ensure_schema(init_engine(), auto_upgrade=False)
+    totals = export_to_file(
+        SessionLocal, output, fmt=args.format, since=args.since, until=until, after=after, batch_size=args.batch_size,
+    )
+    if args.watermark_file and totals["watermark"]:
+        _write_watermark(args.watermark_file, totals["watermark"])
+    print(f"✅ {totals['messages']} mensajes en {output} (marca de agua: {totals['watermark']})")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
@@ -0,0 +1,259 @@
+# generation.py - Backends de generación de texto (fallback con LLM) para Fulano AI
+#
+# Los mensajes que no caen en ningún intent ("desconocido") se responden con un
+# modelo. Cada backend implementa `stream(prompt)`: un generador async que
+# entrega el texto por fragmentos a medida que el modelo los produce.
+#
+# - StubBackend:   determinístico y local (tests, desarrollo, sin API key)
+# - GeminiBackend: Google Gemini (google-generativeai se importa al primer uso)
+#
+# GENERATION_BACKEND elige el backend: stub (por defecto) | gemini
+
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import AsyncIterator, NamedTuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "20"))             # segundos por respuesta completa
+GENERATION_HISTORY_MESSAGES = int(os.getenv("GENERATION_HISTORY_MESSAGES", "6"))  # mensajes previos en el prompt
+GENERATION_MEMORY_RESULTS = int(os.getenv("GENERATION_MEMORY_RESULTS", "3"))      # mensajes viejos relevantes (memoria)
+
+# Respuesta cuando no hay modelo o el modelo falla antes de producir texto
+FALLBACK_REPLY = "No entendí bien, pero dime otra vez y lo resolvemos."
+
+SYSTEM_PROMPT = (
+    "Eres Fulano, un asistente virtual colombiano, amable y con buen humor. "
+    "Responde siempre en español y en pocas frases."
+)
+
+
+class GenerationError(Exception):
+    """El backend no pudo generar una respuesta."""
+
+
+# ==========================
+# 📌 Prompt
+# ==========================
+
+def build_prompt(message: str, history=(), memories=()) -> str:
+    """
+    Prompt de texto plano: instrucciones, mensajes anteriores relevantes
+    (memoria), los últimos mensajes de la conversación (objetos con .sender y
+    .content) y el mensaje nuevo.
+    """
+    lines = [SYSTEM_PROMPT]
+    if memories:
+        lines.append("")
+        lines.append("Mensajes anteriores que pueden servir:")
+        for msg in memories:
+            speaker = "Usuario" if msg.sender == "user" else "Fulano"
+            lines.append(f"- {speaker}: {msg.content}")
+    if history:
+        lines.append("")
+        lines.append("Conversación reciente:")
+        for msg in history:
+            speaker = "Usuario" if msg.sender == "user" else "Fulano"
+            lines.append(f"{speaker}: {msg.content}")
+    lines.append("")
+    lines.append(f"Usuario: {message}")
+    lines.append("Fulano:")
+    return "\n".join(lines)
+
+
+# ==========================
+# 📌 Backends
+# ==========================
+
+class GenerationBackend:
+    """
+    Interfaz de los backends. `uses_model` indica si la respuesta sale de un
+    LLM (se guarda como Message.handled_by_gemini).
+    """
+
+    name = "base"
+    uses_model = True
+
+    @classmethod
+    def from_env(cls):
+        return cls()
+
+    def stream(self, prompt: str) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+
+class StubBackend(GenerationBackend):
+    """
+    Backend local y determinístico: siempre la misma respuesta, entregada
+    palabra por palabra (con `delay_ms` entre fragmentos para simular un modelo).
+    """
+
+    name = "stub"
+    uses_model = False
+
+    def __init__(self, reply: str = FALLBACK_REPLY, delay_ms: float = 0):
+        self.reply = reply
+        self.delay = delay_ms / 1000
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            reply=os.getenv("GENERATION_STUB_REPLY", FALLBACK_REPLY),
+            delay_ms=float(os.getenv("GENERATION_STUB_DELAY_MS", "0")),
+        )
+
+    async def stream(self, prompt: str):
+        for token in re.findall(r"\S+\s*", self.reply):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield token
+
+
+class GeminiBackend(GenerationBackend):
+    """Google Gemini con streaming (generate_content_async(stream=True))."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = "gemini-1.5-flash"):
+        if not api_key:
+            raise ValueError("❌ GENERATION_BACKEND=gemini requiere GEMINI_API_KEY")
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            api_key=os.getenv("GEMINI_API_KEY"),
+            model_name=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+        )
+
+    def _get_model(self):
+        # La librería de Google es pesada (grpc): se importa con el primer mensaje
+        if self._model is None:
+            import google.generativeai as genai
+
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    async def stream(self, prompt: str):
+        response = await self._get_model().generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Fragmento sin texto (p. ej. bloqueado por filtros de seguridad)
+                continue
+            if text:
+                yield text
+
+
+BACKENDS = {
+    "stub": StubBackend,
+    "gemini": GeminiBackend,
+}
+
+
+def create_backend(name: str = None) -> GenerationBackend:
+    name = (name or os.getenv("GENERATION_BACKEND", "stub")).strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"GENERATION_BACKEND inválido: {name!r} (usa {', '.join(BACKENDS)})")
+    return BACKENDS[name].from_env()
+
+
+# Se crea con el primer uso (o en el lifespan de main.py): una configuración
+# inválida falla al arrancar la app, no al importar el módulo.
+generation_backend = None
+
+
+def get_backend() -> GenerationBackend:
+    global generation_backend
+    if generation_backend is None:
+        generation_backend = create_backend()
+    return generation_backend
+
+
+# ==========================
+# 📌 Respuestas
+# ==========================
+
+class ReplyStream:
+    """
+    Fragmentos de una respuesta con deadline y respaldo:
+        stream = ReplyStream(prompt)
+        async for chunk in stream:
+            ...
+        stream.text, stream.handled_by_model
+    Si el backend falla antes del primer fragmento se entrega FALLBACK_REPLY;
+    si falla a mitad de camino, la respuesta queda con lo que alcanzó a llegar.
+    """
+
+    def __init__(self, prompt: str, backend: GenerationBackend = None, timeout: float = GENERATION_TIMEOUT):
+        self.prompt = prompt
+        self.backend = backend or get_backend()
+        self.timeout = timeout
+        self.chunks = []
+        self.handled_by_model = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks).strip()
+
+    async def __aiter__(self):
+        backend = self.backend
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        iterator = backend.stream(self.prompt).__aiter__()
+        try:
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise GenerationError(f"{backend.name}: sin respuesta completa en {self.timeout}s")
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise GenerationError(f"{backend.name}: sin respuesta completa en {self.timeout}s")
+                if not self.chunks:
+                    metrics.generation_first_token.observe(time.perf_counter() - started, backend.name)
+                self.chunks.append(chunk)
+                yield chunk
+            self.handled_by_model = backend.uses_model and bool(self.chunks)
+        except Exception as e:
+            logger.warning(
+                "Falló el backend de generación %s: %s", backend.name, e, exc_info=not isinstance(e, GenerationError)
+            )
+            metrics.generation_errors.inc(backend.name)
+            if self.chunks:
+                self.handled_by_model = backend.uses_model
+            else:
+                self.chunks.append(FALLBACK_REPLY)
+                yield FALLBACK_REPLY
+        finally:
+            metrics.generation_duration.observe(time.perf_counter() - started, backend.name)
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        if not self.chunks:
+            self.chunks.append(FALLBACK_REPLY)
+            yield FALLBACK_REPLY
+
+
+class Generated(NamedTuple):
+    text: str
+    handled_by_model: bool
+
+
+async def generate_reply(prompt: str, backend: GenerationBackend = None) -> Generated:
+    """La respuesta completa (sin streaming)."""
+    stream = ReplyStream(prompt, backend=backend)
+    async for _ in stream:
+        pass
+    return Generated(stream.text, stream.handled_by_model)
@@ -0,0 +1,230 @@
+# http_client.py - Cliente HTTP compartido para las herramientas externas de Fulano AI
+#
+# - Pool de conexiones con keep-alive (requests.Session / httpx.AsyncClient)
+# - Timeouts de conexión y lectura por herramienta
+# - Caché TTL por herramienta y argumentos (clima por ciudad, tasa por par...)
+# - Coalescencia: N requests idénticos concurrentes → 1 llamada al upstream
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import NamedTuple
+
+from cache import LRUTTLCache
+
+
+class ToolConfig(NamedTuple):
+    connect_timeout: float  # segundos
+    read_timeout: float     # segundos
+    ttl: float              # segundos que se guarda una respuesta exitosa (0 = sin caché)
+
+
+TOOL_CONFIG = {
+    "weather": ToolConfig(connect_timeout=2.0, read_timeout=4.0, ttl=600),
+    "news": ToolConfig(connect_timeout=2.0, read_timeout=5.0, ttl=900),
+    "translate": ToolConfig(connect_timeout=2.0, read_timeout=4.0, ttl=86400),
+    "pokemon": ToolConfig(connect_timeout=2.0, read_timeout=5.0, ttl=86400),
+    "exchange_rate": ToolConfig(connect_timeout=2.0, read_timeout=4.0, ttl=3600),
+}
+DEFAULT_CONFIG = ToolConfig(connect_timeout=2.0, read_timeout=5.0, ttl=0)
+
+
+class UpstreamError(Exception):
+    """El servicio externo respondió con un código de error HTTP."""
+
+    def __init__(self, tool: str, status_code: int, payload=None):
+        super().__init__(f"{tool}: HTTP {status_code}")
+        self.tool = tool
+        self.status_code = status_code
+        self.payload = payload
+
+
+class HTTPClient:
+    """
+    Cliente compartido por todas las herramientas. Las sesiones se crean al
+    primer uso para no importar requests/httpx al arrancar.
+    """
+
+    def __init__(self, pool_maxsize: int = 20, cache_size: int = 2048):
+        self.pool_maxsize = pool_maxsize
+        self.cache = LRUTTLCache(maxsize=cache_size)
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+        self._session = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self._inflight = {}        # key → concurrent.futures.Future (sync)
+        self._async_inflight = {}  # key → asyncio.Future (async)
+
+    # ==========================
+    # 📌 Sesiones
+    # ==========================
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=len(TOOL_CONFIG), pool_maxsize=self.pool_maxsize)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            import httpx
+
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize),
+            )
+        return self._async_client
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def aclose(self):
+        """Cierra el AsyncClient (lifespan de main); se vuelve a crear al siguiente uso."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    # ==========================
+    # 📌 GET JSON (sync)
+    # ==========================
+
+    def get_json(self, tool: str, url: str, params: dict = None, cache_key=None):
+        """
+        GET que retorna el JSON de la respuesta. Las respuestas 2xx se guardan
+        `ttl` segundos bajo (tool, cache_key); si no se da cache_key se usa la
+        URL con sus parámetros. Lanza UpstreamError para códigos != 2xx.
+        """
+        config = TOOL_CONFIG.get(tool, DEFAULT_CONFIG)
+        key = _make_key(tool, url, params, cache_key)
+
+        cached = self.cache.get(key) if config.ttl else None
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result(timeout=config.connect_timeout + config.read_timeout)
+
+        try:
+            self.upstream_calls += 1
+            response = self.session.get(
+                url, params=params, timeout=(config.connect_timeout, config.read_timeout)
+            )
+            data = _json_or_raise(tool, response)
+            if config.ttl:
+                self.cache.set(key, data, ttl=config.ttl)
+            future.set_result(data)
+            return data
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    # ==========================
+    # 📌 GET JSON (async)
+    # ==========================
+
+    async def aget_json(self, tool: str, url: str, params: dict = None, cache_key=None):
+        """Igual que get_json pero con httpx.AsyncClient (requiere httpx)."""
+        import httpx
+
+        config = TOOL_CONFIG.get(tool, DEFAULT_CONFIG)
+        key = _make_key(tool, url, params, cache_key)
+
+        cached = self.cache.get(key) if config.ttl else None
+        if cached is not None:
+            return cached
+
+        future = self._async_inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_inflight[key] = future
+        try:
+            self.upstream_calls += 1
+            timeout = httpx.Timeout(config.read_timeout, connect=config.connect_timeout)
+            response = await self.async_client.get(url, params=params, timeout=timeout)
+            data = _json_or_raise(tool, response)
+            if config.ttl:
+                self.cache.set(key, data, ttl=config.ttl)
+            future.set_result(data)
+            return data
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Si nadie más esperaba este future, evita el aviso de "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._async_inflight.pop(key, None)
+
+    def is_warm(self, tool: str, cache_key) -> bool:
+        """
+        True si la respuesta de (tool, cache_key) está en la caché o ya hay una
+        llamada en vuelo que la va a traer (el scheduler no gasta un cupo en esas).
+        """
+        key = (tool, cache_key)
+        if self.cache.peek(key) is not None:
+            return True
+        with self._lock:
+            return key in self._inflight or key in self._async_inflight
+
+    def stats(self) -> dict:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight) + len(self._async_inflight),
+            "cache": self.cache.stats(),
+        }
+
+
+def _json_or_raise(tool: str, response):
+    """
+    JSON de una respuesta 2xx. Con otro código lanza UpstreamError antes de
+    parsear: el cuerpo puede ser una página de error HTML.
+    """
+    if not 200 <= response.status_code < 300:
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        raise UpstreamError(tool, response.status_code, payload)
+    return response.json()
+
+
+def _make_key(tool: str, url: str, params, cache_key):
+    if cache_key is not None:
+        return (tool, cache_key)
+    return (tool, url, tuple(sorted((params or {}).items())))
+
+
+# Instancia compartida por tools.py
+http_client = HTTPClient(pool_maxsize=int(os.getenv("HTTP_POOL_SIZE", "20")))
@@ -1,4 +1,7 @@
-import random
+import re
+import unicodedata
+from collections import deque
+from typing import List, NamedTuple, Optional, Tuple
 
 # Lista de intenciones con ejemplos y respuestas
 INTENTS = [
@@ -57,11 +60,168 @@ INTENTS = [
 # Diccionario rápido de respuestas
 INTENT_RESPONSES = {intent["name"]: intent["responses"] for intent in INTENTS}
 
-# Función simple para predecir intención
-def predict_intent(text: str) -> str:
-    text = text.lower()
-    for intent in INTENTS:
+UNKNOWN_INTENT = "desconocido"
+
+
+# ==========================
+# 📌 Normalización de texto
+# ==========================
+
+def normalize_text(text: str) -> str:
+    """
+    Pasa el texto a minúsculas y le quita las tildes ("Qué" -> "que").
+    """
+    return _normalize_with_offsets(text)[0]
+
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """Palabras normalizadas: "¿Qué es BM25?" -> ["que", "es", "bm25"]."""
+    return _WORD.findall(normalize_text(text or ""))
+
+
+def _normalize_with_offsets(text: str):
+    """
+    Normaliza carácter por carácter y guarda, para cada carácter normalizado,
+    su posición en el texto original. Así los spans se pueden devolver sobre
+    el mensaje tal como lo escribió el usuario.
+    """
+    chars = []
+    offsets = []
+    for index, char in enumerate(text):
+        for piece in unicodedata.normalize("NFKD", char.casefold()):
+            if not unicodedata.combining(piece):
+                chars.append(piece)
+                offsets.append(index)
+    return "".join(chars), offsets
+
+
+# ==========================
+# 📌 Autómata Aho-Corasick
+# ==========================
+
+class IntentMatch(NamedTuple):
+    name: str
+    span: Optional[Tuple[int, int]]  # posiciones [inicio, fin) en el texto original
+    score: float                     # fracción del mensaje cubierta por el ejemplo
+    example: Optional[str] = None
+
+
+class _Automaton:
+    """
+    Autómata Aho-Corasick sobre los ejemplos normalizados. Se construye una
+    sola vez y recorre cada mensaje en una pasada, así que el costo por mensaje
+    depende del largo del texto y no de cuántos ejemplos haya.
+    """
+
+    def __init__(self, patterns):
+        # patterns: lista de (texto normalizado, prioridad, nombre del intent, ejemplo)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern in patterns:
+            node = 0
+            for char in pattern[0]:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append(pattern)
+
+        # Enlaces de fallo en anchura (BFS)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text: str):
+        """
+        Retorna (fin, patrón) por cada ejemplo encontrado en el texto.
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for end, char in enumerate(text, start=1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern in output[node]:
+                yield end, pattern
+
+
+def _build_automaton(intents) -> _Automaton:
+    patterns = []
+    for priority, intent in enumerate(intents):
         for example in intent["examples"]:
-            if example in text:
-                return intent["name"]
-    return "desconocido"
+            normalized = normalize_text(example)
+            if normalized:
+                patterns.append((normalized, priority, intent["name"], example))
+    return _Automaton(patterns)
+
+
+# Se construye al importar el módulo
+_AUTOMATON = _build_automaton(INTENTS)
+
+
+# ==========================
+# 📌 Predicción de intención
+# ==========================
+
+def match_intent(text: str) -> IntentMatch:
+    """
+    Detecta la intención del texto y retorna el intent, el span del ejemplo
+    encontrado y un puntaje. Los ejemplos solo cuentan como palabras completas
+    ("hola" no coincide dentro de "Holanda"). Si varios intents coinciden gana
+    el que aparece primero en INTENTS (igual que antes), luego el ejemplo más largo.
+    """
+    normalized, offsets = _normalize_with_offsets(text)
+    best = None
+    for end, (pattern, priority, name, example) in _AUTOMATON.search(normalized):
+        if not _is_whole_word(normalized, end - len(pattern), end):
+            continue
+        key = (priority, -len(pattern), end - len(pattern))
+        if best is None or key < best[0]:
+            best = (key, end, pattern, name, example)
+
+    if best is None:
+        return IntentMatch(UNKNOWN_INTENT, None, 0.0)
+
+    _, end, pattern, name, example = best
+    start = end - len(pattern)
+    span = (offsets[start], offsets[end - 1] + 1)
+    score = round(len(pattern) / len(normalized.strip() or normalized), 4)
+    return IntentMatch(name, span, min(score, 1.0), example)
+
+
+def _is_whole_word(text: str, start: int, end: int) -> bool:
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+def match_intents(texts: List[str]) -> List[IntentMatch]:
+    """
+    Versión por lotes de match_intent.
+    """
+    return [match_intent(text) for text in texts]
+
+
+def predict_intent(text: str) -> str:
+    return match_intent(text).name
+
+
+def predict_intents(texts: List[str]) -> List[str]:
+    """
+    Predice la intención de varios mensajes en una sola llamada.
+    """
+    return [match.name for match in match_intents(texts)]
@@ -0,0 +1,244 @@
+# journal.py - Escritura diferida (write-behind) de mensajes para Fulano AI
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+# Niveles de durabilidad
+SYNC = "sync"    # cada turno se escribe en la misma transacción del request (comportamiento original)
+GROUP = "group"  # el request espera a que el lote que contiene su turno haga commit
+ASYNC = "async"  # el request solo encola; el flusher escribe en segundo plano
+
+DURABILITY_LEVELS = (SYNC, GROUP, ASYNC)
+
+
+class MessageJournal:
+    """
+    Cola acotada en memoria + hilo que escribe los mensajes por lotes.
+
+    Cada elemento de la cola es la lista de filas de un turno, para que los
+    mensajes de un mismo turno siempre queden en el mismo commit. El flusher
+    escribe cuando pasan `flush_interval_ms` o se juntan `flush_rows` filas,
+    lo que ocurra primero.
+
+    Si un lote falla, sus turnos se reintentan uno por uno: un turno malo no
+    arrastra a los demás. El Future de cada turno que no se pudo escribir
+    termina con la excepción (ver crud.finish_turn).
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        writer,
+        durability: str = SYNC,
+        max_queue: int = 10000,
+        flush_interval_ms: int = 50,
+        flush_rows: int = 500,
+        enqueue_timeout: float = 0.05,
+        group_timeout: float = 5.0,
+    ):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Durabilidad inválida: {durability!r} (usa {', '.join(DURABILITY_LEVELS)})")
+
+        self.session_factory = session_factory
+        self.writer = writer
+        self.durability = durability
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_rows = flush_rows
+        self.enqueue_timeout = enqueue_timeout
+        self.group_timeout = group_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"enqueued_rows": 0, "flushed_rows": 0, "batches": 0, "failed_rows": 0, "queue_full": 0,
+                       "retried_batches": 0, "group_timeouts": 0}
+
+    @classmethod
+    def from_env(cls, session_factory, writer):
+        """
+        Crea el journal a partir de las variables de entorno MESSAGE_JOURNAL_*.
+        """
+        return cls(
+            session_factory,
+            writer,
+            durability=os.getenv("MESSAGE_JOURNAL_DURABILITY", SYNC).lower(),
+            max_queue=int(os.getenv("MESSAGE_JOURNAL_MAX_QUEUE", "10000")),
+            flush_interval_ms=int(os.getenv("MESSAGE_JOURNAL_FLUSH_MS", "50")),
+            flush_rows=int(os.getenv("MESSAGE_JOURNAL_FLUSH_ROWS", "500")),
+            group_timeout=int(os.getenv("MESSAGE_JOURNAL_GROUP_TIMEOUT_MS", "5000")) / 1000,
+        )
+
+    # ==========================
+    # 📌 API pública
+    # ==========================
+
+    @property
+    def enabled(self) -> bool:
+        """True si los mensajes pasan por la cola (group/async)."""
+        return self.durability != SYNC and self._thread is not None
+
+    @property
+    def depth(self) -> int:
+        """Cantidad de turnos esperando en la cola."""
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "durability": self.durability,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queue_depth": self.depth,
+            "queue_capacity": self._queue.maxsize,
+        })
+        return stats
+
+    def start(self):
+        """Arranca el hilo flusher (no hace nada en modo sync)."""
+        if self.durability == SYNC or self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="message-journal", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Detiene el flusher después de vaciar la cola."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("El journal no terminó de vaciarse; quedan %s turnos en cola", self.depth)
+        self._thread = None
+
+    def append(self, rows: list, timeout: float = None) -> Future:
+        """
+        Encola las filas de un turno. Retorna un Future que se resuelve cuando
+        el lote que las contiene hace commit. Lanza queue.Full si la cola sigue
+        llena después de `timeout` (por defecto `enqueue_timeout`; 0 = no esperar,
+        para llamadores async); el llamador decide si escribe directo.
+        """
+        future = Future()
+        try:
+            self._queue.put((rows, future), timeout=self.enqueue_timeout if timeout is None else timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats["queue_full"] += 1
+            raise
+        with self._lock:
+            self._stats["enqueued_rows"] += len(rows)
+        return future
+
+    def wait(self, pending: Future) -> bool:
+        """
+        Modo group: espera el commit del turno como mucho `group_timeout`.
+        Si vence, el turno sigue en cola (queda como en modo async) y retorna
+        False. Si la escritura falló, lanza la excepción del lote.
+        """
+        try:
+            pending.result(timeout=self.group_timeout)
+        except FutureTimeout:
+            self._group_timed_out()
+            return False
+        return True
+
+    async def wait_async(self, pending: Future) -> bool:
+        """Igual que wait, sin bloquear el event loop."""
+        try:
+            # shield: al vencer el plazo no se cancela el Future del journal
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(pending)), self.group_timeout)
+        except asyncio.TimeoutError:
+            self._group_timed_out()
+            return False
+        return True
+
+    def _group_timed_out(self):
+        with self._lock:
+            self._stats["group_timeouts"] += 1
+        logger.warning("El lote no hizo commit en %.1f s; el turno sigue en cola", self.group_timeout)
+
+    def flush(self):
+        """Escribe de inmediato todo lo que haya en la cola (útil en tests y al apagar)."""
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    # ==========================
+    # 📌 Flusher
+    # ==========================
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain(block=True)
+            if batch:
+                self._write(batch)
+        self.flush()
+
+    def _drain(self, block: bool) -> list:
+        """Junta turnos hasta llenar flush_rows o agotar el intervalo."""
+        batch = []
+        rows = 0
+        deadline = time.monotonic() + self.flush_interval
+        while rows < self.flush_rows:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    item = self._queue.get(timeout=timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _write(self, batch: list):
+        error = self._commit(batch)
+        if error is not None and len(batch) > 1:
+            logger.warning("Falló un lote de %s turnos (%s); se reintentan uno por uno", len(batch), error)
+            with self._lock:
+                self._stats["retried_batches"] += 1
+            for item in batch:
+                self._finish([item], self._commit([item]))
+        else:
+            self._finish(batch, error)
+
+    def _commit(self, batch: list):
+        """Escribe los turnos en una transacción. Retorna la excepción si falló."""
+        rows = [row for turn_rows, _ in batch for row in turn_rows]
+        db = self.session_factory()
+        try:
+            self.writer(db, rows)
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            return exc
+        finally:
+            db.close()
+        return None
+
+    def _finish(self, batch: list, error):
+        rows = sum(len(turn_rows) for turn_rows, _ in batch)
+        if error is not None:
+            logger.error("No se pudieron escribir %s mensajes", rows, exc_info=error)
+            with self._lock:
+                self._stats["failed_rows"] += rows
+            for _, future in batch:
+                future.set_exception(error)
+            return
+
+        with self._lock:
+            self._stats["flushed_rows"] += rows
+            self._stats["batches"] += 1
+        for _, future in batch:
+            future.set_result(rows)
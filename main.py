@@ -1,22 +1,74 @@
+import asyncio
 import os
+import hmac
+import json
 import random
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Optional
 import pytz
-from fastapi import FastAPI, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Importar módulos locales
-import models, crud, database
-from intents import predict_intent, INTENT_RESPONSES
-from tools import calculate
+import models, crud, crud_async, database, export, generation, metrics, migrations
+from admission import Rejected, admission_control
+from archive import ConversationArchiver
+from cache import conversation_cache, response_cache
+from memory import conversation_memory
+from journal import MessageJournal
+from http_client import http_client
+from intents import predict_intent, predict_intents, INTENT_RESPONSES, UNKNOWN_INTENT
+from tools import calculate, extract_cities
+from scheduler import tool_scheduler
+from calculator import format_result
 from fastapi.middleware.cors import CORSMiddleware
 
+# Journal de mensajes (write-behind opcional, ver MESSAGE_JOURNAL_DURABILITY)
+message_journal = MessageJournal.from_env(database.SessionLocal, crud.bulk_insert_messages)
+
+# Archivado periódico de conversaciones inactivas (ver ARCHIVE_INTERVAL_HOURS)
+conversation_archiver = ConversationArchiver.from_env(database.SessionLocal)
+
+
+# ==========================
+# Ciclo de vida: al iniciar se crea el motor y se verifica la versión del
+# esquema (migra si hace falta); al apagar se vacía el journal y se cierra todo.
+# ==========================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    generation.get_backend()  # GENERATION_BACKEND inválido → falla aquí, antes de aceptar requests
+    engine = database.init_engine()
+    migrations.ensure_schema(engine)
+    conversation_memory.configure(engine.dialect.name)
+    database.init_async_engine()
+    message_journal.start()
+    conversation_archiver.start()
+    # scikit-learn (caché por similitud) se importa en un hilo, sin retrasar el arranque
+    asyncio.get_running_loop().run_in_executor(None, response_cache.warm)
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        conversation_archiver.stop()
+        message_journal.stop()
+        tool_scheduler.shutdown()
+        http_client.close()
+        await http_client.aclose()
+        await database.dispose_async_engine()
+        database.dispose_engine()
+
+
 app = FastAPI(
     title="Fulano AI Backend",
     description="Asistente virtual con memoria y manejo de intents",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
+app.state.ready = False
 
 # Orígenes permitidos (frontend local y producción)
 origins = [
@@ -33,80 +85,476 @@ app.add_middleware(
     allow_headers=["*"],        # permite todos los headers
 )
 
-# ==========================
-# Evento al iniciar (crear tablas si no existen)
-# ==========================
-@app.on_event("startup")
-def on_startup():
-    models.Base.metadata.create_all(bind=database.engine)
+# Latencia por request/etapa, SQL por request (ver /metrics y SLOW_REQUEST_MS)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+# Control de admisión (ver admission.py): 429 por rate limit, 503 por sobrecarga
+@app.exception_handler(Rejected)
+async def admission_rejected(request: Request, exc: Rejected):
+    message = "Demasiados mensajes, espera un momento" if exc.status_code == 429 else "Servidor ocupado, intenta de nuevo"
+    return JSONResponse(
+        content={"error": message, "reason": exc.reason},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 # ==========================
 # Endpoint principal del chat
 # ==========================
-@app.post("/api/chat")
-def chat(request: models.ChatRequest, db: Session = Depends(database.get_db)):
+@app.post("/api/chat", dependencies=[Depends(admission_control.admit)])
+async def chat(request: models.ChatRequest, db: AsyncSession = Depends(database.get_async_db)):
     """
-    Endpoint de conversación.
-    - Guarda los mensajes en la base de datos
+    Endpoint de conversación (async: no ocupa un hilo mientras espera a la BD
+    o a las APIs externas).
     - Detecta la intención del usuario
-    - Genera la respuesta correspondiente
+    - Genera la respuesta correspondiente (los mensajes sin intent van al
+      backend de generación, ver generation.py)
+    - Guarda el turno completo en la base de datos con un solo commit
+    """
+    received_at = datetime.utcnow()
+
+    # Detectar intent y generar la respuesta
+    with metrics.span("intent"):
+        intent = predict_intent(request.message)
+    handled_by_gemini = served_from_cache = False
+    if intent == UNKNOWN_INTENT:
+        history, memories = await _generation_context(db, request.conversation_id, request.message)
+        # La caché de respuestas es por texto: solo sirve para prompts sin
+        # historial ni memoria (si no, se compartirían respuestas personales)
+        shareable = not history and not memories
+        cached = await response_cache.aget(request.message, intent) if shareable else None
+        if cached is not None:
+            response_text, served_from_cache = cached.reply, True
+        else:
+            prompt = generation.build_prompt(request.message, history, memories)
+            with metrics.span("generation"):
+                response_text, handled_by_gemini = await generation.generate_reply(prompt)
+            if handled_by_gemini and shareable:
+                response_cache.put(request.message, intent, response_text)
+    else:
+        with metrics.span("reply"):
+            response_text = await abuild_reply(intent, request.message)
+
+    # Guardar conversación + mensaje del usuario + respuesta del bot (un solo commit)
+    turn = await crud_async.record_turn(
+        db,
+        conversation_id=request.conversation_id,
+        user_content=request.message,
+        bot_content=response_text,
+        handled_by_gemini=handled_by_gemini,
+        served_from_cache=served_from_cache,
+        received_at=received_at,
+        journal=message_journal,
+    )
+
+    # Retornar respuesta
+    return JSONResponse(content={
+        "generated_text": response_text,
+        "conversation_id": turn.conversation_id
+    })
+
+
+# ==========================
+# Endpoint de chat con streaming (Server-Sent Events)
+# ==========================
+@app.post("/api/chat/stream", dependencies=[Depends(admission_control.admit)])
+async def chat_stream(request: models.ChatRequest):
+    """
+    Igual que /api/chat, pero la respuesta llega como Server-Sent Events:
+    - `token`: {"text": ...} por cada fragmento que produce el modelo
+    - `done`:  {"generated_text": ..., "conversation_id": ...} al terminar
+    El turno se guarda cuando el stream termina; si el cliente se desconecta
+    antes, no se guarda nada.
+    """
+    received_at = datetime.utcnow()
+    with metrics.span("intent"):
+        intent = predict_intent(request.message)
+    return StreamingResponse(
+        _stream_chat(request, intent, received_at),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _stream_chat(request: models.ChatRequest, intent: str, received_at: datetime):
+    # Sesión propia: la respuesta se sigue enviando después de retornar el endpoint
+    database.get_async_engine()
+    async with database.AsyncSessionLocal() as db:
+        handled_by_gemini = served_from_cache = shareable = False
+        cached = None
+        if intent == UNKNOWN_INTENT:
+            history, memories = await _generation_context(db, request.conversation_id, request.message)
+            shareable = not history and not memories
+            if shareable:
+                cached = await response_cache.aget(request.message, intent)
+        if cached is not None:
+            response_text, served_from_cache = cached.reply, True
+            yield _sse("token", {"text": response_text})
+        elif intent == UNKNOWN_INTENT:
+            stream = generation.ReplyStream(generation.build_prompt(request.message, history, memories))
+            with metrics.span("generation"):
+                async for chunk in stream:
+                    yield _sse("token", {"text": chunk})
+            response_text, handled_by_gemini = stream.text, stream.handled_by_model
+            if handled_by_gemini and shareable:
+                response_cache.put(request.message, intent, response_text)
+        else:
+            with metrics.span("reply"):
+                response_text = await abuild_reply(intent, request.message)
+            yield _sse("token", {"text": response_text})
+
+        turn = await crud_async.record_turn(
+            db,
+            conversation_id=request.conversation_id,
+            user_content=request.message,
+            bot_content=response_text,
+            handled_by_gemini=handled_by_gemini,
+            served_from_cache=served_from_cache,
+            received_at=received_at,
+            journal=message_journal,
+        )
+        yield _sse("done", {"generated_text": response_text, "conversation_id": turn.conversation_id})
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _generation_context(db: AsyncSession, conversation_id: Optional[str], message: str):
+    """
+    (historial, memorias) para el prompt del backend de generación: los
+    últimos mensajes de la conversación y, de los anteriores, los más
+    relacionados con el mensaje. Ambos vacíos si la conversación es nueva.
     """
-    # Crear o buscar conversación
-    conversation = crud.get_or_create_conversation(db, conversation_id=request.conversation_id)
+    history, memories = [], []
+    conversation_pk = await crud_async.resolve_conversation_pk(db, conversation_id)
+    if conversation_pk is not None:
+        if generation.GENERATION_HISTORY_MESSAGES:
+            history, _ = await crud_async.get_recent_messages(
+                db, conversation_pk, limit=generation.GENERATION_HISTORY_MESSAGES
+            )
+        with metrics.span("memory"):
+            hits = await conversation_memory.search(
+                db, conversation_pk, message, k=generation.GENERATION_MEMORY_RESULTS,
+                exclude={msg.id for msg in history},
+            )
+        memories = [hit.message for hit in hits]
+    return history, memories
 
-    # Guardar mensaje del usuario en la DB
-    crud.create_message(db, conversation=conversation, sender="user", content=request.message)
 
-    # Detectar intent
-    intent = predict_intent(request.message)
-    response_text = ""
+# ==========================
+# Endpoint de chat por lotes
+# ==========================
+@app.post("/api/chat/batch", dependencies=[Depends(admission_control.admit)])
+def chat_batch(request: models.ChatBatchRequest, db: Session = Depends(database.get_db)):
+    """
+    Procesa muchos mensajes en un solo request (gateway de WhatsApp, reprocesos).
+    - Clasifica todos los mensajes en una sola pasada
+    - Resuelve todas las conversaciones con una consulta IN
+    - Guarda todos los mensajes con un INSERT masivo y un solo commit
+    Las respuestas salen en el mismo orden de los mensajes. Los mensajes sin
+    intent reciben la respuesta fija: el lote no pasa por el modelo.
+    """
+    received_at = datetime.utcnow()
+    texts = [item.message for item in request.messages]
+    with metrics.span("intent"):
+        intents = predict_intents(texts)
+    with metrics.span("reply"):
+        replies = [build_reply(intent, text) for intent, text in zip(intents, texts)]
 
-    # -------------------------
-    # Respuestas por intención
-    # -------------------------
+    with metrics.span("db.persist"):
+        turns = crud.record_turns(
+            db,
+            [
+                crud.TurnInput(conversation_id=item.conversation_id, user_content=item.message, bot_content=reply)
+                for item, reply in zip(request.messages, replies)
+            ],
+            received_at=received_at,
+        )
+
+    return JSONResponse(content={
+        "responses": [
+            {"generated_text": reply, "conversation_id": turn.conversation_id}
+            for reply, turn in zip(replies, turns)
+        ]
+    })
+
+
+# ==========================
+# Respuestas por intención
+# ==========================
+def build_reply(intent: str, message: str) -> str:
+    """
+    Genera el texto de respuesta del bot para un intent ya detectado.
+    """
     if intent in ["saludo", "despedida", "agradecimiento"]:
-        response_text = random.choice(INTENT_RESPONSES[intent])
+        return random.choice(INTENT_RESPONSES[intent])
 
     elif intent == "hora":
         colombia_tz = pytz.timezone("America/Bogota")
         now = datetime.now(colombia_tz)
-        response_text = f"La hora en Colombia es {now.strftime('%H:%M:%S')}."
+        return f"La hora en Colombia es {now.strftime('%H:%M:%S')}."
 
     elif intent == "matematica":
-        try:
-            result = calculate(request.message)
-            response_text = f"El resultado es: {result}"
-        except Exception:
-            response_text = "No pude calcular eso, mi pana."
+        result = calculate(message)
+        if isinstance(result, str):
+            return f"{result} Mi pana, prueba con algo como \"cuánto es 8 por 8\"."
+        return f"El resultado es: {format_result(result)}"
 
-    else:
-        response_text = "No entendí bien, pero dime otra vez y lo resolvemos."
+    elif intent == "clima":
+        return weather_reply(message)
 
-    # Guardar respuesta del bot en DB
-    crud.create_message(db, conversation=conversation, sender="bot", content=response_text)
+    return generation.FALLBACK_REPLY
 
-    # Retornar respuesta
-    return JSONResponse(content={
-        "generated_text": response_text,
-        "conversation_id": conversation.id
-    })
+
+async def abuild_reply(intent: str, message: str) -> str:
+    """
+    Igual que build_reply, pero las herramientas externas se esperan sin
+    bloquear el event loop.
+    """
+    if intent == "clima":
+        return await aweather_reply(message)
+    return build_reply(intent, message)
+
+
+def weather_reply(message: str) -> str:
+    """
+    Consulta el clima de cada ciudad mencionada (en paralelo) a través del
+    scheduler de herramientas.
+    """
+    cities = extract_cities(message) or ["Bogotá"]
+    with metrics.span("tool.clima"):
+        results = tool_scheduler.call_many([("clima", (city,)) for city in cities])
+    return _weather_text(cities, results)
+
+
+async def aweather_reply(message: str) -> str:
+    cities = extract_cities(message) or ["Bogotá"]
+    with metrics.span("tool.clima"):
+        results = await tool_scheduler.acall_many([("clima", (city,)) for city in cities])
+    return _weather_text(cities, results)
+
+
+def _weather_text(cities: list, results: list) -> str:
+    parts = []
+    for city, result in zip(cities, results):
+        if isinstance(result, Exception) or "error" in result:
+            parts.append(f"No pude consultar el clima de {city.title()} ahora mismo.")
+        else:
+            parts.append(f"En {result['city']} está {result['description']} con {result['temperature']}.")
+    return " ".join(parts)
 
 
 # ==========================
 # Endpoint historial de conversación
 # ==========================
 @app.get("/api/history/{conversation_id}")
-def get_history(conversation_id: int, db: Session = Depends(database.get_db)):
+async def get_history(
+    conversation_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(database.get_async_db),
+):
     """
     Recupera el historial de una conversación
+    - Paginado por cursor: `before`/`after` reciben los cursores de la respuesta anterior
+    - Sin cursores retorna los `limit` mensajes más recientes
+    - `stream=true` envía todos los mensajes como NDJSON (uno por línea)
     """
-    conversation = crud.get_conversation(db, conversation_id)
-    if not conversation:
+    conversation_pk = await crud_async.resolve_conversation_pk(db, conversation_id)
+    if conversation_pk is None:
         return JSONResponse(content={"error": "Conversación no encontrada"}, status_code=404)
 
-    history = [{"sender": msg.sender, "content": msg.content} for msg in conversation.messages]
-    return {"conversation_id": conversation.id, "history": history}
+    if before is not None and after is not None:
+        return JSONResponse(content={"error": "Usa before o after, no ambos"}, status_code=400)
+
+    try:
+        for cursor in (before, after):
+            if cursor is not None:
+                crud.decode_cursor(cursor)
+    except crud.InvalidCursor as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+    if stream:
+        return StreamingResponse(_stream_history(conversation_pk, after), media_type="application/x-ndjson")
+
+    if before is None and after is None:
+        messages, has_more = await crud_async.get_recent_messages(db, conversation_pk, limit=limit)
+    else:
+        messages, has_more = await crud_async.get_messages_page(db, conversation_pk, limit=limit, before=before, after=after)
+    return {
+        "conversation_id": conversation_id,
+        "history": [_serialize_message(msg) for msg in messages],
+        "has_more": has_more,
+        "prev_cursor": crud.encode_cursor(messages[0]) if messages else before,
+        "next_cursor": crud.encode_cursor(messages[-1]) if messages else after,
+    }
+
+
+def _serialize_message(msg: models.Message) -> dict:
+    return {"sender": msg.sender, "content": msg.content, "timestamp": msg.timestamp.isoformat()}
+
+
+async def _stream_history(conversation_pk, after: Optional[str]):
+    # Sesión propia: la del Depends se cierra antes de terminar de enviar la respuesta
+    async with database.AsyncSessionLocal() as db:
+        async for msg in crud_async.iter_messages(db, conversation_pk, after=after):
+            line = _serialize_message(msg)
+            line["cursor"] = crud.encode_cursor(msg)
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+
+# ==========================
+# Endpoint de memoria (búsqueda en mensajes anteriores)
+# ==========================
+@app.get("/api/memory/{conversation_id}")
+async def search_memory(
+    conversation_id: str,
+    q: str = Query(..., min_length=1, max_length=500),
+    k: int = Query(5, ge=1, le=50),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """
+    Los `k` mensajes de la conversación más relacionados con `q`, ordenados
+    por relevancia (ver memory.py).
+    """
+    conversation_pk = await crud_async.resolve_conversation_pk(db, conversation_id)
+    if conversation_pk is None:
+        return JSONResponse(content={"error": "Conversación no encontrada"}, status_code=404)
+
+    with metrics.span("memory"):
+        hits = await conversation_memory.search(db, conversation_pk, q, k=k)
+    return {
+        "conversation_id": conversation_id,
+        "results": [dict(_serialize_message(hit.message), score=round(hit.score, 4)) for hit in hits],
+    }
+
+
+# ==========================
+# Endpoint de exportación masiva (ver export.py)
+# ==========================
+@app.get("/api/export")
+def export_messages(
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+    format: str = Query("jsonl", pattern="^(jsonl|parquet|arrow)$"),
+):
+    """
+    Todos los mensajes de [since, until) como JSONL.gz, Parquet o Arrow, en
+    streaming. `after` continúa desde el `cursor` del último registro recibido.
+    `until` nunca pasa de ahora - EXPORT_SAFETY_LAG_SECONDS (ver export.safe_until).
+    Requiere EXPORT_TOKEN (Authorization: Bearer <token>); sin él está apagado.
+    """
+    token = os.getenv("EXPORT_TOKEN")
+    if not token:
+        return JSONResponse(content={"error": "Exportación deshabilitada"}, status_code=404)
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {token}"):
+        return JSONResponse(content={"error": "No autorizado"}, status_code=401)
+
+    try:
+        if after is not None:
+            crud.decode_cursor(after)
+        export.check_format(format)
+    except crud.InvalidCursor as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except export.ExportUnavailable as e:
+        return JSONResponse(content={"error": str(e)}, status_code=501)
+
+    until = export.safe_until(until)
+    filename = f"mensajes-{until:%Y%m%dT%H%M%S}{export.EXTENSIONS[format]}"
+    # Generador sync: Starlette lo recorre en el threadpool, fuera del event loop
+    return StreamingResponse(
+        export.stream_export(database.SessionLocal, fmt=format, since=since, until=until, after=after),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# ==========================
+# Endpoint de estadísticas internas
+# ==========================
+@app.get("/api/stats")
+def stats():
+    """
+    Estado del journal de mensajes (profundidad de la cola, lotes escritos...)
+    aciertos/fallos de las cachés (conversaciones y respuestas) y llamadas a APIs externas
+    """
+    return {
+        "journal": message_journal.stats(),
+        "cache": conversation_cache.stats(),
+        "responses": response_cache.stats(),
+        "memory": conversation_memory.stats(),
+        "admission": admission_control.stats(),
+        "archive": conversation_archiver.stats(),
+        "http": http_client.stats(),
+        "tools": tool_scheduler.stats(),
+    }
+
+
+# ==========================
+# Métricas en formato Prometheus
+# ==========================
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _collect_runtime_metrics():
+    """Estado del journal, las cachés y el cliente HTTP como métricas de Prometheus."""
+    samples = []
+    journal_stats = message_journal.stats()
+    samples.append(("fulano_journal_queue_depth", "gauge", "Turnos esperando en el journal", {}, journal_stats["queue_depth"]))
+    for field in ("flushed_rows", "failed_rows", "batches", "queue_full"):
+        samples.append((f"fulano_journal_{field}_total", "counter", "Contadores del journal", {}, journal_stats[field]))
+    for cache_name, cache_stats in conversation_cache.stats().items():
+        for field in ("hits", "misses", "evictions"):
+            samples.append((f"fulano_cache_{field}_total", "counter", "Contadores de la caché de conversaciones", {"cache": cache_name}, cache_stats[field]))
+        samples.append(("fulano_cache_entries", "gauge", "Entradas en la caché de conversaciones", {"cache": cache_name}, cache_stats["size"]))
+    admission_stats = admission_control.stats()
+    samples.append(("fulano_admission_active_requests", "gauge", "Requests de chat en curso", {}, admission_stats["active"]))
+    samples.append(("fulano_admission_waiting_requests", "gauge", "Requests de chat esperando cupo", {}, admission_stats["waiting"]))
+    response_stats = response_cache.stats()
+    for kind in ("exact", "similar"):
+        samples.append(("fulano_response_cache_hits_total", "counter", "Respuestas servidas desde la caché (sin llamar al modelo)", {"kind": kind}, response_stats[f"{kind}_hits"]))
+    samples.append(("fulano_response_cache_misses_total", "counter", "Mensajes que tuvieron que ir al modelo", {}, response_stats["misses"]))
+    samples.append(("fulano_response_cache_entries", "gauge", "Entradas en la caché de respuestas", {}, response_stats["size"]))
+    http_stats = http_client.stats()
+    samples.append(("fulano_http_upstream_calls_total", "counter", "Llamadas reales a APIs externas", {}, http_stats["upstream_calls"]))
+    samples.append(("fulano_http_coalesced_total", "counter", "Llamadas externas resueltas por coalescencia", {}, http_stats["coalesced"]))
+    return samples
+
+
+metrics.registry.register_collector(_collect_runtime_metrics)
+
+
+# ==========================
+# Liveness / readiness
+# ==========================
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    """Liveness: el proceso está vivo y atiende requests (no toca la BD)."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    """Readiness: la app terminó de arrancar, la BD responde y el esquema está al día."""
+    if not app.state.ready or database.engine is None:
+        return JSONResponse(content={"status": "starting"}, status_code=503)
+    try:
+        with database.engine.connect() as conn:
+            version = migrations.current_version(conn)
+    except Exception as e:
+        return JSONResponse(content={"status": "db_unavailable", "error": str(e)}, status_code=503)
+    if version != migrations.HEAD:
+        return JSONResponse(content={"status": "schema_outdated", "schema_version": version}, status_code=503)
+    return {"status": "ready", "schema_version": version}
 
 
 # ==========================
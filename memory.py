@@ -0,0 +1,243 @@
+# memory.py - Memoria de conversación: búsqueda de mensajes anteriores relevantes
+#
+# "Dame los k mensajes de esta conversación más relacionados con X" sin cargar
+# el historial completo:
+#   - local (SQLite / desarrollo): índice invertido en memoria por conversación,
+#     actualizado en cada escritura y acotado (LRU de conversaciones, máximo de
+#     mensajes por conversación), con puntaje BM25
+#   - postgres: búsqueda de texto completo sobre to_tsvector(content) con el
+#     índice GIN de expresión de la migración 5; la BD lo mantiene sola
+#
+# MEMORY_BACKEND elige: auto (postgres si la BD es Postgres, si no local) | local | postgres
+
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import NamedTuple
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from migrations import CONTENT_TSVECTOR
+from cache import CachedMessage, LRUTTLCache, to_cached
+from intents import tokenize
+
+# Palabras que no ayudan a encontrar mensajes ("que", "de", "el"...)
+STOPWORDS = frozenset("""
+a al algo ante como con cual cuando de del donde e el ella ellos en entre era es esa ese eso esta este esto
+fue ha hay la las le les lo los mas me mi mis muy no nos o para pero por que se si sin sobre son su sus
+te ti tu tus un una uno unos y ya yo
+""".split())
+
+_PG_WORD = re.compile(r"[^\W_]+")
+
+
+class MemoryHit(NamedTuple):
+    message: CachedMessage
+    score: float
+
+
+def memory_terms(text_value: str) -> list:
+    return [token for token in tokenize(text_value) if token not in STOPWORDS]
+
+
+# ==========================
+# 📌 Índice local por conversación
+# ==========================
+
+class _ConversationIndex:
+    """
+    Índice invertido de una conversación: término → {seq: tf}. Los mensajes
+    más viejos salen del índice al pasar de `max_messages`.
+    """
+
+    def __init__(self, max_messages: int):
+        self.max_messages = max_messages
+        self.lock = threading.Lock()
+        self.messages = OrderedDict()  # seq → (CachedMessage, Counter de términos, largo)
+        self.postings = {}             # término → {seq: tf}
+        self.total_length = 0
+        self.ids = set()
+        self._next_seq = 0
+
+    def add(self, message: CachedMessage):
+        if message.id in self.ids:
+            return
+        terms = Counter(memory_terms(message.content))
+        seq = self._next_seq
+        self._next_seq += 1
+        length = sum(terms.values())
+        self.messages[seq] = (message, terms, length)
+        self.ids.add(message.id)
+        self.total_length += length
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[seq] = tf
+        while len(self.messages) > self.max_messages:
+            self._remove_oldest()
+
+    def _remove_oldest(self):
+        seq, (message, terms, length) = self.messages.popitem(last=False)
+        self.ids.discard(message.id)
+        self.total_length -= length
+        for term in terms:
+            posting = self.postings[term]
+            del posting[seq]
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query_terms: set, k: int, exclude=frozenset(), k1: float = 1.2, b: float = 0.75) -> list:
+        n_docs = len(self.messages)
+        if not n_docs:
+            return []
+        avg_length = self.total_length / n_docs or 1.0
+        scores = {}
+        for term in query_terms:
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log1p((n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for seq, tf in posting.items():
+                length = self.messages[seq][2]
+                scores[seq] = scores.get(seq, 0.0) + idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+        best = heapq.nlargest(k + len(exclude), scores.items(), key=lambda item: item[1])
+        hits = []
+        for seq, score in best:
+            message = self.messages[seq][0]
+            if message.id not in exclude:
+                hits.append(MemoryHit(message, score))
+                if len(hits) == k:
+                    break
+        return hits
+
+
+# ==========================
+# 📌 Memoria de conversaciones
+# ==========================
+
+class ConversationMemory:
+    """
+    Punto único para indexar y buscar. `add_messages` se llama en cada escritura
+    (crud), `search` desde los endpoints async.
+
+    El índice local de una conversación se arma la primera vez que se busca en
+    ella (los últimos `max_messages` mensajes, una sola consulta) y desde ahí se
+    mantiene con cada escritura; las conversaciones nuevas arrancan indexadas.
+    """
+
+    def __init__(self, backend: str = "auto", max_conversations: int = 2000, max_messages: int = 500, ttl: float = 1800):
+        if backend not in ("auto", "local", "postgres"):
+            raise ValueError(f"MEMORY_BACKEND inválido: {backend!r} (usa auto, local o postgres)")
+        self.backend = backend
+        self.max_messages = max_messages
+        self.indexes = LRUTTLCache(max_conversations, ttl)
+        self.postgres = backend == "postgres"  # con "auto" se decide en configure()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            backend=os.getenv("MEMORY_BACKEND", "auto").strip().lower(),
+            max_conversations=int(os.getenv("MEMORY_MAX_CONVERSATIONS", "2000")),
+            max_messages=int(os.getenv("MEMORY_MAX_MESSAGES", "500")),
+            ttl=float(os.getenv("MEMORY_TTL", "1800")),
+        )
+
+    def configure(self, dialect_name: str):
+        """Se llama al arrancar con el dialecto de la BD (resuelve MEMORY_BACKEND=auto)."""
+        if self.backend == "auto":
+            self.postgres = dialect_name == "postgresql"
+
+    # ---- Escritura ----
+
+    def add_messages(self, conversation_pk, rows: list, new_conversation: bool = False):
+        """
+        Agrega mensajes recién guardados. Igual que la cola de la caché de
+        conversaciones: solo si la conversación ya tiene índice (o es nueva).
+        """
+        if self.postgres or self.max_messages <= 0:
+            return
+        if new_conversation:
+            self.indexes.set(conversation_pk, _ConversationIndex(self.max_messages))
+        index = self.indexes.peek(conversation_pk)
+        if index is None:
+            return
+        with index.lock:
+            for row in rows:
+                index.add(to_cached(row))
+
+    def invalidate(self, conversation_pk):
+        self.indexes.pop(conversation_pk)
+
+    def clear(self):
+        self.indexes.clear()
+
+    # ---- Búsqueda ----
+
+    async def search(self, db: AsyncSession, conversation_pk, query: str, k: int = 5, exclude=frozenset()) -> list:
+        """Los `k` mensajes de la conversación más relevantes para `query` (sin los de `exclude`)."""
+        if k <= 0:
+            return []
+        if self.postgres:
+            return await self._search_postgres(db, conversation_pk, query, k, exclude)
+
+        terms = set(memory_terms(query))
+        if not terms:
+            return []
+        index = self.indexes.get(conversation_pk)
+        if index is None:
+            index = await self._load(db, conversation_pk)
+        with index.lock:
+            return index.search(terms, k, exclude=frozenset(exclude))
+
+    async def _load(self, db: AsyncSession, conversation_pk) -> _ConversationIndex:
+        index = _ConversationIndex(self.max_messages)
+        messages = list(await db.scalars(
+            select(models.Message)
+            .where(models.Message.conversation_id == conversation_pk)
+            .order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+            .limit(self.max_messages)
+        ))
+        for message in reversed(messages):
+            index.add(to_cached(message))
+        # Si otra escritura armó el índice mientras se consultaba, gana esa
+        current = self.indexes.peek(conversation_pk)
+        if current is not None:
+            return current
+        self.indexes.set(conversation_pk, index)
+        return index
+
+    async def _search_postgres(self, db: AsyncSession, conversation_pk, query: str, k: int, exclude) -> list:
+        # Solo letras y dígitos unidos con OR: no hay sintaxis de tsquery que escapar.
+        # La configuración 'spanish' descarta las stopwords y aplica stemming.
+        words = _PG_WORD.findall(query.lower())
+        if not words:
+            return []
+        result = await db.execute(
+            text(
+                "SELECT id, sender, content, timestamp, handled_by_gemini, "
+                f"ts_rank({CONTENT_TSVECTOR}, query) AS score "
+                "FROM messages, to_tsquery('spanish', :query) AS query "
+                f"WHERE conversation_id = :conversation_id AND {CONTENT_TSVECTOR} @@ query "
+                "ORDER BY score DESC, timestamp DESC LIMIT :limit"
+            ),
+            {"query": " | ".join(words), "conversation_id": conversation_pk, "limit": k + len(exclude)},
+        )
+        hits = []
+        for row in result:
+            if row.id in exclude:
+                continue
+            message = CachedMessage(row.id, row.sender, row.content, row.timestamp, bool(row.handled_by_gemini))
+            hits.append(MemoryHit(message, float(row.score)))
+            if len(hits) == k:
+                break
+        return hits
+
+    def stats(self) -> dict:
+        return dict(self.indexes.stats(), backend="postgres" if self.postgres else "local")
+
+
+# Instancia compartida por crud y main
+conversation_memory = ConversationMemory.from_env()
@@ -0,0 +1,305 @@
+# metrics.py - Instrumentación de latencia por etapa y endpoint /metrics para Fulano AI
+#
+# - span("nombre"): mide una etapa del request actual (contextvars)
+# - MetricsMiddleware: mide cada request y deja el desglose por etapa
+# - instrument_engine(engine): cuenta sentencias SQL y tiempo de BD por request
+# - render(): exporta todo en formato de texto de Prometheus
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger("fulano.metrics")
+slow_logger = logging.getLogger("fulano.slow_requests")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 = desactivado
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+# ==========================
+# 📌 Tipos de métrica
+# ==========================
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label_values → [conteos por bucket..., +Inf, suma]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], list]):
+        """
+        `collector()` retorna una lista de (nombre, tipo, ayuda, {labels}, valor);
+        sirve para exponer estado que ya vive en otro módulo (cola del journal,
+        contadores de la caché...).
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        seen = set()
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception:
+                logger.exception("Falló un collector de métricas")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_duration = registry.histogram(
+    "fulano_http_request_duration_seconds", "Duración de los requests HTTP", labels=("method", "route", "status"),
+)
+stage_duration = registry.histogram(
+    "fulano_stage_duration_seconds", "Duración de cada etapa dentro de un request", labels=("stage",),
+)
+db_statement_duration = registry.histogram(
+    "fulano_db_statement_duration_seconds", "Duración de cada sentencia SQL",
+)
+db_statements_per_request = registry.histogram(
+    "fulano_db_statements_per_request", "Sentencias SQL por request", labels=("route",), buckets=COUNT_BUCKETS,
+)
+db_time_per_request = registry.histogram(
+    "fulano_db_time_per_request_seconds", "Tiempo total de BD por request", labels=("route",),
+)
+tool_duration = registry.histogram(
+    "fulano_tool_call_duration_seconds", "Duración de las llamadas a herramientas externas", labels=("tool",),
+)
+tool_errors = registry.counter(
+    "fulano_tool_errors_total", "Errores de herramientas externas", labels=("tool", "kind"),
+)
+generation_first_token = registry.histogram(
+    "fulano_generation_first_token_seconds", "Tiempo hasta el primer fragmento del modelo", labels=("backend",),
+)
+generation_duration = registry.histogram(
+    "fulano_generation_duration_seconds", "Duración total de la generación", labels=("backend",),
+)
+admission_rejections = registry.counter(
+    "fulano_admission_rejections_total", "Requests rechazados por el control de admisión", labels=("reason",),
+)
+generation_errors = registry.counter(
+    "fulano_generation_errors_total", "Fallos del backend de generación", labels=("backend",),
+)
+
+
+# ==========================
+# 📌 Contexto por request
+# ==========================
+
+class RequestStats:
+    """Acumulado de un request: etapas, SQL y herramientas."""
+
+    def __init__(self):
+        self.stages = {}
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_sql(self, seconds: float):
+        with self.lock:
+            self.sql_count += 1
+            self.sql_time += seconds
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("fulano_request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Mide una etapa:
+        with metrics.span("intent"):
+            intent = predict_intent(texto)
+    Se registra en el histograma por etapa y en el desglose del request actual.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_duration.observe(elapsed, name)
+        stats = _current.get()
+        if stats is not None:
+            stats.add_stage(name, elapsed)
+
+
+# ==========================
+# 📌 Eventos de SQLAlchemy
+# ==========================
+
+def instrument_engine(engine):
+    """Cuenta sentencias y tiempo de BD (por request cuando hay uno en curso)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("fulano_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("fulano_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        db_statement_duration.observe(elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.add_sql(elapsed)
+
+
+# ==========================
+# 📌 Middleware ASGI
+# ==========================
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI puro (sin BaseHTTPMiddleware) que crea el RequestStats del
+    request, mide la duración total y, si se pasa de SLOW_REQUEST_MS, deja en
+    el log el desglose por etapa.
+    """
+
+    def __init__(self, app, slow_request_ms: float = SLOW_REQUEST_MS):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = {"code": 500}
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_duration.observe(elapsed, scope["method"], route, status["code"])
+            db_statements_per_request.observe(stats.sql_count, route)
+            db_time_per_request.observe(stats.sql_time, route)
+
+            if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+                slow_logger.warning(json.dumps({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status["code"],
+                    "total_ms": round(elapsed * 1000, 2),
+                    "sql_count": stats.sql_count,
+                    "sql_ms": round(stats.sql_time * 1000, 2),
+                    "stages_ms": {name: round(s * 1000, 2) for name, s in stats.stages.items()},
+                }, ensure_ascii=False))
+
+
+def render() -> str:
+    return registry.render()
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
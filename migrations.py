@@ -0,0 +1,443 @@
+# migrations.py - Migraciones versionadas del esquema de Fulano AI
+#
+# Uso:
+#   python migrations.py upgrade   → aplica las migraciones pendientes
+#   python migrations.py current   → muestra la versión actual del esquema
+#   python migrations.py check     → sale con código 1 si hay migraciones pendientes
+#
+# La app las aplica sola al arrancar (AUTO_MIGRATE=1, ver ensure_schema), así
+# que ninguna reescribe messages: sus índices se crean CONCURRENTLY en
+# migraciones no transaccionales (transactional=False).
+
+import logging
+import os
+import sys
+import uuid
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Integer, LargeBinary, MetaData, String, Table, Text,
+    inspect, select, text,
+)
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_TABLE = "schema_version"
+
+# Llave fija para pg_advisory_lock: evita que dos workers migren a la vez
+_ADVISORY_LOCK_KEY = 7_241_001
+
+
+# Expresión del índice GIN de búsqueda de texto completo (memory.py la repite
+# tal cual en sus consultas para que Postgres use el índice)
+CONTENT_TSVECTOR = "to_tsvector('spanish', coalesce(content, ''))"
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+    # False: corre en autocommit, fuera de una transacción (CREATE INDEX CONCURRENTLY).
+    # Tiene que poder repetirse si el proceso muere antes de registrar la versión.
+    transactional: bool = True
+
+
+# ==========================
+# 📌 Helpers
+# ==========================
+
+def _is_postgres(conn: Connection) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def _create_index(conn: Connection, name: str, table: str, definition: str):
+    """
+    Índice sobre una tabla grande, para migraciones no transaccionales. En
+    Postgres es CREATE INDEX CONCURRENTLY: no bloquea las escrituras mientras
+    recorre la tabla; si una corrida anterior falló a la mitad quedó un índice
+    INVALID, que IF NOT EXISTS daría por bueno: se borra y se vuelve a crear.
+    """
+    if not _is_postgres(conn):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}"))
+        return
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).scalar()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+
+
+def _columns(conn: Connection, table: str) -> dict:
+    inspector = inspect(conn)
+    if not inspector.has_table(table):
+        return {}
+    return {column["name"]: column for column in inspector.get_columns(table)}
+
+
+# ==========================
+# 📌 Migraciones
+# ==========================
+
+def _v1_baseline(conn: Connection):
+    """
+    Tablas tal como las creaba `create_all` con los modelos originales.
+    En bases existentes no hace nada (checkfirst).
+    """
+    conversations, _ = _v1_tables()
+    conversations.metadata.create_all(conn, checkfirst=True)
+
+
+def _v1_tables():
+    """(conversations, messages) con las columnas originales."""
+    metadata = MetaData()
+    conversations = Table(
+        "conversations", metadata,
+        Column("id", UUID(as_uuid=True), primary_key=True),
+        Column("conversation_id", String),
+        Column("created_at", DateTime),
+    )
+    messages = Table(
+        "messages", metadata,
+        Column("id", UUID(as_uuid=True), primary_key=True),
+        Column("conversation_id", UUID(as_uuid=True), ForeignKey("conversations.id")),
+        Column("sender", String),
+        Column("content", Text),
+        Column("handled_by_gemini", Boolean),
+        Column("timestamp", DateTime),
+    )
+    return conversations, messages
+
+
+def _v2_canonical_schema(conn: Connection):
+    """
+    Deja una sola forma canónica del esquema:
+    - Si existe la tabla `messages` que creaba setup_db.py (id SERIAL, role,
+      created_at, FK a conversations.conversation_id), se renombra a
+      `messages_legacy` y sus filas se copian a la tabla canónica.
+    - conversations.conversation_id pasa a VARCHAR(36) NOT NULL con índice único.
+    - Índice compuesto (conversation_id, timestamp) en messages.
+    """
+    postgres = _is_postgres(conn)
+    legacy_messages = "role" in _columns(conn, "messages")
+
+    if legacy_messages:
+        conn.execute(text("ALTER TABLE messages RENAME TO messages_legacy"))
+        if postgres:
+            conn.execute(text("ALTER TABLE messages_legacy DROP CONSTRAINT IF EXISTS messages_conversation_id_fkey"))
+            conn.execute(text("ALTER INDEX IF EXISTS messages_pkey RENAME TO messages_legacy_pkey"))
+        _v1_baseline(conn)
+
+    if postgres:
+        # setup_db.py creaba la columna como UUID UNIQUE DEFAULT gen_random_uuid()
+        conn.execute(text("ALTER TABLE conversations DROP CONSTRAINT IF EXISTS conversations_conversation_id_key"))
+        conn.execute(text("ALTER TABLE conversations ALTER COLUMN conversation_id DROP DEFAULT"))
+        conn.execute(text(
+            "ALTER TABLE conversations ALTER COLUMN conversation_id TYPE VARCHAR(36) "
+            "USING conversation_id::text"
+        ))
+        conn.execute(text("UPDATE conversations SET conversation_id = id::text WHERE conversation_id IS NULL"))
+        conn.execute(text("ALTER TABLE conversations ALTER COLUMN conversation_id SET NOT NULL"))
+    else:
+        conn.execute(text("UPDATE conversations SET conversation_id = id WHERE conversation_id IS NULL"))
+
+    if legacy_messages and postgres:
+        conn.execute(text("""
+            INSERT INTO messages (id, conversation_id, sender, content, handled_by_gemini, timestamp)
+            SELECT gen_random_uuid(), c.id, l.role, l.content, FALSE, l.created_at
+            FROM messages_legacy l
+            JOIN conversations c ON c.conversation_id = l.conversation_id::text
+        """))
+    elif legacy_messages:
+        # Sin gen_random_uuid(): los IDs se generan aquí (bases de prueba/desarrollo)
+        conversations, messages = _v1_tables()
+        legacy = conn.execute(text(
+            "SELECT conversation_id, role, content, created_at FROM messages_legacy ORDER BY id"
+        ).columns(created_at=DateTime)).all()
+        pks = dict(conn.execute(select(conversations.c.conversation_id, conversations.c.id)).all())
+        rows = [
+            {"id": uuid.uuid4(), "conversation_id": pks[conversation_id], "sender": role,
+             "content": content, "handled_by_gemini": False, "timestamp": created_at}
+            for conversation_id, role, content, created_at in legacy if conversation_id in pks
+        ]
+        if rows:
+            conn.execute(messages.insert(), rows)
+
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_conversations_conversation_id "
+        "ON conversations (conversation_id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_id_timestamp "
+        "ON messages (conversation_id, timestamp)"
+    ))
+
+
+def _v3_keyset_index(conn: Connection):
+    """
+    La paginación del historial ordena por (timestamp, id): se agrega `id` al
+    índice compuesto para que el desempate también salga del índice.
+    """
+    _create_index(conn, "ix_messages_conversation_id_timestamp_id", "messages", "(conversation_id, timestamp, id)")
+    concurrently = "CONCURRENTLY " if _is_postgres(conn) else ""
+    conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS ix_messages_conversation_id_timestamp"))
+
+
+def _v4_served_from_cache(conn: Connection):
+    """
+    Marca de las respuestas servidas desde la caché de respuestas, aparte de
+    handled_by_gemini, para medir cuántas llamadas al modelo se ahorran.
+    """
+    if "served_from_cache" not in _columns(conn, "messages"):
+        conn.execute(text(
+            "ALTER TABLE messages ADD COLUMN served_from_cache BOOLEAN NOT NULL DEFAULT FALSE"
+        ))
+
+
+def _v5_content_search(conn: Connection):
+    """
+    Búsqueda de texto completo sobre el contenido de los mensajes (memoria de
+    conversación): índice GIN de expresión sobre CONTENT_TSVECTOR, creado
+    CONCURRENTLY. No agrega columnas: no reescribe ni bloquea messages, y
+    puede correr al arrancar. Solo Postgres; en otros motores la memoria usa
+    el índice en proceso (memory.py).
+    """
+    if _is_postgres(conn):
+        _create_index(conn, "ix_messages_content_fts", "messages", f"USING GIN ({CONTENT_TSVECTOR})")
+
+
+def _v6_retention(conn: Connection):
+    """
+    Retención y archivado:
+    - messages.conversation_id → ON DELETE CASCADE (Postgres; en SQLite no se
+      pueden cambiar FKs y crud borra los mensajes explícitamente). La FK se
+      crea NOT VALID: el bloqueo exclusivo de DROP/ADD CONSTRAINT dura solo
+      esta transacción corta; la validación (recorre toda la tabla) es la
+      migración 8, en su propia transacción.
+    - Tabla archived_conversations (manifiesto de archive.py).
+    - Índice conversations (created_at, id) para recorrer candidatas a archivar.
+    """
+    if _is_postgres(conn):
+        for foreign_key in inspect(conn).get_foreign_keys("messages"):
+            if foreign_key["referred_table"] == "conversations" and foreign_key.get("name"):
+                conn.execute(text(f'ALTER TABLE messages DROP CONSTRAINT "{foreign_key["name"]}"'))
+        conn.execute(text(
+            "ALTER TABLE messages ADD CONSTRAINT messages_conversation_id_fkey "
+            "FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE NOT VALID"
+        ))
+
+    metadata = MetaData()
+    Table(
+        "archived_conversations", metadata,
+        Column("id", UUID(as_uuid=True), primary_key=True),
+        Column("conversation_pk", UUID(as_uuid=True), nullable=False),
+        Column("conversation_id", String(36), nullable=False),
+        Column("created_at", DateTime),
+        Column("last_message_at", DateTime),
+        Column("message_count", Integer, nullable=False),
+        Column("archive_path", String(500), nullable=False),
+        Column("archived_at", DateTime, nullable=False),
+    )
+    metadata.create_all(conn, checkfirst=True)
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_archived_conversations_conversation_id "
+        "ON archived_conversations (conversation_id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_conversations_created_at_id ON conversations (created_at, id)"
+    ))
+
+
+def _v7_export_index(conn: Connection):
+    """
+    La exportación recorre todos los mensajes por rango de fechas en orden
+    (timestamp, id), con cursor keyset: necesita su propio índice.
+    """
+    _create_index(conn, "ix_messages_timestamp_id", "messages", "(timestamp, id)")
+
+
+def _v8_validate_cascade_fk(conn: Connection):
+    """
+    Valida la FK NOT VALID de la migración 6. VALIDATE CONSTRAINT solo toma
+    SHARE UPDATE EXCLUSIVE: las escrituras siguen mientras recorre la tabla.
+    """
+    if _is_postgres(conn):
+        conn.execute(text("ALTER TABLE messages VALIDATE CONSTRAINT messages_conversation_id_fkey"))
+
+
+def _v9_archive_chunks(conn: Connection):
+    """Tabla archive_chunks: destino durable del archivado (ARCHIVE_DESTINATION=table)."""
+    metadata = MetaData()
+    Table(
+        "archive_chunks", metadata,
+        Column("id", UUID(as_uuid=True), primary_key=True),
+        Column("name", String(200), nullable=False, unique=True),
+        Column("message_count", Integer, nullable=False),
+        Column("payload", LargeBinary, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+    )
+    metadata.create_all(conn, checkfirst=True)
+
+
+def _v10_drop_content_tsv(conn: Connection):
+    """
+    Bases que aplicaron la primera versión de la migración 5 (columna
+    generada content_tsv STORED + su índice): se quita la columna (DROP COLUMN
+    no reescribe la tabla; su índice cae con ella) y se asegura el índice de
+    expresión. En las demás no hace nada.
+    """
+    if not _is_postgres(conn):
+        return
+    if "content_tsv" in _columns(conn, "messages"):
+        # Bloqueo exclusivo corto: si no lo consigue pronto, falla en vez de
+        # encolar detrás de él todas las escrituras
+        conn.execute(text("SET lock_timeout = '5s'"))
+        try:
+            conn.execute(text("ALTER TABLE messages DROP COLUMN IF EXISTS content_tsv"))
+        finally:
+            conn.execute(text("RESET lock_timeout"))
+    _create_index(conn, "ix_messages_content_fts", "messages", f"USING GIN ({CONTENT_TSVECTOR})")
+
+
+MIGRATIONS = [
+    Migration(1, "Tablas base conversations/messages", _v1_baseline),
+    Migration(2, "Esquema canónico + índices de búsqueda", _v2_canonical_schema),
+    Migration(3, "Índice (conversation_id, timestamp, id) para paginar el historial", _v3_keyset_index, transactional=False),
+    Migration(4, "Columna messages.served_from_cache", _v4_served_from_cache),
+    Migration(5, "Búsqueda de texto completo en messages.content (Postgres)", _v5_content_search, transactional=False),
+    Migration(6, "FK con ON DELETE CASCADE + tabla archived_conversations", _v6_retention),
+    Migration(7, "Índice (timestamp, id) para exportar por rango de fechas", _v7_export_index, transactional=False),
+    Migration(8, "Validar la FK con ON DELETE CASCADE de messages", _v8_validate_cascade_fk),
+    Migration(9, "Tabla archive_chunks (archivado dentro de la BD)", _v9_archive_chunks),
+    Migration(10, "Quitar la columna content_tsv (índice de expresión)", _v10_drop_content_tsv, transactional=False),
+]
+
+HEAD = MIGRATIONS[-1].version
+
+
+# ==========================
+# 📌 Versión del esquema
+# ==========================
+
+_version_table = Table(
+    SCHEMA_VERSION_TABLE, MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200)),
+    Column("applied_at", DateTime),
+)
+
+
+def current_version(conn: Connection) -> int:
+    """
+    Versión aplicada del esquema (0 si nunca se ha migrado).
+    Es una sola consulta; no reflexiona las tablas.
+    """
+    try:
+        with conn.begin_nested():
+            version = conn.execute(text(f"SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}")).scalar()
+    except DBAPIError:
+        return 0
+    return version or 0
+
+
+def upgrade(engine: Engine, target: int = HEAD) -> int:
+    """
+    Aplica en orden las migraciones pendientes hasta `target`. Cada migración
+    corre en su propia transacción junto con el registro de su versión; las
+    no transaccionales corren en una conexión autocommit aparte y su versión
+    se registra al terminar. Retorna la versión final.
+    """
+    with engine.connect() as conn:
+        postgres = _is_postgres(conn)
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+            conn.commit()
+        try:
+            with conn.begin():
+                _version_table.create(conn, checkfirst=True)
+
+            version = 0
+            for migration in MIGRATIONS:
+                if migration.version > target:
+                    break
+                if not migration.transactional:
+                    with conn.begin():
+                        version = current_version(conn)
+                    if migration.version <= version:
+                        continue
+                    logger.info("Aplicando migración %s: %s", migration.version, migration.description)
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as autocommit:
+                        migration.apply(autocommit)
+                    with conn.begin():
+                        _record_version(conn, migration)
+                    version = migration.version
+                    continue
+                with conn.begin():
+                    version = current_version(conn)
+                    if migration.version <= version:
+                        continue
+                    logger.info("Aplicando migración %s: %s", migration.version, migration.description)
+                    migration.apply(conn)
+                    _record_version(conn, migration)
+                    version = migration.version
+            return version
+        finally:
+            if postgres:
+                conn.rollback()
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+                conn.commit()
+
+
+def _record_version(conn: Connection, migration: Migration):
+    conn.execute(_version_table.insert().values(
+        version=migration.version,
+        description=migration.description,
+        applied_at=datetime.utcnow(),
+    ))
+
+
+def ensure_schema(engine: Engine, auto_upgrade: bool = None):
+    """
+    Se llama al iniciar la app: compara la versión del esquema con HEAD.
+    Si está atrasada migra (AUTO_MIGRATE=1, por defecto) o falla.
+    """
+    if auto_upgrade is None:
+        auto_upgrade = os.getenv("AUTO_MIGRATE", "1") != "0"
+
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version == HEAD:
+        return
+    if version > HEAD:
+        raise RuntimeError(f"❌ El esquema (v{version}) es más nuevo que este código (v{HEAD}).")
+    if not auto_upgrade:
+        raise RuntimeError(f"❌ El esquema está en v{version} y se necesita v{HEAD}. Corre: python migrations.py upgrade")
+    upgrade(engine)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from database import get_engine
+
+    engine = get_engine()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        print(f"✅ Esquema en la versión {upgrade(engine)}")
+    elif command == "current":
+        with engine.connect() as conn:
+            print(current_version(conn))
+    elif command == "check":
+        with engine.connect() as conn:
+            version = current_version(conn)
+        print(f"Esquema v{version}, código v{HEAD}")
+        sys.exit(0 if version == HEAD else 1)
+    else:
+        print("Comandos: upgrade | current | check")
+        sys.exit(2)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional
-from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Text
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Integer, Text, Index, LargeBinary, false
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 from sqlalchemy.dialects.postgresql import UUID
@@ -18,6 +18,10 @@ class ChatRequest(BaseModel):
     message: str
 
 
+class ChatBatchRequest(BaseModel):
+    messages: List[ChatRequest] = Field(..., min_length=1, max_length=1000)
+
+
 # ==========================
 # 📌 MODELOS SQLAlchemy (BD)
 # ==========================
@@ -26,11 +30,20 @@ class Conversation(Base):
     __tablename__ = 'conversations'
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    conversation_id = Column(String) # Considera si este campo es realmente necesario si 'id' ya es un UUID
+    # ID público que usa el frontend; se busca en cada request (índice único)
+    conversation_id = Column(String(36), nullable=False, default=lambda: str(uuid.uuid4()))
     created_at = Column(DateTime, default=datetime.utcnow) # Es útil tener la fecha de creación
 
-    # Relación inversa (back_populates) para acceder a los mensajes desde la conversación
-    messages = relationship("Message", back_populates="conversation")
+    # Relación inversa (back_populates) para acceder a los mensajes desde la conversación.
+    # Al borrar una conversación sus mensajes se van con ella; passive_deletes deja
+    # ese trabajo al ON DELETE CASCADE de la BD en vez de cargar cada mensaje.
+    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_conversations_conversation_id", "conversation_id", unique=True),
+        # Candidatas a archivar (archive.py) en orden de antigüedad
+        Index("ix_conversations_created_at_id", "created_at", "id"),
+    )
 
 
 class Message(Base):
@@ -39,12 +52,56 @@ class Message(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # Asegúrate de que el tipo de ForeignKey coincida con el tipo de la clave primaria de 'conversations'
-    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"))
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"))
     
     sender = Column(String)  # "user" o "bot"
     content = Column(Text)
     handled_by_gemini = Column(Boolean, default=False)
+    # Respuesta servida desde la caché de respuestas (sin llamar al modelo)
+    served_from_cache = Column(Boolean, nullable=False, default=False, server_default=false())
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     # Relación con conversación
-    conversation = relationship("Conversation", back_populates="messages")
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="messages")
+
+    __table_args__ = (
+        # Historial de una conversación ordenado por fecha (paginación por cursor)
+        Index("ix_messages_conversation_id_timestamp_id", "conversation_id", "timestamp", "id"),
+        # Exportación por rango de fechas (export.py)
+        Index("ix_messages_timestamp_id", "timestamp", "id"),
+    )
+
+
+class ArchivedConversation(Base):
+    """
+    Manifiesto de lo que archive.py movió a almacenamiento frío: una fila por
+    conversación y corrida (una conversación que revive puede archivarse otra vez).
+    """
+    __tablename__ = "archived_conversations"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    conversation_pk = Column(UUID(as_uuid=True), nullable=False)   # Conversation.id original
+    conversation_id = Column(String(36), nullable=False)           # ID público
+    created_at = Column(DateTime)
+    last_message_at = Column(DateTime)
+    message_count = Column(Integer, nullable=False, default=0)
+    archive_path = Column(String(500), nullable=False)             # archivo .jsonl.gz o "db:<nombre>" (ArchiveChunk)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_archived_conversations_conversation_id", "conversation_id"),
+    )
+
+
+class ArchiveChunk(Base):
+    """
+    Lote archivado con ARCHIVE_DESTINATION=table: el mismo .jsonl.gz que
+    se escribiría en disco, guardado en la BD junto con el borrado.
+    """
+    __tablename__ = "archive_chunks"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = Column(String(200), nullable=False, unique=True)
+    message_count = Column(Integer, nullable=False, default=0)
+    payload = Column(LargeBinary, nullable=False)                  # JSONL comprimido con gzip
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
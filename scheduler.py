@@ -0,0 +1,406 @@
+# scheduler.py - Registro y ejecución de herramientas externas para Fulano AI
+#
+# Las herramientas (clima, noticias, traducción...) son funciones bloqueantes.
+# El scheduler las corre en un pool de hilos acotado, con:
+#   - límite de llamadas concurrentes por herramienta (si no hay cupo se espera
+#     hasta TOOL_QUEUE_TIMEOUT_MS; las respuestas que ya están en la caché HTTP
+#     o en vuelo no gastan cupo)
+#   - deadline por llamada
+#   - circuit breaker: si un upstream falla seguido, se responde de una vez
+#     con error durante `reset_timeout` segundos en vez de seguir esperándolo
+#   - fan-out de varias llamadas en paralelo para un mismo mensaje
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Callable, NamedTuple, Optional
+
+import metrics
+import tools
+from http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+
+class ToolError(Exception):
+    """Error base del scheduler."""
+
+
+class ToolNotFound(ToolError):
+    pass
+
+
+class ToolBusy(ToolError):
+    """La herramienta ya tiene el máximo de llamadas en curso."""
+
+
+class ToolTimeout(ToolError):
+    pass
+
+
+class CircuitOpen(ToolError):
+    """El circuit breaker está abierto: el upstream viene fallando."""
+
+
+# ==========================
+# 📌 Circuit breaker
+# ==========================
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Cerrado: deja pasar. Abierto: rechaza hasta que pase reset_timeout;
+        después deja pasar una sola llamada de prueba (half-open).
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit breaker abierto tras %s fallos", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+# ==========================
+# 📌 Registro de herramientas
+# ==========================
+
+class ToolSpec(NamedTuple):
+    name: str
+    func: Callable
+    timeout: float
+    semaphore: threading.BoundedSemaphore
+    breaker: CircuitBreaker
+    is_failure: Optional[Callable] = None  # resultado → True si cuenta como fallo
+    async_func: Optional[Callable] = None  # versión async (acall la usa en vez del pool de hilos)
+    is_warm: Optional[Callable] = None     # args → True si la respuesta ya está en caché o en vuelo
+
+
+def is_error_result(result) -> bool:
+    """Las herramientas de tools.py no lanzan excepciones: retornan {"error": ...}."""
+    return isinstance(result, dict) and "error" in result
+
+
+class ToolScheduler:
+    def __init__(self, max_workers: int = 16, queue_timeout: float = 0.25):
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout  # espera máxima por un cupo en call/call_many/acall
+        self._executor = None
+        self.tools = {}
+        self.stats_by_tool = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        func: Callable,
+        max_concurrency: int = 4,
+        timeout: float = 5.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        is_failure: Callable = None,
+        async_func: Callable = None,
+        is_warm: Callable = None,
+    ):
+        self.tools[name] = ToolSpec(
+            name=name,
+            func=func,
+            timeout=timeout,
+            semaphore=threading.BoundedSemaphore(max_concurrency),
+            breaker=CircuitBreaker(failure_threshold, reset_timeout),
+            is_failure=is_failure,
+            async_func=async_func,
+            is_warm=is_warm,
+        )
+        self.stats_by_tool[name] = {"calls": 0, "errors": 0, "timeouts": 0, "rejected": 0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Se crea al primer uso (y de nuevo si la app se reinicia en el mismo proceso)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool")
+        return self._executor
+
+    def _count(self, name: str, field: str):
+        with self._lock:
+            self.stats_by_tool[name][field] += 1
+        if field != "calls":
+            metrics.tool_errors.inc(name, field)
+
+    def _spec(self, name: str) -> ToolSpec:
+        spec = self.tools.get(name)
+        if spec is None:
+            raise ToolNotFound(name)
+        return spec
+
+    # ==========================
+    # 📌 Ejecución
+    # ==========================
+
+    def _served_without_upstream(self, spec: ToolSpec, args, kwargs) -> bool:
+        """La respuesta ya está en la caché HTTP o en vuelo: no hace falta un cupo."""
+        return spec.is_warm is not None and spec.is_warm(*args, **kwargs)
+
+    def _try_acquire(self, spec: ToolSpec, args, kwargs, wait_seconds: float = 0.0):
+        """
+        None si la llamada puede correr sin cupo (caché / en vuelo); True si
+        tomó un cupo (hay que liberarlo al terminar); False si no lo consiguió
+        en `wait_seconds`.
+        """
+        if self._served_without_upstream(spec, args, kwargs):
+            return None
+        if wait_seconds > 0:
+            return spec.semaphore.acquire(timeout=wait_seconds)
+        return spec.semaphore.acquire(blocking=False)
+
+    async def _atry_acquire(self, spec: ToolSpec, args, kwargs):
+        """Como _try_acquire con queue_timeout, pero esperando sin bloquear el loop."""
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            acquired = self._try_acquire(spec, args, kwargs)
+            if acquired is not False or time.monotonic() >= deadline:
+                return acquired
+            await asyncio.sleep(0.01)
+
+    def _admit(self, spec: ToolSpec, acquired):
+        """
+        Cierra la admisión después de _try_acquire: rechaza si no hubo cupo o
+        si el breaker está abierto. Las respuestas desde caché pasan siempre.
+        """
+        name = spec.name
+        if acquired is False:
+            self._count(name, "rejected")
+            raise ToolBusy(f"{name}: demasiadas llamadas en curso")
+        if acquired and not spec.breaker.allow():
+            spec.semaphore.release()
+            self._count(name, "rejected")
+            raise CircuitOpen(f"{name}: servicio no disponible por ahora")
+        self._count(name, "calls")
+
+    def submit(self, name: str, *args, **kwargs):
+        """
+        Envía la llamada al pool y retorna el concurrent.futures.Future.
+        Falla de inmediato (sin encolar) si el breaker está abierto o la
+        herramienta ya tiene todas sus llamadas concurrentes ocupadas, salvo
+        que la respuesta ya esté en la caché o en vuelo.
+        """
+        spec = self._spec(name)
+        return self._submit(spec, args, kwargs, self._try_acquire(spec, args, kwargs))
+
+    def _submit(self, spec: ToolSpec, args, kwargs, acquired):
+        self._admit(spec, acquired)
+        try:
+            future = self.executor.submit(self._run, spec, args, kwargs, acquired is not None)
+        except BaseException:
+            if acquired:
+                spec.semaphore.release()
+            raise
+        # El cupo se libera cuando el hilo termina de verdad, aunque el llamador
+        # ya se haya ido por timeout: así un upstream colgado no ocupa más hilos.
+        if acquired:
+            future.add_done_callback(lambda _: spec.semaphore.release())
+        return future
+
+    def _run(self, spec: ToolSpec, args, kwargs, upstream: bool = True):
+        started = time.perf_counter()
+        try:
+            result = spec.func(*args, **kwargs)
+        except Exception:
+            self._record_failure(spec, started, upstream)
+            raise
+        return self._record_result(spec, started, result, upstream)
+
+    async def _arun(self, spec: ToolSpec, args, kwargs, upstream: bool = True):
+        started = time.perf_counter()
+        try:
+            result = await spec.async_func(*args, **kwargs)
+        except Exception:
+            self._record_failure(spec, started, upstream)
+            raise
+        return self._record_result(spec, started, result, upstream)
+
+    # El breaker solo cuenta llamadas que tomaron cupo (upstream=True): las que
+    # sirve la caché HTTP o una llamada en vuelo no dicen nada del upstream, y
+    # un éxito desde caché no debe cerrar un breaker abierto.
+
+    def _record_failure(self, spec: ToolSpec, started: float, upstream: bool = True):
+        metrics.tool_duration.observe(time.perf_counter() - started, spec.name)
+        if upstream:
+            spec.breaker.record_failure()
+        self._count(spec.name, "errors")
+
+    def _record_result(self, spec: ToolSpec, started: float, result, upstream: bool = True):
+        metrics.tool_duration.observe(time.perf_counter() - started, spec.name)
+        if spec.is_failure is not None and spec.is_failure(result):
+            if upstream:
+                spec.breaker.record_failure()
+            self._count(spec.name, "errors")
+        elif upstream:
+            spec.breaker.record_success()
+        return result
+
+    def _record_timeout(self, spec: ToolSpec, acquired):
+        if acquired is not None:
+            spec.breaker.record_failure()
+        self._count(spec.name, "timeouts")
+
+    def call(self, name: str, *args, timeout: float = None, **kwargs):
+        """
+        Ejecuta una herramienta y espera su resultado hasta el deadline. Si no
+        hay cupo libre espera hasta queue_timeout a que se libere uno.
+        """
+        spec = self._spec(name)
+        acquired = self._try_acquire(spec, args, kwargs, self.queue_timeout)
+        future = self._submit(spec, args, kwargs, acquired)
+        try:
+            return future.result(timeout=timeout or spec.timeout)
+        except FutureTimeout:
+            self._record_timeout(spec, acquired)
+            raise ToolTimeout(f"{name}: no respondió a tiempo")
+
+    def call_many(self, calls: list, timeout: float = None) -> list:
+        """
+        Fan-out: corre varias llamadas en paralelo y retorna, en el mismo orden,
+        el resultado de cada una o la excepción (ToolError u otra) si falló.
+        `calls` es una lista de (nombre, args) o (nombre, args, kwargs).
+        """
+        futures = []
+        for call in calls:
+            name, args, kwargs = (tuple(call) + ({},))[:3]
+            try:
+                spec = self._spec(name)
+                acquired = self._try_acquire(spec, args, kwargs, self.queue_timeout)
+                futures.append((name, self._submit(spec, args, kwargs, acquired), acquired))
+            except ToolError as e:
+                futures.append((name, e, None))
+
+        pending = [f for _, f, _ in futures if not isinstance(f, Exception)]
+        deadline = timeout or max(
+            (self.tools[name].timeout for name, f, _ in futures if not isinstance(f, Exception)), default=0
+        )
+        wait(pending, timeout=deadline)
+
+        results = []
+        for name, future, acquired in futures:
+            if isinstance(future, Exception):
+                results.append(future)
+            elif not future.done():
+                self._record_timeout(self.tools[name], acquired)
+                results.append(ToolTimeout(f"{name}: no respondió a tiempo"))
+            elif future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
+        return results
+
+    async def acall(self, name: str, *args, timeout: float = None, **kwargs):
+        """
+        Versión para código async: no bloquea el event loop. Si la herramienta
+        tiene async_func se corre en el loop (sin ocupar un hilo); si no, en el pool.
+        """
+        spec = self._spec(name)
+        acquired = await self._atry_acquire(spec, args, kwargs)
+        if spec.async_func is not None:
+            self._admit(spec, acquired)
+            task = asyncio.ensure_future(self._arun(spec, args, kwargs, acquired is not None))
+            # Igual que en submit: el cupo se libera cuando la llamada termina de verdad
+            task.add_done_callback(lambda done: self._release_task(spec, done, acquired))
+            future = task
+        else:
+            future = asyncio.wrap_future(self._submit(spec, args, kwargs, acquired))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or spec.timeout)
+        except asyncio.TimeoutError:
+            self._record_timeout(spec, acquired)
+            raise ToolTimeout(f"{name}: no respondió a tiempo")
+
+    @staticmethod
+    def _release_task(spec: ToolSpec, task, acquired):
+        if acquired:
+            spec.semaphore.release()
+        # Evita el aviso de "exception never retrieved" si el llamador ya se fue
+        if not task.cancelled():
+            task.exception()
+
+    async def acall_many(self, calls: list, timeout: float = None) -> list:
+        async def one(call):
+            name, args, kwargs = (tuple(call) + ({},))[:3]
+            try:
+                return await self.acall(name, *args, timeout=timeout, **kwargs)
+            except Exception as e:
+                return e
+
+        return list(await asyncio.gather(*(one(call) for call in calls)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: dict(counters, breaker=self.tools[name].breaker.state)
+                for name, counters in self.stats_by_tool.items()
+            }
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ==========================
+# 📌 Herramientas registradas
+# ==========================
+
+def build_default_scheduler() -> ToolScheduler:
+    scheduler = ToolScheduler(
+        max_workers=int(os.getenv("TOOL_MAX_WORKERS", "16")),
+        queue_timeout=float(os.getenv("TOOL_QUEUE_TIMEOUT_MS", "250")) / 1000,
+    )
+    scheduler.register(
+        "clima", tools.get_weather, max_concurrency=8, timeout=6.0, is_failure=is_error_result,
+        async_func=tools.aget_weather,
+        is_warm=lambda city="Bogotá": http_client.is_warm("weather", tools.weather_cache_key(city)),
+    )
+    scheduler.register("noticias", tools.get_news, max_concurrency=4, timeout=7.0, is_failure=is_error_result)
+    scheduler.register("traducir", tools.translate_text, max_concurrency=4, timeout=6.0, is_failure=is_error_result)
+    scheduler.register("pokemon", tools.get_pokemon_info, max_concurrency=4, timeout=7.0, is_failure=is_error_result)
+    scheduler.register("tasa_cambio", tools.get_exchange_rate, max_concurrency=4, timeout=6.0, is_failure=is_error_result)
+    return scheduler
+
+
+tool_scheduler = build_default_scheduler()
@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    Responde según server.routes: ruta → (status, content_type, cuerpo, demora).
+    Las rutas sin configurar responden {"path": ruta} con 200.
+    """
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        with self.server.lock:
+            self.server.hits[path] = self.server.hits.get(path, 0) + 1
+        status, content_type, body, delay = self.server.routes.get(
+            path, (200, "application/json", {"path": path}, 0)
+        )
+        if delay:
+            time.sleep(delay)
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    """Servidor HTTP local para probar las herramientas sin salir a internet."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.hits = {}
+    server.routes = {}
+    server.lock = threading.Lock()
+    server.url = lambda path: f"http://127.0.0.1:{server.server_address[1]}{path}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app_client(tmp_path, monkeypatch):
+    """TestClient de la app (con lifespan) sobre un SQLite temporal y cachés vacías."""
+    from fastapi.testclient import TestClient
+
+    import main
+    from cache import conversation_cache, response_cache
+    from memory import conversation_memory
+
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'app.db'}")
+    for cache in (conversation_cache, response_cache, conversation_memory):
+        cache.clear()
+    with TestClient(main.app) as client:
+        yield client
+    for cache in (conversation_cache, response_cache, conversation_memory):
+        cache.clear()
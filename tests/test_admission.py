@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+from starlette.requests import Request
+
+from admission import AdmissionController, InMemoryRateLimitBackend, Rejected
+
+
+def _request(body: dict, client: str = "1.2.3.4") -> Request:
+    payload = json.dumps(body).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    scope = {"type": "http", "method": "POST", "path": "/api/chat", "headers": [], "client": (client, 1234)}
+    return Request(scope, receive)
+
+
+async def _admit(controller: AdmissionController, request: Request):
+    admission = controller.admit(request)
+    await admission.__anext__()
+    await admission.aclose()
+
+
+def _controller(**kwargs) -> AdmissionController:
+    options = dict(client_rate=5, client_burst=20, conversation_rate=0, max_concurrent=0)
+    options.update(kwargs)
+    return AdmissionController(backend=InMemoryRateLimitBackend(), **options)
+
+
+def test_single_messages_are_limited_by_burst():
+    controller = _controller()
+
+    async def scenario():
+        for _ in range(20):
+            await _admit(controller, _request({"message": "hola"}))
+        with pytest.raises(Rejected) as excinfo:
+            await _admit(controller, _request({"message": "hola"}))
+        return excinfo.value
+
+    rejection = asyncio.run(scenario())
+    assert rejection.status_code == 429
+    assert rejection.reason == "client_rate"
+
+
+def test_batch_pays_one_token_per_message():
+    controller = _controller()
+    batch = {"messages": [{"message": f"hola {i}"} for i in range(1000)]}
+
+    async def scenario():
+        await _admit(controller, _request(batch))  # con el bucket lleno pasa, y queda en deuda
+        with pytest.raises(Rejected) as excinfo:
+            await _admit(controller, _request(batch))
+        with pytest.raises(Rejected):
+            await _admit(controller, _request({"message": "hola"}))
+        return excinfo.value
+
+    rejection = asyncio.run(scenario())
+    assert rejection.retry_after >= (1000 - 20) / 5
+
+
+def test_conversation_bucket_counts_messages_per_conversation():
+    controller = _controller(client_rate=0, conversation_rate=1, conversation_burst=5)
+    batch = {"messages": [{"message": "hola", "conversation_id": "abc"} for _ in range(5)]}
+
+    async def scenario():
+        await _admit(controller, _request(batch))
+        with pytest.raises(Rejected) as excinfo:
+            await _admit(controller, _request({"message": "hola", "conversation_id": "abc"}))
+        await _admit(controller, _request({"message": "hola", "conversation_id": "otra"}))
+        return excinfo.value
+
+    assert asyncio.run(scenario()).reason == "conversation_rate"
+
+
+def test_backend_cost_above_burst_goes_into_debt():
+    backend = InMemoryRateLimitBackend()
+
+    async def scenario():
+        first = await backend.take("k", rate=5, burst=20, cost=100)
+        second = await backend.take("k", rate=5, burst=20, cost=1)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == 0
+    assert second == pytest.approx((1 + 80) / 5, rel=0.01)
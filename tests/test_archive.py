@@ -0,0 +1,137 @@
+import gzip
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+import migrations
+import models
+from archive import DIRECTORY, TABLE, ArchiveUnavailable, ConversationArchiver
+
+OLD = datetime.utcnow() - timedelta(days=200)
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'archive.db'}")
+    migrations.upgrade(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def add_conversation(session_factory, at: datetime, messages: int = 2) -> uuid.UUID:
+    pk = uuid.uuid4()
+    with session_factory() as db:
+        db.execute(insert(models.Conversation).values(id=pk, conversation_id=str(uuid.uuid4()), created_at=at))
+        for index in range(messages):
+            add_message(db, pk, at + timedelta(seconds=index))
+        db.commit()
+    return pk
+
+
+def add_message(db, pk, at: datetime, content: str = "hola"):
+    db.execute(insert(models.Message).values(
+        id=uuid.uuid4(), conversation_id=pk, sender="user", content=content,
+        handled_by_gemini=False, served_from_cache=False, timestamp=at,
+    ))
+
+
+def count(session_factory, model, *where) -> int:
+    with session_factory() as db:
+        return db.scalar(select(func.count()).select_from(model).where(*where))
+
+
+def archived_records(session_factory) -> list:
+    with session_factory() as db:
+        payloads = db.scalars(select(models.ArchiveChunk.payload)).all()
+    return [json.loads(line) for payload in payloads for line in gzip.decompress(payload).splitlines()]
+
+
+def test_archives_to_table_then_deletes(session_factory):
+    old = [add_conversation(session_factory, OLD) for _ in range(3)]
+    recent = add_conversation(session_factory, datetime.utcnow() - timedelta(days=1))
+
+    totals = ConversationArchiver(session_factory, destination=TABLE).run()
+
+    assert totals["conversations"] == 3 and totals["messages"] == 6
+    assert len(archived_records(session_factory)) == 6
+    assert count(session_factory, models.ArchivedConversation) == 3
+    assert count(session_factory, models.Conversation, models.Conversation.id.in_(old)) == 0
+    assert count(session_factory, models.Message, models.Message.conversation_id.in_(old)) == 0
+    assert count(session_factory, models.Message, models.Message.conversation_id == recent) == 2
+
+
+def test_archives_to_directory(session_factory, tmp_path):
+    add_conversation(session_factory, OLD, messages=3)
+    archiver = ConversationArchiver(session_factory, destination=DIRECTORY, output_dir=tmp_path / "frio")
+
+    totals = archiver.run()
+
+    [path] = totals["files"]
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert len(f.readlines()) == 3
+    assert count(session_factory, models.Message) == 0
+
+
+def test_refuses_to_delete_without_a_durable_destination(session_factory):
+    add_conversation(session_factory, OLD)
+    archiver = ConversationArchiver(session_factory)
+
+    with pytest.raises(ArchiveUnavailable):
+        archiver.run()
+    assert archiver.run(dry_run=True)["conversations"] == 1
+    assert count(session_factory, models.Message) == 2
+
+
+def test_resumes_where_the_previous_run_stopped(session_factory):
+    for _ in range(5):
+        add_conversation(session_factory, OLD)
+    archiver = ConversationArchiver(session_factory, destination=TABLE, chunk_size=2)
+
+    assert archiver.run(max_chunks=1)["conversations"] == 2
+    assert count(session_factory, models.Conversation) == 3
+    assert archiver.run()["conversations"] == 3
+    assert count(session_factory, models.Conversation) == 0
+    assert count(session_factory, models.ArchivedConversation) == 5
+
+
+def test_failed_chunk_deletes_nothing_and_is_retried(session_factory, monkeypatch):
+    add_conversation(session_factory, OLD)
+    archiver = ConversationArchiver(session_factory, destination=TABLE)
+
+    def fail(*args):
+        raise RuntimeError("se cayó la conexión")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(archiver, "_delete_archived", fail)
+        with pytest.raises(RuntimeError):
+            archiver.run()
+    assert count(session_factory, models.Message) == 2
+    assert count(session_factory, models.ArchiveChunk) == 0
+
+    assert archiver.run()["messages"] == 2
+    assert count(session_factory, models.Message) == 0
+
+
+def test_conversation_with_a_new_message_is_not_deleted(session_factory):
+    revived = add_conversation(session_factory, OLD)
+    idle = add_conversation(session_factory, OLD)
+    archiver = ConversationArchiver(session_factory, destination=TABLE)
+    cutoff = datetime.utcnow() - timedelta(days=archiver.idle_days)
+
+    with session_factory() as db:
+        candidates = archiver.find_idle(db, cutoff, limit=10)
+        assert {row.id for row in candidates} == {revived, idle}
+        # Llega un mensaje después de listar las candidatas y antes de archivar
+        with session_factory() as other:
+            add_message(other, revived, datetime.utcnow(), "volví")
+            other.commit()
+        result = archiver.archive_chunk(db, candidates, cutoff)
+
+    assert result["conversations"] == 1
+    assert count(session_factory, models.Message, models.Message.conversation_id == revived) == 3
+    assert count(session_factory, models.Conversation, models.Conversation.id == idle) == 0
+    assert {record["content"] for record in archived_records(session_factory)} == {"hola"}
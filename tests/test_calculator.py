@@ -0,0 +1,90 @@
+import pytest
+
+import calculator
+import tools
+from calculator import CalculationError, evaluate, extract_expression
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    calculator._compile.cache_clear()
+    calculator._evaluate_cached.cache_clear()
+    yield
+    calculator._compile.cache_clear()
+    calculator._evaluate_cached.cache_clear()
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("cuánto es 8 por 8", 64),
+    ("cuanto es 100 entre 5", 20),
+    ("100 dividido por 4", 25),
+    ("2 elevado a 10", 1024),
+    ("5 al cuadrado", 25),
+    ("3 al cubo", 27),
+    ("7 mas 3", 10),
+    ("10 menos 4", 6),
+    ("10 mod 3", 1),
+    ("8x8", 64),
+    ("(2+3)*4", 20),
+])
+def test_spanish_phrasings(message, expected):
+    assert evaluate(extract_expression(message)) == expected
+
+
+@pytest.mark.parametrize("expression", ["(-8)**0.5", "(0-8)^0.5", "(-8)**(1/3)"])
+def test_complex_result_is_rejected(expression):
+    with pytest.raises(CalculationError):
+        evaluate(extract_expression(expression))
+
+
+def test_complex_result_does_not_escape_calculate():
+    assert tools.calculate("(0-8)^0.5").startswith("No pude calcular eso")
+
+
+def test_negative_base_with_integer_exponent():
+    assert evaluate("(-8)**2") == 64
+    assert evaluate("(-2)**-1") == -0.5
+
+
+@pytest.mark.parametrize("expression", ["9**9**9**9", "2**5000", "10**1001"])
+def test_exponent_and_result_size_limits(expression):
+    with pytest.raises(CalculationError):
+        evaluate(expression)
+
+
+def test_operand_size_limit():
+    with pytest.raises(CalculationError):
+        evaluate("9" * 2000)
+
+
+def test_multiplication_size_limit():
+    big = str(2 ** 4000)
+    with pytest.raises(CalculationError):
+        evaluate(f"{big}*{big}")
+
+
+def test_node_limit():
+    with pytest.raises(CalculationError):
+        evaluate("+".join(["1"] * 60))
+
+
+def test_division_by_zero():
+    with pytest.raises(CalculationError):
+        evaluate("1/0")
+
+
+def test_time_budget(monkeypatch):
+    monkeypatch.setattr(calculator, "TIME_BUDGET_MS", -1)
+    with pytest.raises(CalculationError, match="demasiado tiempo"):
+        evaluate("1+1")
+
+
+def test_only_arithmetic():
+    with pytest.raises(CalculationError):
+        evaluate("__import__('os')")
+
+
+def test_repeated_expressions_hit_the_cache():
+    evaluate("12*12")
+    evaluate("12 * 12")
+    assert calculator._evaluate_cached.cache_info().hits == 1
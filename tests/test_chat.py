@@ -0,0 +1,36 @@
+import generation
+
+
+class EchoNameBackend(generation.GenerationBackend):
+    """Responde con el nombre si aparece en el prompt (historial o memoria)."""
+
+    name = "echo-name"
+
+    async def stream(self, prompt: str):
+        yield "Te llamas Ana" if "me llamo Ana" in prompt.split("Usuario: cómo me llamo")[0] else "No sé tu nombre"
+
+
+def test_personalized_reply_is_not_shared_between_conversations(app_client, monkeypatch):
+    monkeypatch.setattr(generation, "generation_backend", EchoNameBackend())
+
+    first = app_client.post("/api/chat", json={"message": "me llamo Ana"}).json()
+    conversation_a = first["conversation_id"]
+    reply_a = app_client.post("/api/chat", json={"message": "cómo me llamo", "conversation_id": conversation_a}).json()
+    assert reply_a["generated_text"] == "Te llamas Ana"
+
+    reply_b = app_client.post("/api/chat", json={"message": "cómo me llamo"}).json()
+    assert reply_b["conversation_id"] != conversation_a
+    assert reply_b["generated_text"] == "No sé tu nombre"
+
+    stream_b = app_client.post("/api/chat/stream", json={"message": "cómo me llamo"}).text
+    assert "Te llamas Ana" not in stream_b
+
+
+def test_reply_without_context_is_cached(app_client, monkeypatch):
+    monkeypatch.setattr(generation, "generation_backend", EchoNameBackend())
+    from cache import response_cache
+
+    app_client.post("/api/chat", json={"message": "cuéntame algo"})
+    hits = response_cache.exact_hits
+    app_client.post("/api/chat", json={"message": "cuéntame algo"})
+    assert response_cache.exact_hits == hits + 1
@@ -0,0 +1,29 @@
+import asyncio
+import importlib
+
+import pytest
+
+import generation
+
+
+@pytest.fixture
+def bad_backend_env(monkeypatch):
+    monkeypatch.setenv("GENERATION_BACKEND", "gemini")
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    yield
+    monkeypatch.undo()
+    importlib.reload(generation)
+
+
+def test_bad_backend_config_fails_on_first_use_not_on_import(bad_backend_env):
+    importlib.reload(generation)
+    assert generation.generation_backend is None
+    with pytest.raises(ValueError):
+        generation.get_backend()
+
+
+def test_stub_backend_is_created_on_first_reply(monkeypatch):
+    monkeypatch.setattr(generation, "generation_backend", None)
+    reply = asyncio.run(generation.generate_reply("hola"))
+    assert reply.text == generation.FALLBACK_REPLY
+    assert isinstance(generation.generation_backend, generation.StubBackend)
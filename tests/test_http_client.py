@@ -0,0 +1,101 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import http_client as http_client_module
+from http_client import HTTPClient, ToolConfig, UpstreamError
+
+
+@pytest.fixture(autouse=True)
+def _routes(stub_server):
+    stub_server.routes.update({
+        "/slow": (200, "application/json", {"path": "/slow"}, 0.3),
+        "/hang": (200, "application/json", {"path": "/hang"}, 2),
+        "/html-error": (502, "text/html", b"<html><body>Bad gateway</body></html>", 0),
+        "/json-error": (404, "application/json", {"message": "city not found"}, 0),
+    })
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(http_client_module.TOOL_CONFIG, "stub", ToolConfig(connect_timeout=1.0, read_timeout=1.0, ttl=60))
+    monkeypatch.setitem(http_client_module.TOOL_CONFIG, "nocache", ToolConfig(connect_timeout=1.0, read_timeout=1.0, ttl=0))
+    client = HTTPClient()
+    yield client
+    client.close()
+
+
+def test_responses_are_cached_per_key(stub_server, client):
+    assert client.get_json("stub", stub_server.url("/ok"), cache_key="bogota") == {"path": "/ok"}
+    assert client.get_json("stub", stub_server.url("/ok"), cache_key="bogota") == {"path": "/ok"}
+    assert stub_server.hits["/ok"] == 1
+    client.get_json("stub", stub_server.url("/ok"), cache_key="medellin")
+    assert stub_server.hits["/ok"] == 2
+
+
+def test_no_cache_when_ttl_is_zero(stub_server, client):
+    client.get_json("nocache", stub_server.url("/ok"))
+    client.get_json("nocache", stub_server.url("/ok"))
+    assert stub_server.hits["/ok"] == 2
+
+
+def test_concurrent_identical_requests_are_coalesced(stub_server, client):
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(lambda _: client.get_json("nocache", stub_server.url("/slow"), cache_key="k"), range(10)))
+    assert results == [{"path": "/slow"}] * 10
+    assert stub_server.hits["/slow"] == 1
+    assert client.coalesced == 9
+
+
+def test_html_error_page_raises_upstream_error(stub_server, client):
+    with pytest.raises(UpstreamError) as excinfo:
+        client.get_json("stub", stub_server.url("/html-error"))
+    assert excinfo.value.status_code == 502
+    assert excinfo.value.payload is None
+
+
+def test_json_error_keeps_the_payload(stub_server, client):
+    with pytest.raises(UpstreamError) as excinfo:
+        client.get_json("stub", stub_server.url("/json-error"))
+    assert excinfo.value.status_code == 404
+    assert excinfo.value.payload == {"message": "city not found"}
+
+
+def test_errors_are_not_cached(stub_server, client):
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            client.get_json("stub", stub_server.url("/html-error"), cache_key="x")
+    assert stub_server.hits["/html-error"] == 2
+
+
+def test_read_timeout(stub_server, client, monkeypatch):
+    import requests
+
+    monkeypatch.setitem(http_client_module.TOOL_CONFIG, "fast", ToolConfig(connect_timeout=1.0, read_timeout=0.2, ttl=0))
+    started = time.perf_counter()
+    with pytest.raises(requests.Timeout):
+        client.get_json("fast", stub_server.url("/hang"))
+    assert time.perf_counter() - started < 1.5
+
+
+def test_async_cache_coalescing_and_errors(stub_server, client):
+    pytest.importorskip("httpx")
+
+    async def scenario():
+        try:
+            results = await asyncio.gather(*(
+                client.aget_json("stub", stub_server.url("/slow"), cache_key="bogota") for _ in range(10)
+            ))
+            cached = await client.aget_json("stub", stub_server.url("/slow"), cache_key="bogota")
+            with pytest.raises(UpstreamError):
+                await client.aget_json("stub", stub_server.url("/html-error"))
+            return results, cached
+        finally:
+            await client.aclose()
+
+    results, cached = asyncio.run(scenario())
+    assert results == [{"path": "/slow"}] * 10
+    assert cached == {"path": "/slow"}
+    assert stub_server.hits["/slow"] == 1
@@ -0,0 +1,54 @@
+import pytest
+
+from intents import UNKNOWN_INTENT, match_intent, predict_intent, predict_intents
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("¿QUÉ HORA ES?", "hora"),
+    ("que hora es", "hora"),
+    ("ÉPALE mi pana", "saludo"),
+    ("Cuanto es 8 por 8", "matematica"),
+    ("Cómo está el CLIMA en Bogotá", "clima"),
+])
+def test_accents_and_case_are_folded(text, intent):
+    assert predict_intent(text) == intent
+
+
+def test_span_points_at_the_original_text():
+    text = "Oye, ¿Qué HORA es?"
+    match = match_intent(text)
+    assert match.name == "hora"
+    assert text[slice(*match.span)] == "Qué HORA es"
+    assert match.example == "qué hora es"
+    assert 0 < match.score < 1
+
+
+@pytest.mark.parametrize("text", ["Holanda es bonita", "el partido quedó consumado", "chaos"])
+def test_examples_only_match_whole_words(text):
+    match = match_intent(text)
+    assert match.name == UNKNOWN_INTENT
+    assert match.span is None and match.score == 0.0
+
+
+def test_whole_word_at_the_edges_of_the_text():
+    assert match_intent("hola!").span == (0, 4)
+    assert match_intent("bueno, chao").span == (7, 11)
+
+
+def test_first_intent_in_the_list_wins():
+    # "hola" (saludo) va antes que "qué hora es" (hora) en INTENTS
+    assert predict_intent("hola, ¿qué hora es?") == "saludo"
+    assert predict_intent("qué hora es? chao") == "despedida"
+
+
+def test_longest_example_wins_within_an_intent():
+    match = match_intent("muchas gracias, parce")
+    assert match.name == "agradecimiento"
+    assert match.example == "muchas gracias"
+    assert match.span == (0, 14)
+
+
+def test_predict_intents_keeps_the_order():
+    texts = ["hola", "", "cuánto es 2 más 2", "xyz", "chao"]
+    assert predict_intents(texts) == ["saludo", UNKNOWN_INTENT, "matematica", UNKNOWN_INTENT, "despedida"]
+    assert predict_intents([]) == []
@@ -0,0 +1,87 @@
+import uuid
+from concurrent.futures import Future
+
+import pytest
+
+import crud
+from cache import conversation_cache
+from journal import ASYNC, GROUP, MessageJournal
+from memory import conversation_memory
+
+
+class FakeSession:
+    """Sesión mínima: guarda lo escrito al hacer commit."""
+
+    def __init__(self, store):
+        self.store = store
+        self.staged = []
+
+    def commit(self):
+        self.store.extend(self.staged)
+
+    def rollback(self):
+        self.staged = []
+
+    def close(self):
+        pass
+
+
+def failing_writer(db, rows):
+    if any(row["content"] == "malo" for row in rows):
+        raise ValueError("fila inválida")
+    db.staged.extend(rows)
+
+
+def make_journal(store, durability=ASYNC, **kwargs):
+    return MessageJournal(lambda: FakeSession(store), failing_writer, durability=durability, **kwargs)
+
+
+def turn(content):
+    return [{"id": uuid.uuid4(), "content": content}]
+
+
+def test_bad_turn_does_not_roll_back_the_rest_of_the_batch():
+    store = []
+    journal = make_journal(store)
+    good_first = journal.append(turn("hola"))
+    bad = journal.append(turn("malo"))
+    good_last = journal.append(turn("adiós"))
+    journal.flush()
+
+    assert [row["content"] for row in store] == ["hola", "adiós"]
+    assert good_first.result() == 1 and good_last.result() == 1
+    assert isinstance(bad.exception(), ValueError)
+    stats = journal.stats()
+    assert stats["retried_batches"] == 1
+    assert stats["failed_rows"] == 1
+    assert stats["flushed_rows"] == 2
+
+
+def test_group_wait_times_out_instead_of_hanging():
+    journal = make_journal([], durability=GROUP, group_timeout=0.05)
+    assert journal.wait(Future()) is False
+    assert journal.stats()["group_timeouts"] == 1
+
+
+def test_group_wait_raises_the_write_error():
+    journal = make_journal([], durability=GROUP)
+    pending = journal.append(turn("malo"))
+    journal.flush()
+    with pytest.raises(ValueError):
+        journal.wait(pending)
+
+
+@pytest.mark.parametrize("fail_before_finish", [False, True])
+def test_lost_async_turn_is_dropped_from_cache_and_memory(fail_before_finish):
+    conversation_pk = uuid.uuid4()
+    prepared = crud.PreparedTurn(conversation_pk, str(uuid.uuid4()), True, [])
+    pending = Future()
+    if fail_before_finish:
+        pending.set_exception(ValueError("fila inválida"))
+    crud.finish_turn(prepared, pending)
+    if not fail_before_finish:
+        assert conversation_cache.get_tail(conversation_pk, 10) is not None
+        pending.set_exception(ValueError("fila inválida"))
+
+    assert conversation_cache.get_tail(conversation_pk, 10) is None
+    assert conversation_memory.indexes.peek(conversation_pk) is None
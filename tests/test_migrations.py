@@ -0,0 +1,124 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import migrations
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    yield engine
+    engine.dispose()
+
+
+def version(engine) -> int:
+    with engine.connect() as conn:
+        return migrations.current_version(conn)
+
+
+def indexes(engine, table: str) -> dict:
+    return {index["name"]: index for index in inspect(engine).get_indexes(table)}
+
+
+def assert_head_schema(engine):
+    assert version(engine) == migrations.HEAD
+    message_indexes = indexes(engine, "messages")
+    assert message_indexes["ix_messages_conversation_id_timestamp_id"]["column_names"] == ["conversation_id", "timestamp", "id"]
+    assert message_indexes["ix_messages_timestamp_id"]["column_names"] == ["timestamp", "id"]
+    assert "ix_messages_conversation_id_timestamp" not in message_indexes
+    assert indexes(engine, "conversations")["ix_conversations_conversation_id"]["unique"]
+    assert {"archived_conversations", "archive_chunks"} <= set(inspect(engine).get_table_names())
+    assert "served_from_cache" in {column["name"] for column in inspect(engine).get_columns("messages")}
+
+
+def test_upgrade_empty_database(engine):
+    assert version(engine) == 0
+    assert migrations.upgrade(engine) == migrations.HEAD
+    assert_head_schema(engine)
+    with engine.connect() as conn:
+        applied = [row.version for row in conn.execute(text("SELECT version FROM schema_version ORDER BY version"))]
+    assert applied == [migration.version for migration in migrations.MIGRATIONS]
+
+    # Idempotente: una segunda corrida no aplica nada
+    assert migrations.upgrade(engine) == migrations.HEAD
+    migrations.ensure_schema(engine, auto_upgrade=False)
+
+
+def test_upgrade_database_created_by_the_original_models(engine):
+    conversation_pk = uuid.uuid4()
+    conversations, messages = migrations._v1_tables()
+    with engine.begin() as conn:
+        conversations.metadata.create_all(conn)
+        conn.execute(conversations.insert().values(id=conversation_pk, conversation_id=None, created_at=datetime(2025, 1, 1)))
+        conn.execute(messages.insert().values(
+            id=uuid.uuid4(), conversation_id=conversation_pk, sender="user", content="hola",
+            handled_by_gemini=False, timestamp=datetime(2025, 1, 1),
+        ))
+
+    migrations.upgrade(engine)
+
+    assert_head_schema(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM conversations WHERE conversation_id IS NULL")).scalar() == 0
+        assert conn.execute(text("SELECT sender, content, served_from_cache FROM messages")).one() == ("user", "hola", 0)
+
+
+def test_upgrade_database_created_by_the_old_setup_script(engine):
+    # Forma de la tabla messages que creaba setup_db.py (id serial, role, created_at)
+    conversation_id = str(uuid.uuid4())
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE conversations (id CHAR(32) PRIMARY KEY, conversation_id VARCHAR UNIQUE, created_at DATETIME)"))
+        conn.execute(text(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "conversation_id VARCHAR REFERENCES conversations (conversation_id), "
+            "role VARCHAR(50), content TEXT, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO conversations VALUES (:id, :cid, '2025-01-01 00:00:00.000000')"),
+                     {"id": uuid.uuid4().hex, "cid": conversation_id})
+        for role, content in (("user", "hola"), ("bot", "¡Épale!")):
+            conn.execute(text("INSERT INTO messages (conversation_id, role, content, created_at) "
+                              "VALUES (:cid, :role, :content, '2025-01-01 00:00:00.000000')"),
+                         {"cid": conversation_id, "role": role, "content": content})
+
+    migrations.upgrade(engine)
+
+    assert_head_schema(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM messages_legacy")).scalar() == 2
+        copied = conn.execute(text(
+            "SELECT m.sender, m.content, m.timestamp FROM messages m "
+            "JOIN conversations c ON c.id = m.conversation_id WHERE c.conversation_id = :cid ORDER BY m.sender DESC"
+        ), {"cid": conversation_id}).all()
+    assert [(sender, content) for sender, content, _ in copied] == [("user", "hola"), ("bot", "¡Épale!")]
+    assert all(timestamp.startswith("2025-01-01") for _, _, timestamp in copied)
+
+
+def test_failed_migration_is_not_recorded_and_the_next_upgrade_resumes(engine, monkeypatch):
+    def fail(conn):
+        raise RuntimeError("se cayó la conexión")
+
+    failing = [m._replace(apply=fail) if m.version == 7 else m for m in migrations.MIGRATIONS]
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, "MIGRATIONS", failing)
+        with pytest.raises(RuntimeError):
+            migrations.upgrade(engine)
+    assert version(engine) == 6
+
+    assert migrations.upgrade(engine) == migrations.HEAD
+    assert_head_schema(engine)
+
+
+def test_ensure_schema_checks_the_version(engine):
+    with pytest.raises(RuntimeError, match="migrations.py upgrade"):
+        migrations.ensure_schema(engine, auto_upgrade=False)
+    migrations.ensure_schema(engine, auto_upgrade=True)
+    assert version(engine) == migrations.HEAD
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO schema_version (version, description) VALUES (:v, 'futura')"),
+                     {"v": migrations.HEAD + 1})
+    with pytest.raises(RuntimeError, match="más nuevo"):
+        migrations.ensure_schema(engine)
@@ -0,0 +1,102 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tools
+from http_client import http_client
+from scheduler import CircuitOpen, ToolNotFound, build_default_scheduler
+
+WEATHER = {"name": "Bogotá", "main": {"temp": 14}, "weather": [{"description": "nublado"}]}
+
+
+@pytest.fixture
+def weather_stub(stub_server, monkeypatch):
+    stub_server.routes["/weather"] = (200, "application/json", WEATHER, 0.3)
+    monkeypatch.setattr(tools, "OPENWEATHER_URL", stub_server.url("/weather"))
+    monkeypatch.setenv("OPENWEATHER_API_KEY", "test")
+    http_client.cache.clear()
+    yield stub_server
+    http_client.cache.clear()
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = build_default_scheduler()
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_concurrent_identical_weather_requests_are_not_rejected(weather_stub, scheduler):
+    # 12 > max_concurrency de clima (8): las que llegan con la llamada en vuelo no gastan cupo
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        results = list(pool.map(lambda _: scheduler.call("clima", "Bogotá"), range(12)))
+    assert all(result.get("city") == "Bogotá" for result in results)
+    assert weather_stub.hits["/weather"] == 1
+    assert scheduler.stats()["clima"]["rejected"] == 0
+
+
+def test_concurrent_identical_weather_requests_async(weather_stub, scheduler):
+    async def scenario():
+        try:
+            return await asyncio.gather(*(scheduler.acall("clima", "Bogotá") for _ in range(12)))
+        finally:
+            await http_client.aclose()
+
+    results = asyncio.run(scenario())
+    assert all(result.get("city") == "Bogotá" for result in results)
+    assert weather_stub.hits["/weather"] == 1
+    assert scheduler.stats()["clima"]["rejected"] == 0
+
+
+def test_cached_weather_does_not_take_a_slot(weather_stub, scheduler):
+    scheduler.call("clima", "Bogotá")
+    spec = scheduler.tools["clima"]
+    for _ in range(8):
+        spec.semaphore.acquire()
+    try:
+        assert scheduler.call("clima", "Bogotá")["city"] == "Bogotá"
+    finally:
+        for _ in range(8):
+            spec.semaphore.release()
+
+
+def test_call_many_unknown_tool_returns_an_error(weather_stub, scheduler):
+    results = scheduler.call_many([("clima", ("Bogotá",)), ("no_existe", ())])
+    assert results[0]["city"] == "Bogotá"
+    assert isinstance(results[1], ToolNotFound)
+
+
+def test_call_many_only_unknown_tools(scheduler):
+    results = scheduler.call_many([("no_existe", ())])
+    assert isinstance(results[0], ToolNotFound)
+
+
+def test_cached_hits_do_not_close_the_breaker(weather_stub, scheduler):
+    scheduler.call("clima", "Bogotá")  # queda en la caché HTTP
+    weather_stub.routes["/weather"] = (500, "application/json", {"message": "caído"}, 0)
+    for attempt in range(10):
+        try:
+            scheduler.call("clima", f"Ciudad {attempt}")
+        except CircuitOpen:
+            pass
+        assert scheduler.call("clima", "Bogotá")["city"] == "Bogotá"
+    assert scheduler.stats()["clima"]["breaker"] == "open"
+
+
+def test_cached_hits_do_not_close_the_breaker_async(weather_stub, scheduler):
+    async def scenario():
+        try:
+            await scheduler.acall("clima", "Bogotá")
+            weather_stub.routes["/weather"] = (500, "application/json", {"message": "caído"}, 0)
+            for attempt in range(10):
+                try:
+                    await scheduler.acall("clima", f"Ciudad {attempt}")
+                except CircuitOpen:
+                    pass
+                assert (await scheduler.acall("clima", "Bogotá"))["city"] == "Bogotá"
+        finally:
+            await http_client.aclose()
+
+    asyncio.run(scenario())
+    assert scheduler.stats()["clima"]["breaker"] == "open"
@@ -1,35 +1,77 @@
 # tools.py - Funciones utilitarias para Fulano AI
 
 import os
-import requests
-from datetime import datetime
-import pytz
-import re
 from datetime import datetime
+from functools import lru_cache
 import pytz
+import calculator
+from intents import normalize_text
+from http_client import http_client, UpstreamError
+
+# URLs base (se pueden apuntar a un servidor local para pruebas)
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "http://api.openweathermap.org/data/2.5/weather")
+GNEWS_URL = os.getenv("GNEWS_URL", "https://gnews.io/api/v4/top-headlines")
+TRANSLATE_URL = os.getenv("TRANSLATE_URL", "https://translate.googleapis.com/translate_a/single")
+POKEAPI_URL = os.getenv("POKEAPI_URL", "https://pokeapi.co/api/v2/pokemon")
+EXCHANGE_RATE_URL = os.getenv("EXCHANGE_RATE_URL", "https://api.exchangerate.host/latest")
+
+
+def _upstream_message(error: UpstreamError, default: str) -> str:
+    if isinstance(error.payload, dict):
+        return error.payload.get("message", default)
+    return default
+
 # ==========================
 # Herramientas básicas
 # ==========================
 
 
+def weather_cache_key(city: str) -> str:
+    return city.strip().lower()
+
+
+def _weather_params(city: str, api_key: str) -> dict:
+    return {"q": city, "appid": api_key, "lang": "es", "units": "metric"}
+
+
+def _weather_result(response: dict) -> dict:
+    return {
+        "city": response["name"],
+        "temperature": f"{response['main']['temp']} °C",
+        "description": response["weather"][0]["description"]
+    }
+
+
 def get_weather(city: str = "Bogotá"):
     """Consulta el clima actual usando la API de OpenWeatherMap"""
     api_key = os.getenv("OPENWEATHER_API_KEY")
     if not api_key:
         return {"error": "Falta la API key de OpenWeather"}
-    
-    url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&lang=es&units=metric"
 
     try:
-        response = requests.get(url).json()
-        if response.get("cod") != 200:
-            return {"error": response.get("message", "No se pudo obtener el clima")}
-        
-        return {
-            "city": response["name"],
-            "temperature": f"{response['main']['temp']} °C",
-            "description": response["weather"][0]["description"]
-        }
+        response = http_client.get_json(
+            "weather", OPENWEATHER_URL, params=_weather_params(city, api_key), cache_key=weather_cache_key(city)
+        )
+        return _weather_result(response)
+    except UpstreamError as e:
+        return {"error": _upstream_message(e, "No se pudo obtener el clima")}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def aget_weather(city: str = "Bogotá"):
+    """Igual que get_weather, con el cliente async (no ocupa un hilo mientras espera)."""
+    api_key = os.getenv("OPENWEATHER_API_KEY")
+    if not api_key:
+        return {"error": "Falta la API key de OpenWeather"}
+
+    try:
+        response = await http_client.aget_json(
+            "weather", OPENWEATHER_URL, params=_weather_params(city, api_key), cache_key=weather_cache_key(city)
+        )
+        return _weather_result(response)
+    except UpstreamError as e:
+        return {"error": _upstream_message(e, "No se pudo obtener el clima")}
     except Exception as e:
         return {"error": str(e)}
 
@@ -39,15 +81,17 @@ def get_news(country: str = "co", lang: str = "es"):
     if not api_key:
         return {"error": "Falta la API key de GNews"}
 
-    url = f"https://gnews.io/api/v4/top-headlines?country={country}&lang={lang}&token={api_key}"
+    params = {"country": country, "lang": lang, "token": api_key}
     try:
-        response = requests.get(url).json()
+        response = http_client.get_json("news", GNEWS_URL, params=params, cache_key=(country, lang))
         if "articles" not in response:
             return {"error": response.get("message", "No se pudo obtener noticias")}
         
         articles = response["articles"]
         top_news = [f"{a['title']} - {a['source']['name']}" for a in articles[:5]]
         return {"news": top_news}
+    except UpstreamError as e:
+        return {"error": _upstream_message(e, "No se pudo obtener noticias")}
     except Exception as e:
         return {"error": str(e)}
 
@@ -59,32 +103,40 @@ def google_search(query: str):
 def translate_text(text: str, target_lang: str = "en"):
     """Traducción usando Google Translate API (Traduce con 'translate.googleapis.com')"""
     try:
-        url = f"https://translate.googleapis.com/translate_a/single?client=gtx&sl=auto&tl={target_lang}&dt=t&q={text}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            translated_text = response.json()[0][0][0]
-            return {"translated_text": translated_text}
+        params = {"client": "gtx", "sl": "auto", "tl": target_lang, "dt": "t", "q": text}
+        response = http_client.get_json("translate", TRANSLATE_URL, params=params, cache_key=(target_lang, text))
+        translated_text = response[0][0][0]
+        return {"translated_text": translated_text}
+    except UpstreamError:
         return {"error": "No pude traducir el texto."}
     except Exception as e:
         return {"error": str(e)}
 
-def calculate(expression: str):
-    """Evalúa expresiones matemáticas simples"""
-    try:
-        result = eval(expression, {"__builtins__": {}})
-        return result
-    except Exception:
-        return "No pude calcular eso, mi pana."
+def rerank_documents(query: str, documents: list, top_k: int = None):
+    """
+    Ordena los documentos por relevancia BM25 frente a la consulta (los que no
+    comparten ningún término quedan al final, en su orden original).
+    El índice de un mismo conjunto de documentos se reutiliza entre llamadas.
+    """
+    if not documents:
+        return {"reranked": []}
+    index = _bm25_index(tuple(documents))
+    hits = index.search(query, k=top_k or len(documents), include_zero=True)
+    return {"reranked": [hit.document for hit in hits]}
 
-def rerank_documents(query: str, documents: list):
-    """Simulación de rerankeo de documentos"""
-    return {"reranked": sorted(documents, key=lambda x: len(x))}
+
+@lru_cache(maxsize=16)
+def _bm25_index(documents: tuple):
+    # NumPy solo se importa cuando alguien rerankea, no al arrancar la app
+    from bm25 import BM25Index
+
+    return BM25Index(documents)
 
 def get_pokemon_info(name: str):
     """Ejemplo de integración con la API de Pokémon"""
-    url = f"https://pokeapi.co/api/v2/pokemon/{name.lower()}"
+    name = name.strip().lower()
     try:
-        response = requests.get(url).json()
+        response = http_client.get_json("pokemon", f"{POKEAPI_URL}/{name}", cache_key=name)
         return {
             "name": response["name"],
             "height": response["height"],
@@ -108,42 +160,51 @@ def search_wikipedia(query: str):
 
 def get_exchange_rate(base: str = "USD", target: str = "COP"):
     """Obtiene tasa de cambio usando exchangerate.host"""
-    url = f"https://api.exchangerate.host/latest?base={base}&symbols={target}"
+    base, target = base.upper(), target.upper()
     try:
-        response = requests.get(url).json()
+        response = http_client.get_json(
+            "exchange_rate", EXCHANGE_RATE_URL, params={"base": base, "symbols": target}, cache_key=(base, target)
+        )
         rate = response["rates"][target]
         return {"rate": rate}
     except Exception:
         return {"error": "No pude obtener la tasa de cambio."}
 
+CIUDADES = ["bogotá", "medellín", "cali", "barranquilla", "caracas", "maracaibo"]
+
+
 def extract_city(text: str):
     """Extrae una ciudad básica del texto (rudimentario)"""
-    ciudades = ["bogotá", "medellín", "cali", "barranquilla", "caracas", "maracaibo"]
-    for ciudad in ciudades:
-        if ciudad in text.lower():
-            return ciudad
-    return "Bogotá"
+    ciudades = extract_cities(text)
+    return ciudades[0] if ciudades else "Bogotá"
+
+
+def extract_cities(text: str):
+    """Todas las ciudades conocidas mencionadas en el texto, en orden de aparición"""
+    texto = normalize_text(text)
+    encontradas = []
+    for ciudad in CIUDADES:
+        posicion = texto.find(normalize_text(ciudad))
+        if posicion >= 0:
+            encontradas.append((posicion, ciudad))
+    return [ciudad for _, ciudad in sorted(encontradas)]
+
+
 # ==========================
 # Herramienta: Calcular operaciones matemáticas
 # ==========================
 def calculate(expression: str):
     """
-    Evalúa operaciones matemáticas básicas desde el texto del usuario.
+    Evalúa operaciones matemáticas básicas desde el texto del usuario, sin eval
+    (ver calculator.py).
     Ejemplo:
         "8 * 8" -> 64
-        "100 / 5" -> 20
+        "cuánto es 100 entre 5" -> 20
     """
     try:
-        # Extraer solo números y operadores permitidos
-        match = re.findall(r"[0-9\.\+\-\*\/\(\)]+", expression)
-        safe_expression = "".join(match)
-        if not safe_expression:
-            return "Expresión inválida."
-
-        result = eval(safe_expression)
-        return result
-    except Exception:
-        return "No pude calcular eso."
+        return calculator.evaluate(calculator.extract_expression(expression))
+    except calculator.CalculationError as e:
+        return f"No pude calcular eso: {e}"
 
 
 # ==========================